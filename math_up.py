@@ -9,6 +9,18 @@
 #
 # OK then, test yourself, enjoy your math!
 
+import array
+import concurrent.futures
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+import weakref
 
 
 TYPE_VARIABLE = 0
@@ -39,9 +51,496 @@ REPLACE = 23
 AXIOM = 24
 LET = 30
 GENERALIZE = 31
+CONGRUENCE = 41
+AUTO_TAUTOLOGY = 42
+EQUIVALENCE = 43
+INSTANTIATE = 44
+UNFOLD = 45
+FOLD = 46
+REPLACE_AT = 47
 
 callbacks = {}
-proof_history = {}
+equivalence_relations = {} # name -> the names of its reflection, symmetry and transitivity, by register_equivalence
+
+# the keys of the arguments in the sorted order, as they are hashed into the digests
+digest_keys = {
+    TYPE_FUNCTION : ["children", "name"],
+    TYPE_PROPERTY : ["children", "name"],
+    TYPE_ALL : ["bound", "statement"],
+    TYPE_EXIST : ["bound", "statement"],
+    TYPE_UNIQUELY_EXIST : ["bound", "statement"],
+    TYPE_NOT : ["body"],
+    TYPE_AND : ["left", "right"],
+    TYPE_OR : ["left", "right"],
+    TYPE_IMPLY : ["assumption", "conclusion"],
+    TYPE_IFF : ["left", "right"],
+    TYPE_TRUE : [],
+    TYPE_FALSE : [],
+}
+digest_labels = {key : key.encode() + b":" for keys in digest_keys.values() for key in keys} # key -> the bytes it is hashed as
+digest_names = {} # string name -> the bytes it is hashed as
+
+# the proved sentences, by their numbers or names, loading the missing names from the attached store
+class History(dict):
+    store = None
+
+    def __init__(self):
+        dict.__init__(self)
+        self.citations = set()
+        self.dependencies = {} # name -> names cited in its proof
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            self.citations.add(key)
+        return dict.__getitem__(self, key)
+
+    # the cached instances of a name are dropped with its theorem
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            instance_cache.invalidate(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if isinstance(key, str):
+            instance_cache.invalidate(key)
+        dict.__delitem__(self, key)
+
+    def __missing__(self, key):
+        if isinstance(key, str) and History.store != None:
+            theorem = History.store.load(key)
+            if theorem != None:
+                return theorem
+        raise KeyError(key)
+
+proof_history = History()
+
+# union-find over terms by their digests, with the reasons of the unions for explain()
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+        self.edge = {} # proof forest : term -> (neighbor, reason)
+
+    def find(self, term):
+        root = term
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while term != root:
+            parent = self.parent[term]
+            self.parent[term] = root
+            term = parent
+        return root
+
+    # reverse the proof forest edges, so that the term becomes the root of its proof tree
+    def reroot(self, term):
+        previous = None
+        cursor = term
+        while cursor != None:
+            edge = self.edge.pop(cursor, None)
+            if previous != None:
+                self.edge[cursor] = previous
+            if edge == None:
+                break
+            previous = (cursor, edge[1])
+            cursor = edge[0]
+
+    def union(self, A, B, reason):
+        root_A = self.find(A)
+        root_B = self.find(B)
+        if root_A == root_B:
+            return False
+        self.reroot(A)
+        self.edge[A] = (B, reason)
+        if self.size.get(root_A, 1) > self.size.get(root_B, 1):
+            root_A, root_B = root_B, root_A
+        self.parent[root_A] = root_B
+        self.size[root_B] = self.size.get(root_A, 1) + self.size.get(root_B, 1)
+        return True
+
+    # the reasons on the path between A and B, or None if they are not connected
+    def explain(self, A, B):
+        if self.find(A) != self.find(B):
+            return None
+        ancestors = {}
+        cursor = A
+        reasons = []
+        while True:
+            ancestors[cursor] = len(reasons)
+            edge = self.edge.get(cursor)
+            if edge == None:
+                break
+            reasons.append(edge[1])
+            cursor = edge[0]
+        path = []
+        cursor = B
+        while ancestors.get(cursor) == None:
+            edge = self.edge[cursor]
+            path.append(edge[1])
+            cursor = edge[0]
+        return reasons[ : ancestors[cursor]] + list(reversed(path))
+
+# congruence closure over the proved equalities, undone on the trail as their scopes close
+# a quantifier binding a variable of an equality is congruent only to itself, e.g. All(a, a == a) and All(a, a == b) under a == b
+class CongruenceClosure:
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+        self.terms = {}
+        self.uses = {}
+        self.signatures = {}
+        self.equated = {} # counter -> True, for the variables free in the equalities
+        self.trail = []
+        self.equalities = [] # (equality, branch, length of the trail before it)
+        self.ground = 0 # the first equalities of the ground level, which are never undone
+
+    def set(self, table, key, value):
+        self.trail.append((table, key, table.get(key)))
+        table[key] = value
+
+    def append(self, uses, key):
+        self.trail.append((uses, ))
+        uses.append(key)
+
+    def undo(self, mark):
+        while len(self.trail) > mark:
+            entry = self.trail.pop()
+            if len(entry) == 1:
+                entry[0].pop()
+            else:
+                table, key, value = entry
+                if value == None:
+                    del table[key]
+                else:
+                    table[key] = value
+
+    # no path compression, to keep the trail short
+    # union by size keeps the trees shallow anyway
+    def find(self, key):
+        while self.parent[key] != key:
+            key = self.parent[key]
+        return key
+
+    def signature(self, term):
+        if term.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST] and self.equated.get(term.bound.counter) != None:
+            return (term.type_, term.digest)
+        signature = [term.type_]
+        for key, value in sorted(term.arguments.items(), key = (lambda item : item[0])):
+            signature.append(key)
+            if isinstance(value, list):
+                signature.append(tuple([self.find(element.digest) for element in value]))
+            elif isinstance(value, Node):
+                signature.append(self.find(value.digest))
+            else:
+                signature.append(value)
+        return tuple(signature)
+
+    def add(self, term):
+        stack = [(term, False)]
+        while len(stack) > 0:
+            term, walked = stack.pop()
+            key = term.digest
+            if not walked and self.parent.get(key) != None:
+                continue
+            subnodes = [] if term.type_ == TYPE_VARIABLE else term.subnodes()
+            if not walked and len(subnodes) > 0:
+                stack.append((term, True))
+                stack += [(subnode, False) for subnode in subnodes]
+                continue
+            self.set(self.parent, key, key)
+            self.set(self.size, key, 1)
+            self.set(self.terms, key, term)
+            self.set(self.uses, key, [])
+            if len(subnodes) > 0:
+                for subnode in set([self.find(subnode.digest) for subnode in subnodes]):
+                    self.append(self.uses[subnode], key)
+                signature = self.signature(term)
+                other = self.signatures.get(signature)
+                if other == None:
+                    self.set(self.signatures, signature, key)
+                else:
+                    self.merge(key, other)
+        return key
+
+    def merge(self, A, B):
+        pending = [(A, B)]
+        while len(pending) > 0:
+            A, B = pending.pop()
+            A = self.find(A)
+            B = self.find(B)
+            if A == B:
+                continue
+            if self.size[A] > self.size[B]:
+                A, B = B, A
+            self.set(self.parent, A, B)
+            self.set(self.size, B, self.size[A] + self.size[B])
+            for use in self.uses[A]:
+                signature = self.signature(self.terms[use])
+                other = self.signatures.get(signature)
+                if other == None:
+                    self.set(self.signatures, signature, use)
+                elif self.find(other) != self.find(use):
+                    pending.append((use, other))
+                self.append(self.uses[B], use)
+
+    def assume(self, equality, branch):
+        if len(branch) <= 1 and self.ground == len(self.equalities):
+            self.ground += 1
+        self.equalities.append((equality, branch, len(self.trail)))
+        for counter in equality.free:
+            if self.equated.get(counter) == None:
+                self.set(self.equated, counter, True)
+        self.merge(self.add(equality.children[0]), self.add(equality.children[1]))
+
+    # undo the equalities out of scope, and replay the later ones still in scope
+    def synchronize(self):
+        for index in range(self.ground, len(self.equalities)):
+            if not Node.in_scope(self.equalities[index][1]):
+                replay = self.equalities[index + 1 : ]
+                self.undo(self.equalities[index][2])
+                del self.equalities[index : ]
+                for equality, branch, mark in replay:
+                    if Node.in_scope(branch):
+                        self.assume(equality, branch)
+                return
+
+    def congruent(self, A, B):
+        self.synchronize()
+        return self.find(self.add(A)) == self.find(self.add(B))
+
+# the proved sentences by the atoms of their logical forms,
+# to select the reasons of AUTO_TAUTOLOGY
+class PremiseIndex:
+    def __init__(self):
+        self.facts = {} # digest of an atom -> sentences having the atom
+        self.atoms = {} # id of a sentence -> digests of its atoms
+        self.constants = [] # sentences without atoms, like false
+        self.pending = [] # sentences not indexed yet
+
+    # the sentences are indexed only when the index is used
+    def add(self, fact):
+        self.pending.append(fact)
+
+    def update(self):
+        for fact in self.pending:
+            if not fact.is_proved():
+                continue
+            atoms = [atom.digest for atom in fact.atoms()]
+            self.atoms[id(fact)] = atoms
+            if len(atoms) == 0:
+                self.constants.append(fact)
+            for atom in atoms:
+                if self.facts.get(atom) == None:
+                    self.facts[atom] = []
+                self.facts[atom].append(fact)
+        self.pending = []
+
+    # a sentence out of scope never comes back, so it is dropped for good
+    def prune(self, facts):
+        alive = [fact for fact in facts if fact.is_proved()]
+        for fact in facts:
+            if not fact.is_proved():
+                self.atoms.pop(id(fact), None)
+        facts[:] = alive
+        return alive
+
+    # the sentences in scope, layer by layer, each sharing an atom with the target or the former layers
+    # a target without atoms, like false, starts from the last sentence and the innermost assumption
+    def layers(self, target):
+        self.update()
+        selected = set()
+        seen = set()
+        frontier = [atom.digest for atom in target.atoms()]
+        if len(frontier) == 0:
+            for fact in [Node.last, Node.assumptions[Node.level]]:
+                if fact != None and fact.is_proved():
+                    frontier += [atom.digest for atom in fact.atoms()]
+        layer = []
+        for fact in self.prune(self.constants):
+            if not fact.digest in selected:
+                selected.add(fact.digest)
+                layer.append(fact)
+        while True:
+            atoms = []
+            for atom in frontier:
+                if atom in seen:
+                    continue
+                seen.add(atom)
+                for fact in self.prune(self.facts.get(atom, [])):
+                    if fact.digest in selected:
+                        continue
+                    selected.add(fact.digest)
+                    layer.append(fact)
+                    atoms += self.atoms[id(fact)]
+            yield layer
+            if len(atoms) == 0:
+                return
+            frontier = atoms
+            layer = []
+
+# raised by budget when a step or the proof runs out of one of its budgets, e.g. "step_nodes"
+class BudgetExceeded(Exception):
+    def __init__(self, kind, limit):
+        Exception.__init__(self, "%s over the budget %s" % (kind, limit))
+        self.kind = kind
+        self.limit = limit
+
+# the budgets of each step and of the whole proof, None for no limit
+# budget.configure(step_seconds = 1.0, step_assignments = 1 << 24, proof_seconds = 60.0)
+# budget.reset() # at the start of each proof
+class Budget:
+    period = 1024 # the charges between the looks at the clock
+
+    def __init__(self):
+        self.limits = {
+            "step_seconds" : None, "step_assignments" : None, "step_nodes" : None,
+            "proof_seconds" : None, "proof_assignments" : None, "proof_nodes" : None,
+        }
+        self.reset()
+
+    def configure(self, **limits):
+        for kind, limit in limits.items():
+            assert kind in self.limits
+            self.limits[kind] = limit
+        self.arm()
+
+    # the start of a proof
+    def reset(self):
+        self.started = time.monotonic()
+        self.assignments = 0
+        self.nodes = 0
+        self.step()
+
+    # the start of a step
+    def step(self):
+        self.step_started = time.monotonic()
+        self.step_assignments = self.assignments
+        self.step_nodes = self.nodes
+        self.arm()
+
+    # the counts where the budgets run out, and the time they run out at, the nearest of the step and the proof
+    def arm(self):
+        self.bounds = {}
+        for kind, step_base, proof_base in [
+            ("seconds", self.step_started, self.started),
+            ("assignments", self.step_assignments, 0),
+            ("nodes", self.step_nodes, 0),
+        ]:
+            bound = None
+            for scope, base in [("step_", step_base), ("proof_", proof_base)]:
+                limit = self.limits[scope + kind]
+                if limit != None and (bound == None or base + limit < bound[0]):
+                    bound = (base + limit, scope + kind, limit)
+            self.bounds[kind] = bound
+        self.next_assignments = 0
+        self.next_nodes = 0
+
+    def visit(self, count = 1):
+        self.nodes += count
+        if self.nodes >= self.next_nodes:
+            self.check()
+
+    def enumerate(self, count = 1):
+        self.assignments += count
+        if self.assignments >= self.next_assignments:
+            self.check()
+
+    # the counts are checked at once when they run out, and the clock every period of them
+    def check(self):
+        for kind, count in [("assignments", self.assignments), ("nodes", self.nodes), ("seconds", time.monotonic())]:
+            bound = self.bounds[kind]
+            if bound != None and count > bound[0]:
+                raise BudgetExceeded(bound[1], bound[2])
+        self.next_assignments = self.assignments + Budget.period
+        self.next_nodes = self.nodes + Budget.period
+        if self.bounds["assignments"] != None:
+            self.next_assignments = min(self.next_assignments, self.bounds["assignments"][0] + 1)
+        if self.bounds["nodes"] != None:
+            self.next_nodes = min(self.next_nodes, self.bounds["nodes"][0] + 1)
+
+budget = Budget()
+
+# whether a variable is fresh, i.e. in no sentence proved since it was made, shared by the variables of its counter
+class Freshness:
+    __slots__ = ["fresh", "__weakref__"]
+
+    def __init__(self):
+        self.fresh = True
+
+# the counters of the fresh variables, as a set, kept only while a variable of the counter is alive
+class FreshVariables:
+    def __init__(self):
+        self.freshness = weakref.WeakValueDictionary() # counter -> Freshness
+
+    # the freshness of the counter, for the variable made of it
+    def add(self, counter):
+        freshness = self.freshness.get(counter)
+        if freshness == None:
+            freshness = Freshness()
+            self.freshness[counter] = freshness
+        return freshness
+
+    def __contains__(self, counter):
+        freshness = self.freshness.get(counter)
+        return freshness != None and freshness.fresh
+
+    def discard(self, counter):
+        freshness = self.freshness.get(counter)
+        if freshness != None and freshness.fresh:
+            Rollback.set(freshness, "fresh", False)
+
+    def remove(self, counter):
+        if not counter in self:
+            raise KeyError(counter)
+        self.discard(counter)
+
+    def __len__(self):
+        return len([counter for counter, freshness in self.freshness.items() if freshness.fresh])
+
+# what a derived rule changed, set back if it fails, including the frames it passed to Node.tracer
+class Rollback:
+    def __init__(self):
+        congruence_closure.synchronize()
+        self.attributes = [] # (object, attribute, value before)
+        self.bounded = [set(bounded) for bounded in Node.bounded[ : Node.level + 1]]
+        self.last = Node.last
+        self.numbered = dict([(key, value) for key, value in dict.items(proof_history) if isinstance(key, int)])
+        self.trail = len(congruence_closure.trail)
+        self.equalities = len(congruence_closure.equalities)
+        self.ground = congruence_closure.ground
+        self.tracer = Node.tracer
+        if self.tracer != None:
+            self.tracer.hold()
+
+    # setattr, remembered by the rollback of the derived rule running
+    @staticmethod
+    def set(target, attribute, value):
+        if Node.rollback != None:
+            Node.rollback.attributes.append((target, attribute, getattr(target, attribute)))
+        setattr(target, attribute, value)
+
+    def restore(self):
+        for target, attribute, value in reversed(self.attributes):
+            setattr(target, attribute, value)
+        for level, bounded in enumerate(self.bounded):
+            Node.bounded[level] = bounded
+        Node.last = self.last
+        for key in [key for key in dict.keys(proof_history) if isinstance(key, int)]:
+            dict.__delitem__(proof_history, key)
+        dict.update(proof_history, self.numbered)
+        congruence_closure.undo(self.trail)
+        del congruence_closure.equalities[self.equalities : ]
+        congruence_closure.ground = self.ground
+        if self.tracer != None:
+            self.tracer.drop()
+
+    # the derived rule ended
+    def close(self):
+        if self.tracer != None:
+            self.tracer.release()
+
+# the nodes made so far, for MemoryProfile
+made_nodes = 0
+
 class Node:
     counter = 0
     branch = [0]
@@ -50,27 +549,40 @@ class Node:
     assumptions = [None]
     level = 0
     last = None
-    fresh = set()
-
-    def __init__(self, type_, **arguments):
-        self.free = set()
-        self.bounded = set()
+    fresh = FreshVariables()
+    confirm = False
+    recorder = None
+    tracer = None
+    rollback = None # Rollback of the derived rule running
+    depth = 0
+
+    # the digest is given only by Node.loaded, which trusts it
+    def __init__(self, type_, digest = None, **arguments):
+        global made_nodes
+        made_nodes += 1
         self.arguments = arguments
 
+        # the size is the number of the nodes in the tree, for the fingerprints of Matcher
         if type_ == TYPE_VARIABLE:
             if arguments.get("counter") != None:
                 self.counter = arguments["counter"]
             else:
                 self.counter = Node.counter
                 Node.counter += 1
-            self.free.add(self.counter)
+            self.free = {self.counter}
+            self.bounded = set()
+            self.size = 1
             self.defined_by = arguments.get("defined_by")
-            Node.fresh.add(self.counter)
+            self.freshness = Node.fresh.add(self.counter)
         elif type_ in [TYPE_PROPERTY, TYPE_FUNCTION]:
             self.name = arguments["name"]
             self.children = arguments["children"]
+            self.free = set()
+            self.bounded = set()
+            self.size = 1
             for child in self.children:
                 self.free |= child.free
+                self.size += child.size
         elif type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
             self.bound = arguments["bound"]
             self.statement = arguments["statement"]
@@ -80,22 +592,28 @@ class Node:
             assert not self.bound.counter in self.bounded
             self.free.remove(self.bound.counter)
             self.bounded.add(self.bound.counter)
+            self.size = 2 + self.statement.size
         elif type_ == TYPE_NOT:
             self.body = arguments["body"]
             self.free = self.body.free.copy()
             self.bounded = self.body.bounded.copy()
+            self.size = 1 + self.body.size
         elif type_ in [TYPE_AND, TYPE_OR, TYPE_IFF]:
             self.left = arguments["left"]
             self.right = arguments["right"]
             self.free = self.left.free | self.right.free
             self.bounded = self.left.bounded | self.right.bounded
+            self.size = 1 + self.left.size + self.right.size
         elif type_ == TYPE_IMPLY:
             self.assumption = arguments["assumption"]
             self.conclusion = arguments["conclusion"]
             self.free = self.assumption.free | self.conclusion.free
             self.bounded = self.assumption.bounded | self.conclusion.bounded
+            self.size = 1 + self.assumption.size + self.conclusion.size
         elif type_ in [TYPE_TRUE, TYPE_FALSE]:
-            pass
+            self.free = set()
+            self.bounded = set()
+            self.size = 1
         else:
             assert False
 
@@ -103,24 +621,254 @@ class Node:
         self.branch = None
         self.operator = None
 
-        hashing = [self.type_]
-        if self.type_ == TYPE_VARIABLE:
-            hashing.append(self.counter)
-        for key, value in sorted(self.arguments.items(), key = (lambda item : item[0])):
-            hashing.append(key)
-            if isinstance(value, list):
-                for element in value:
-                    hashing.append(hash(element))
+        # blake2b over the type, the name and the digests of the children, without the names of the bound variables
+        if digest != None:
+            self.digest = digest
+        elif self.type_ == TYPE_VARIABLE:
+            self.digest = hashlib.blake2b(bytes([self.type_]) + self.counter.to_bytes(8, "big"), digest_size = 16).digest()
+        elif self.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+            statement = {id(self.statement) : Node.nameless(self.statement, {self.bound.counter : 0})}
+            self.digest = Node.merkle(b"", self.type_, {"statement" : self.statement}, statement)
+        elif len(arguments) == len(digest_keys[type_]):
+            # as Node.merkle hashes them, but without looking at the types of the arguments
+            pieces = [bytes((type_,))]
+            if type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                pieces += [b"children:", len(self.children).to_bytes(4, "big")]
+                pieces += [child.digest for child in self.children]
+                pieces += [b"name:", Node.encoded_name(self.name)]
+            else:
+                for key in digest_keys[type_]:
+                    pieces += [digest_labels[key], arguments[key].digest]
+            self.digest = hashlib.blake2b(b"".join(pieces), digest_size = 16).digest()
+        else:
+            self.digest = Node.merkle(b"", self.type_, self.arguments)
+
+    # the digest of the type and the arguments, with the digests of the children by their ids if given
+    @staticmethod
+    def merkle(prefix, type_, arguments, digests = None):
+        pieces = [prefix, bytes((type_,))]
+        keys = digest_keys.get(type_)
+        if keys == None or len(keys) != len(arguments):
+            keys = sorted(arguments.keys())
+        for key in keys:
+            value = arguments[key]
+            pieces.append(digest_labels[key] if key in digest_labels else key.encode() + b":")
+            if isinstance(value, Node):
+                pieces.append(value.digest if digests == None else digests[id(value)])
+            elif isinstance(value, list):
+                pieces.append(len(value).to_bytes(4, "big"))
+                if digests == None:
+                    pieces += [element.digest for element in value]
+                else:
+                    pieces += [digests[id(element)] for element in value]
+            else:
+                pieces.append(Node.encoded_name(value))
+        return hashlib.blake2b(b"".join(pieces), digest_size = 16).digest()
+
+    # a name or any other argument as it is hashed, by the length and the bytes of its repr
+    @staticmethod
+    def encoded_name(value):
+        if type(value) == str and value in digest_names:
+            return digest_names[value]
+        encoded = repr(value).encode()
+        encoded = len(encoded).to_bytes(4, "big") + encoded
+        if type(value) == str:
+            digest_names[value] = encoded
+        return encoded
+
+    # the digest of the node with the variables of the counters in levels hashed as their levels
+    @staticmethod
+    def nameless(root, levels):
+        levels = dict(levels)
+        digests = {} # (id of the node, scope) -> digest
+        scopes = 1
+        stack = [(root, 0, None)] # the node, its scope, and the scope of its subnodes once it is entered
+        while len(stack) > 0:
+            node, scope, inner = stack.pop()
+            key = (id(node), scope)
+            if inner != None and node.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+                del levels[node.bound.counter]
+                statement = {id(node.statement) : digests[(id(node.statement), inner)]}
+                digests[key] = Node.merkle(b"nameless:", node.type_, {"statement" : node.statement}, statement)
+            elif inner != None:
+                subdigests = dict([(id(subnode), digests[(id(subnode), scope)]) for subnode in node.subnodes()])
+                digests[key] = Node.merkle(b"nameless:", node.type_, node.arguments, subdigests)
+            elif key in digests:
+                continue
+            elif node.type_ == TYPE_VARIABLE and node.counter in levels:
+                digests[key] = hashlib.blake2b(b"bound:" + levels[node.counter].to_bytes(4, "big"), digest_size = 16).digest()
+            elif node.free.isdisjoint(levels):
+                digests[key] = node.digest
+            elif node.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+                levels[node.bound.counter] = len(levels)
+                stack.append((node, scope, scopes))
+                stack.append((node.statement, scopes, None))
+                scopes += 1
             else:
-                hashing.append(hash(value))
-        self.hash = hash(tuple(hashing))
+                stack.append((node, scope, scope))
+                stack += [(subnode, scope, None) for subnode in node.subnodes()]
+        return digests[(id(root), 0)]
+
+    # the digest with the names of the bound variables, for the encodings keeping the names
+    def named_digest(self):
+        if len(self.bounded) == 0:
+            return self.digest
+        counters = []
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            if len(node.bounded) == 0:
+                continue
+            if node.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+                counters.append(node.bound.counter)
+            stack += reversed(node.subnodes())
+        return (self.digest, tuple(counters))
 
     def is_fresh(self):
         assert self.type_ == TYPE_VARIABLE
         return self.counter in Node.fresh
 
     def __hash__(self):
-        return self.hash
+        return int.from_bytes(self.digest[ : 7], "big")
+
+    # pickled as a row, or over table_size nodes as the flat table of the nodes under it
+    table_size = 128
+    loaded_limit = 1024 # the size of loaded_nodes where its dead references are swept out
+
+    def __reduce__(self):
+        if self.size > Node.table_size:
+            return (Node.from_table, self.table())
+        if self.type_ == TYPE_VARIABLE:
+            return (Node.loaded, (self.type_, self.digest, self.counter))
+        if self.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+            return (Node.loaded, (self.type_, self.digest, self.name, *self.children))
+        return (Node.loaded, (self.type_, self.digest, None, *self.written()))
+
+    # the rows of the distinct nodes under the node, each after its subnodes, as (types, operands, names, digests)
+    def table(self):
+        indices = {}
+        types = bytearray()
+        operands = array.array("q")
+        names = []
+        digests = bytearray()
+        for node in self.postorder():
+            subnodes = node.written()
+            indices[id(node)] = len(types)
+            types.append(node.type_)
+            digests += node.digest
+            if node.type_ == TYPE_VARIABLE:
+                operands.append(node.counter)
+                continue
+            if node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                names.append(node.name)
+                operands.append(len(subnodes))
+            operands.extend([indices[id(subnode)] for subnode in subnodes])
+        return (bytes(types), operands, names, bytes(digests))
+
+    @staticmethod
+    def from_table(types, operands, names, digests):
+        nodes = []
+        position = 0
+        names = iter(names)
+        for index, type_ in enumerate(types):
+            if type_ == TYPE_VARIABLE:
+                key = operands[position]
+                arity = 0
+                position += 1
+            elif type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                key = next(names)
+                arity = operands[position]
+                position += 1
+            else:
+                key = None
+                arity = len(encoding_fields[type_])
+            subnodes = [nodes[subnode] for subnode in operands[position : position + arity]]
+            position += arity
+            nodes.append(Node.loaded(type_, digests[16 * index : 16 * index + 16], key, *subnodes))
+        return nodes[-1]
+
+    # the node of a row, the key being the counter of a variable or the name of a function or a property
+    # made by __init__ with the digest given, hashed again with Node.confirm on, or the same node loaded before if alive
+    @staticmethod
+    def loaded(type_, digest, key, *subnodes):
+        interned = (type_, key, *map(id, subnodes))
+        reference = loaded_nodes.get(interned)
+        if reference != None:
+            node = reference()
+            if isinstance(node, Node): # not node != None, which is Node.__ne__
+                return node
+        given = None if Node.confirm else digest
+        if type_ == TYPE_VARIABLE:
+            if key >= Node.counter:
+                Node.counter += (key - Node.counter) // 52 * 52 + 52
+            node = Node(type_, given, counter = key)
+        elif key != None:
+            node = Node(type_, given, name = key, children = list(subnodes))
+        elif type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+            node = Node(type_, given, bound = subnodes[0], statement = subnodes[1])
+        elif type_ in [TYPE_AND, TYPE_OR, TYPE_IFF]:
+            node = Node(type_, given, left = subnodes[0], right = subnodes[1])
+        elif type_ == TYPE_IMPLY:
+            node = Node(type_, given, assumption = subnodes[0], conclusion = subnodes[1])
+        elif type_ == TYPE_NOT:
+            node = Node(type_, given, body = subnodes[0])
+        else:
+            node = Node(type_, given)
+        if given == None:
+            assert node.digest == digest
+        loaded_nodes[interned] = weakref.ref(node)
+        if len(loaded_nodes) > Node.loaded_limit:
+            for interned in [interned for interned, reference in loaded_nodes.items() if not isinstance(reference(), Node)]:
+                del loaded_nodes[interned]
+            Node.loaded_limit = max(1024, 2 * len(loaded_nodes))
+        return node
+
+    # the digests decide whether two nodes are the same,
+    # and with Node.confirm on, a matching digest is confirmed structurally
+    def same(self, other):
+        if self.digest != other.digest:
+            return False
+        return not Node.confirm or self.same_structure(other)
+
+    # the levels of the bound variables on both sides are kept, as the names of the bound variables do not matter
+    def same_structure(self, other):
+        stack = [(self, other, {}, {})]
+        while len(stack) > 0:
+            budget.visit()
+            node, other, levels, other_levels = stack.pop()
+            if node is other and node.free.isdisjoint(levels) and other.free.isdisjoint(other_levels):
+                continue
+            if node.type_ != other.type_:
+                return False
+            if node.type_ == TYPE_VARIABLE:
+                if levels.get(node.counter) != other_levels.get(other.counter):
+                    return False
+                if levels.get(node.counter) == None and node.counter != other.counter:
+                    return False
+                continue
+            if node.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+                levels = dict(levels)
+                levels[node.bound.counter] = len(levels)
+                other_levels = dict(other_levels)
+                other_levels[other.bound.counter] = len(other_levels)
+                stack.append((node.statement, other.statement, levels, other_levels))
+                continue
+            if sorted(node.arguments.keys()) != sorted(other.arguments.keys()):
+                return False
+            for key, value in node.arguments.items():
+                value2 = other.arguments[key]
+                if isinstance(value, list):
+                    if not isinstance(value2, list) or len(value) != len(value2):
+                        return False
+                    for index, element in enumerate(value):
+                        stack.append((element, value2[index], levels, other_levels))
+                elif isinstance(value, Node):
+                    if not isinstance(value2, Node):
+                        return False
+                    stack.append((value, value2, levels, other_levels))
+                elif isinstance(value2, Node) or isinstance(value2, list) or value != value2:
+                    return False
+        return True
 
     def is_sentence(self):
         return not self.type_ in [TYPE_VARIABLE, TYPE_FUNCTION]
@@ -135,69 +883,155 @@ class Node:
     def is_proved(self):
         if self.branch == None:
             return False
-        if len(self.branch) > len(Node.branch):
+        return Node.in_scope(self.branch)
+
+    # whether a sentence accepted at the branch is still available
+    @staticmethod
+    def in_scope(branch):
+        if len(branch) > len(Node.branch):
             return False
-        for level in range(0, len(self.branch)):
-            if self.branch[level] != Node.branch[level]:
+        for level in range(0, len(branch)):
+            if branch[level] != Node.branch[level]:
                 return False
         return True
 
-    def __str__(self): # for debugging only
-        if self.type_ == TYPE_VARIABLE:
-            if self.counter < 52:
-                if self.counter < 26:
-                    return chr(ord('a') + self.counter) + "_"
+    # the text, piece by piece
+    # the subterms in names, by their digests, are written by their names
+    def pieces(self, names = None):
+        if names == None:
+            names = {}
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, str):
+                yield node
+            elif len(names) > 0 and node is not self and node.digest in names:
+                yield names[node.digest]
+            elif node.type_ == TYPE_VARIABLE:
+                if node.counter < 52:
+                    if node.counter < 26:
+                        yield chr(ord('a') + node.counter) + "_"
+                    else:
+                        yield chr(ord('A') + node.counter - 26) + "_"
                 else:
-                    return chr(ord('A') + self.counter - 26) + "_"
+                    count = node.counter % 52
+                    if count < 26:
+                        yield chr(ord('a') + count)
+                    else:
+                        yield chr(ord('A') + count - 26)
+            elif node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                yield str(node.name) + "("
+                stack.append(")")
+                for index in range(len(node.children) - 1, 0, -1):
+                    stack += [node.children[index], ", "]
+                if len(node.children) > 0:
+                    stack.append(node.children[0])
+            elif node.type_ == TYPE_ALL:
+                yield "All("
+                stack += [")", node.statement, ",", node.bound]
+            elif node.type_ == TYPE_EXIST:
+                yield "Exist("
+                stack += [")", node.statement, ",", node.bound]
+            elif node.type_ == TYPE_UNIQUELY_EXIST:
+                yield "UniquelyExist("
+                stack += [")", node.statement, ",", node.bound]
+            elif node.type_ == TYPE_NOT:
+                yield "(~ "
+                stack += [")", node.body]
+            elif node.type_ == TYPE_AND:
+                yield "("
+                stack += [")", node.right, " & ", node.left]
+            elif node.type_ == TYPE_OR:
+                yield "("
+                stack += [")", node.right, " | ", node.left]
+            elif node.type_ == TYPE_IMPLY:
+                yield "("
+                stack += [")", node.conclusion, " >> ", node.assumption]
+            elif node.type_ == TYPE_IFF:
+                yield "("
+                stack += [")", node.right, " == ", node.left]
+            elif node.type_ == TYPE_TRUE:
+                yield "true"
+            elif node.type_ == TYPE_FALSE:
+                yield "false"
             else:
-                count = self.counter % 52
-                if count < 26:
-                    return chr(ord('a') + count)
-                else:
-                    return chr(ord('A') + count - 26)
-
-        elif self.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
-            ret = self.name + "("
-            if len(self.children) > 0:
-                for child in self.children[ : -1]:
-                    ret += (str(child) + ", ")
-                ret += str(self.children[-1])
-            ret += ")"
-            return ret
-        elif self.type_ == TYPE_ALL:
-            return "All(" + str(self.bound) + "," + str(self.statement) + ")"
-        elif self.type_ == TYPE_EXIST:
-            return "Exist(" + str(self.bound) + "," + str(self.statement) + ")"
-        elif self.type_ == TYPE_UNIQUELY_EXIST:
-            return "UniquelyExist(" + str(self.bound) + "," + str(self.statement) + ")"
-        elif self.type_ == TYPE_NOT:
-            return "(~ " + str(self.body) + ")"
-        elif self.type_ == TYPE_AND:
-            return "(" + str(self.left) + " & " + str(self.right) + ")"
-        elif self.type_ == TYPE_OR:
-            return "(" + str(self.left) + " | " + str(self.right) + ")"
-        elif self.type_ == TYPE_IMPLY:
-            return "(" + str(self.assumption) + " >> " + str(self.conclusion) + ")"
-        elif self.type_ == TYPE_IFF:
-            return "(" + str(self.left) + " == " + str(self.right) + ")"
-        elif self.type_ == TYPE_TRUE:
-            return "true"
-        elif self.type_ == TYPE_FALSE:
-            return "false"
-        else:
-            assert False
+                assert False
+
+    def __str__(self): # for debugging only
+        return "".join(self.pieces())
+
+    # write the text into the output, sharing the repeated subterms as let bindings, cut at limit characters with "..."
+    # return whether the whole text is written
+    def write(self, output, share = False, limit = None):
+        bindings = []
+        if share:
+            # the text of more than limit distinct nodes is cut anyway, so only the first limit of them are looked at
+            count = {}
+            order = []
+            stack = [(self, False)]
+            while len(stack) > 0 and (limit == None or len(order) < limit):
+                node, walked = stack.pop()
+                if walked:
+                    count[node.digest] = 0
+                    order.append(node)
+                    for subnode in node.subnodes():
+                        count[subnode.digest] += 1
+                elif count.get(node.digest) == None:
+                    stack.append((node, True))
+                    stack += [(subnode, False) for subnode in reversed(node.subnodes())]
+            budget.visit(len(order))
+            for node in order:
+                if count[node.digest] > 1 and not node.type_ in [TYPE_VARIABLE, TYPE_TRUE, TYPE_FALSE]:
+                    bindings.append(node)
+        names = {}
+        written = 0
+        held = "" # the last three characters or less, written only if the text ends there
+        for node in bindings + [self]:
+            pieces = node.pieces(names)
+            if node is not self:
+                name = "#" + str(len(names))
+                pieces = itertools.chain(["let ", name, " = "], pieces, ["\n"])
+            for piece in pieces:
+                if limit != None and (len(held) > 0 or written + len(piece) > limit - 3):
+                    held += piece
+                    if written + len(held) > limit:
+                        output.write((held[ : max(limit - 3 - written, 0)] + "...")[ : limit - written])
+                        return False
+                    continue
+                output.write(piece)
+                written += len(piece)
+            if node is not self:
+                names[node.digest] = name
+        output.write(held)
+        return True
+
+    def format(self, share = False, limit = None):
+        output = io.StringIO()
+        self.write(output, share, limit)
+        return output.getvalue()
 
     # when you just assume an axiom:
     # your_axiom.accept()
     # at the ground level(i.e. no Fitch-style assumptions),
     # the axiom must be closed
-    def accept(self):
+    # the inference is passed to Node.tracer, as the rule and its arguments
+    def accept(self, *inference):
         assert self.is_sentence()
-        self.branch = Node.branch[ : Node.level]
+        if Node.tracer != None and len(inference) > 0:
+            Node.tracer.infer(self, inference)
+        self.admit(Node.branch[ : Node.level])
+        Node.last = self
+        return self
+
+    # mark the sentence as proved at the branch
+    def admit(self, branch):
+        Rollback.set(self, "branch", branch)
         for variable in self.free | self.bounded:
             if variable in Node.fresh:
                 Node.fresh.remove(variable)
-        Node.last = self
+        if self.type_ == TYPE_PROPERTY and self.name == "equal":
+            congruence_closure.assume(self, self.branch)
+        premise_index.add(self)
         return self
     
     # to save a sentence:
@@ -210,6 +1044,8 @@ class Node:
         assert self.is_sentence()
         if isinstance(save_as, str):
             assert proof_history.get(save_as) == None
+            proof_history.dependencies[save_as] = proof_history.citations - {save_as}
+            proof_history.citations = set()
         else:
             assert isinstance(save_as, int)
         proof_history[save_as] = self
@@ -222,8 +1058,8 @@ class Node:
     #     conclustion
     # (assumption >> conclusion).deduce()
     def deduce(self):
-        assert hash(self) == hash(Node.last)
-        return self.accept()
+        assert self.same(Node.last)
+        return self.accept(DEDUCE)
 
     def __enter__(self):
         Node.level += 1
@@ -238,29 +1074,195 @@ class Node:
             Node.assumptions[Node.level] = self
             Node.names[Node.level] = set()
         Node.bounded[Node.level] |= self.free
+        if Node.depth == 0 and Node.recorder != None:
+            Node.recorder.enter(self)
+        if Node.tracer != None:
+            Node.tracer.enter(self)
         return self.accept()
 
+    # the block left by an error proves nothing, and is left in the trace and the record too
     def __exit__(self, exc_type, exc_val, exc_tb):
-        Node(TYPE_IMPLY, assumption = Node.assumptions[Node.level], conclusion = Node.last).accept()
+        if exc_type != None:
+            Node.level -= 1
+            if Node.tracer != None:
+                Node.tracer.leave()
+            if Node.depth == 0 and Node.recorder != None:
+                Node.recorder.leave()
+            return False
+        implication = Node(TYPE_IMPLY, assumption = Node.assumptions[Node.level], conclusion = Node.last).accept()
         Node.level -= 1
+        if Node.tracer != None:
+            Node.tracer.exit(implication)
+        if Node.depth == 0 and Node.recorder != None:
+            Node.recorder.exit()
+
+    # the nodes right below, in the order of the arguments
+    def subnodes(self):
+        if self.type_ in [TYPE_FUNCTION, TYPE_PROPERTY] and len(self.arguments) == 2:
+            return list(self.children)
+        if self.type_ != TYPE_VARIABLE and len(self.arguments) == len(digest_keys[self.type_]):
+            return list(self.arguments.values()) # the fields of a formula, all nodes
+        subnodes = []
+        for value in self.arguments.values():
+            if isinstance(value, list):
+                subnodes += value
+            elif isinstance(value, Node):
+                subnodes.append(value)
+        return subnodes
+
+    # the nodes below, each after its subnodes
+    def postorder(self):
+        order = []
+        visited = set()
+        stack = [(self, False)]
+        while len(stack) > 0:
+            node, walked = stack.pop()
+            if walked:
+                order.append(node)
+            elif not id(node) in visited:
+                visited.add(id(node))
+                stack.append((node, True))
+                stack += [(subnode, False) for subnode in reversed(node.subnodes())]
+        budget.visit(len(order))
+        return order
 
     def substitute(self, old, new):
         assert old.type_ == TYPE_VARIABLE
+        return self.substitute_all({old.counter : new})
+
+    # substitute the variables at once, by the counters in the mapping, by recursion up to recursion_size nodes
+    recursion_size = 256
+    def substitute_all(self, mapping):
+        counters = set(mapping)
+        if counters.isdisjoint(self.free) and counters.isdisjoint(self.bounded):
+            return self
+        if self.size <= Node.recursion_size:
+            budget.visit(self.size)
+            return self.substituted(mapping, counters)
+        substituted = {}
+        stack = [(self, False)]
+        while len(stack) > 0:
+            node, walked = stack.pop()
+            if walked and node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY] and len(node.arguments) == 2:
+                substituted[id(node)] = Node(node.type_, name = node.name, children = [substituted[id(child)] for child in node.children])
+            elif walked:
+                arguments = {}
+                for key, value in node.arguments.items():
+                    if isinstance(value, list):
+                        arguments[key] = [substituted[id(element)] for element in value]
+                    elif isinstance(value, Node):
+                        arguments[key] = substituted[id(value)]
+                    else:
+                        arguments[key] = value
+                substituted[id(node)] = Node(node.type_, **arguments)
+            elif id(node) in substituted:
+                continue
+            elif node.type_ == TYPE_VARIABLE:
+                substituted[id(node)] = mapping.get(node.counter, node)
+            elif counters.isdisjoint(node.free) and counters.isdisjoint(node.bounded):
+                substituted[id(node)] = node
+            else:
+                stack.append((node, True))
+                stack += [(subnode, False) for subnode in node.subnodes()]
+        budget.visit(len(substituted))
+        return substituted[id(self)]
+
+    def substituted(self, mapping, counters):
         if self.type_ == TYPE_VARIABLE:
-            if self.counter == old.counter:
-                return new
+            return mapping.get(self.counter, self)
+        if counters.isdisjoint(self.free) and counters.isdisjoint(self.bounded):
+            return self
+        if self.type_ in [TYPE_FUNCTION, TYPE_PROPERTY] and len(self.arguments) == 2:
+            return Node(self.type_, name = self.name, children = [child.substituted(mapping, counters) for child in self.children])
+        arguments = {}
+        for key, value in self.arguments.items():
+            if isinstance(value, list):
+                arguments[key] = [element.substituted(mapping, counters) for element in value]
+            elif isinstance(value, Node):
+                arguments[key] = value.substituted(mapping, counters)
             else:
-                return self
+                arguments[key] = value
+        return Node(self.type_, **arguments)
+
+    # the nodes in preorder, each with its path from the root,
+    # i.e. the keys of the arguments down to it, with the indices in the lists of the children
+    def paths(self):
+        stack = [(self, ())]
+        while len(stack) > 0:
+            node, path = stack.pop()
+            yield node, path
+            if node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                for index in reversed(range(0, len(node.children))):
+                    stack.append((node.children[index], path + (("children", index),)))
+            elif node.type_ != TYPE_VARIABLE:
+                for key in reversed(encoding_fields[node.type_]):
+                    stack.append((node.arguments[key], path + ((key, None),)))
+
+    # the node with the node at the path replaced by the new one
+    def replaced(self, path, new):
+        if len(path) == 0:
+            return new
+        key, index = path[0]
+        arguments = dict(self.arguments)
+        if index == None:
+            arguments[key] = arguments[key].replaced(path[1 : ], new)
         else:
-            arguments = {}
-            for key, value in self.arguments.items():
-                if isinstance(value, list):
-                    arguments[key] = [element.substitute(old, new) for element in value]
-                elif isinstance(value, Node):
-                    arguments[key] = value.substitute(old, new)
-                else:
-                    arguments[key] = value
-            return Node(self.type_, **arguments)
+            arguments[key] = list(arguments[key])
+            arguments[key][index] = arguments[key][index].replaced(path[1 : ], new)
+        return Node(self.type_, **arguments)
+
+    # whether the node is the statement with the term for the bound variable,
+    # i.e. the same as statement.substitute(bound, term), but without making it
+    def instantiates(self, statement, bound, term):
+        return self.matches(statement, {bound.counter : term})
+
+    # instantiates, with the terms for the variables of the counters in the mapping at once
+    # the bound variables are compared by their levels, as in same_structure
+    def matches(self, statement, mapping):
+        scopes = [({}, {})]
+        visited = set()
+        stack = [(statement, self, True, 0)]
+        while len(stack) > 0:
+            budget.visit()
+            pair = stack.pop()
+            node, counterpart, substituting, scope = pair
+            key = (id(node), id(counterpart), substituting, scope)
+            if key in visited:
+                continue
+            visited.add(key)
+            levels, other_levels = scopes[scope]
+            if substituting and node.free.isdisjoint(mapping) and node.bounded.isdisjoint(mapping):
+                substituting = False
+            if substituting and node.type_ == TYPE_VARIABLE:
+                node = mapping.get(node.counter, node)
+                substituting = False
+            if not substituting and node.free.isdisjoint(levels) and counterpart.free.isdisjoint(other_levels):
+                if not counterpart.same(node):
+                    return False
+            elif node.type_ != counterpart.type_:
+                return False
+            elif node.type_ == TYPE_VARIABLE:
+                if levels.get(node.counter) != other_levels.get(counterpart.counter):
+                    return False
+                if levels.get(node.counter) == None and node.counter != counterpart.counter:
+                    return False
+            elif node.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+                bound = mapping.get(node.bound.counter, node.bound) if substituting else node.bound
+                if bound.type_ != TYPE_VARIABLE:
+                    return False
+                levels = dict(levels)
+                levels[bound.counter] = len(levels)
+                other_levels = dict(other_levels)
+                other_levels[counterpart.bound.counter] = len(other_levels)
+                scopes.append((levels, other_levels))
+                stack.append((node.statement, counterpart.statement, substituting, len(scopes) - 1))
+            elif node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                if node.name != counterpart.name or len(node.children) != len(counterpart.children):
+                    return False
+                stack += [(child, other, substituting, scope) for child, other in zip(node.children, counterpart.children)]
+            else:
+                stack += [(subnode, other, substituting, scope) for subnode, other in zip(node.subnodes(), counterpart.subnodes())]
+        return True
 
     # define property
     # All(x, All(y, ... P(x, y, ...) iff Q(x, y, ...)))
@@ -276,7 +1278,9 @@ class Node:
         assert cursor.type_ == TYPE_IFF
         assert cursor.left.type_ == TYPE_PROPERTY
         assert cursor.left.name == name
-        return self.accept()
+        self.accept(DEFINE_PROPERTY, name)
+        definition_index.add(name, self)
+        return self
 
     # define function
     # All(x, Q(x) >> UniquelyExist(y, P(x, y))).by(...).save(number)
@@ -303,8 +1307,10 @@ class Node:
             definition = cursor.statement.substitute(cursor.bound, Node(TYPE_FUNCTION, name = name, children = arguments))
         for argument in reversed(arguments):
             definition = Node(TYPE_ALL, bound = argument, statement = definition)
-        assert hash(self) == hash(definition)
-        return self.accept()
+        assert self.same(definition)
+        self.accept(DEFINE_FUNCTION, name, reason)
+        definition_index.add(name, self)
+        return self
 
     # prove Exist(x, P(x)) from t & P(t)
     def found(self, term, reason):
@@ -312,8 +1318,8 @@ class Node:
         assert reason.is_proved()
         assert not term.is_sentence()
         assert self.type_ == TYPE_EXIST
-        assert hash(self.statement.substitute(self.bound, term)) == hash(reason)
-        return self.accept()
+        assert reason.instantiates(self.statement, self.bound, term)
+        return self.accept(FOUND, term, reason)
 
     # prove P(c) from c & Exist(x, P(x))
     # c must be FRESH, i.e. must NOT be used in the proof so far
@@ -322,10 +1328,10 @@ class Node:
         assert reason.is_proved()
         assert reason.type_ in [TYPE_EXIST, TYPE_UNIQUELY_EXIST]
         assert variable.is_fresh()
-        variable.defined_by = reason
+        Rollback.set(variable, "defined_by", reason)
         Node.bounded[Node.level].add(variable.counter)
-        assert hash(self) == hash(reason.statement.substitute(reason.bound, variable))
-        return self.accept()
+        assert self.instantiates(reason.statement, reason.bound, variable)
+        return self.accept(LET, variable, reason)
     
     # Exist(x, P(x)).save(key)
     # P(a).let(a, key)
@@ -338,10 +1344,11 @@ class Node:
         assert reason.is_proved()
         assert reason.type_ == TYPE_PROPERTY
         assert reason.name == "equal"
-        assert hash(reason.children[0].defined_by) == hash(reason.children[1].defined_by)
+        assert reason.children[0].defined_by != None
+        assert reason.children[0].defined_by.same(reason.children[1].defined_by)
         assert self.type_ == TYPE_UNIQUELY_EXIST
-        assert hash(Node(TYPE_EXIST, **self.arguments)) == hash(reason.children[0].defined_by)
-        return self.accept()
+        assert Node(TYPE_EXIST, **self.arguments).same(reason.children[0].defined_by)
+        return self.accept(CLAIM_UNIQUE, reason)
 
     # prove (a == b) from UniquelyExist(x, P(x)), P(a) & P(b)
     def by_unique(self, reason, left, right):
@@ -354,9 +1361,9 @@ class Node:
         assert self.type_ == TYPE_PROPERTY
         assert self.name == "equal"
         assert reason.type_ == TYPE_UNIQUELY_EXIST
-        assert hash(reason.statement.substitute(reason.bound, self.children[0])) == hash(left)
-        assert hash(reason.statement.substitute(reason.bound, self.children[1])) == hash(right)
-        return self.accept()
+        assert left.instantiates(reason.statement, reason.bound, self.children[0])
+        assert right.instantiates(reason.statement, reason.bound, self.children[1])
+        return self.accept(BY_UNIQUE, reason, left, right)
     
     # prove P(t) from All(x, P(x))
     def put(self, replace_by, reason):
@@ -364,93 +1371,495 @@ class Node:
         assert reason.is_proved()
         assert reason.type_ == TYPE_ALL
         assert not replace_by.is_sentence()
-        assert hash(self) == hash(reason.statement.substitute(reason.bound, replace_by))
-        return self.accept()
+        assert self.instantiates(reason.statement, reason.bound, replace_by)
+        return self.accept(PUT, replace_by, reason)
 
     # generalization
     # NOT applicable to BOUNDED variables,
     # which is a let-variable or a free variable of any assumption.
-    def generalize(self, reason):
+    # with the variables, it is over all of them at once, the first one outermost,
+    # and the bound variables of the sentence may have any names, as the digests do not see them
+    def generalize(self, reason, *variables):
         reason = proof_history[reason]
         assert reason.is_proved()
-        assert self.bound.is_generalizable()
-        assert hash(self) == hash(Node(TYPE_ALL, bound = self.bound, statement = reason))
-        return self.accept()
+        if len(variables) == 0:
+            variables = [self.bound]
+        closed = reason
+        for variable in reversed(variables):
+            assert variable.is_generalizable()
+            closed = Node(TYPE_ALL, bound = variable, statement = closed)
+        assert self.same(closed)
+        return self.accept(GENERALIZE, reason, *variables)
 
     def logical_form(self, mapping):
-        if self.type_ == TYPE_NOT:
-            return Node(TYPE_NOT, body = self.body.logical_form(mapping))
-        elif self.type_ == TYPE_IMPLY:
-            return Node(TYPE_IMPLY, assumption = self.assumption.logical_form(mapping), conclusion = self.conclusion.logical_form(mapping))
-        elif self.type_ in [TYPE_AND, TYPE_OR, TYPE_IFF]:
-            return Node(self.type_, left = self.left.logical_form(mapping), right = self.right.logical_form(mapping))
-        elif self.type_ in [TYPE_TRUE, TYPE_FALSE]:
-            return self
-        else:
-            if mapping.get(hash(self)) == None:
-                mapping[hash(self)] = len(mapping)
-            return Node(TYPE_PROPERTY, name = mapping[hash(self)], children = [])
+        formed = {}
+        stack = [(self, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if expanded:
+                arguments = {}
+                for key, value in node.arguments.items():
+                    arguments[key] = formed[id(value)]
+                formed[id(node)] = Node(node.type_, **arguments)
+            elif id(node) in formed:
+                continue
+            elif node.type_ in [TYPE_TRUE, TYPE_FALSE]:
+                formed[id(node)] = node
+            elif node.type_ in [TYPE_NOT, TYPE_IMPLY, TYPE_AND, TYPE_OR, TYPE_IFF]:
+                stack.append((node, True))
+                for value in reversed(list(node.arguments.values())):
+                    stack.append((value, False))
+            else:
+                if mapping.get(node.digest) == None:
+                    mapping[node.digest] = len(mapping)
+                formed[id(node)] = Node(TYPE_PROPERTY, name = mapping[node.digest], children = [])
+        return formed[id(self)]
+
+    # the logical form as a list of instructions, each refering to the results of the former ones
+    def logical_program(self):
+        position = {}
+        program = []
+        for node in self.postorder():
+            position[id(node)] = len(program)
+            if node.type_ == TYPE_PROPERTY:
+                program.append((node.type_, node.name))
+            else:
+                program.append((node.type_, [position[id(subnode)] for subnode in node.subnodes()]))
+        return program
+
+    # the programs of the logical forms, without making the logical forms
+    # the atoms are numbered in the mapping, by their digests, or by the keys for the digests if given
+    @staticmethod
+    def logical_programs(nodes, mapping, keys = None):
+        if keys == None:
+            keys = {}
+        programs = []
+        for node in nodes:
+            position = {}
+            program = []
+            stack = [(node, False)]
+            while len(stack) > 0:
+                node, walked = stack.pop()
+                if walked:
+                    program.append((node.type_, [position[id(subnode)] for subnode in node.subnodes()]))
+                elif id(node) in position:
+                    continue
+                elif node.type_ in [TYPE_NOT, TYPE_IMPLY, TYPE_AND, TYPE_OR, TYPE_IFF]:
+                    stack.append((node, True))
+                    stack += [(subnode, False) for subnode in reversed(node.subnodes())]
+                    continue
+                elif node.type_ in [TYPE_TRUE, TYPE_FALSE]:
+                    program.append((node.type_, []))
+                else:
+                    key = keys.get(node.digest, node.digest)
+                    if mapping.get(key) == None:
+                        mapping[key] = len(mapping)
+                    program.append((TYPE_PROPERTY, mapping[key]))
+                position[id(node)] = len(program) - 1
+            budget.visit(len(position))
+            programs.append(program)
+        return programs
+
+    @staticmethod
+    def logical_run(program, truth_assign):
+        values = []
+        for type_, operand in program:
+            if type_ == TYPE_PROPERTY:
+                values.append(truth_assign[operand])
+            elif type_ == TYPE_NOT:
+                values.append(not values[operand[0]])
+            elif type_ == TYPE_AND:
+                values.append(values[operand[0]] and values[operand[1]])
+            elif type_ == TYPE_OR:
+                values.append(values[operand[0]] or values[operand[1]])
+            elif type_ == TYPE_IMPLY:
+                values.append(values[operand[1]] or not values[operand[0]])
+            elif type_ == TYPE_IFF:
+                values.append(values[operand[0]] == values[operand[1]])
+            elif type_ == TYPE_TRUE:
+                values.append(True)
+            elif type_ == TYPE_FALSE:
+                values.append(False)
+            else:
+                assert False
+        return values[-1]
+
+    # logical_run over a partial assignment, where None is unknown
+    @staticmethod
+    def logical_bound(program, truth_assign):
+        return Node.logical_values(program, truth_assign)[-1]
+
+    # the values of all the instructions of logical_bound
+    @staticmethod
+    def logical_values(program, truth_assign):
+        values = []
+        for type_, operand in program:
+            if type_ == TYPE_PROPERTY:
+                values.append(truth_assign[operand])
+            elif type_ == TYPE_NOT:
+                value = values[operand[0]]
+                values.append(None if value == None else not value)
+            elif type_ == TYPE_AND:
+                left, right = values[operand[0]], values[operand[1]]
+                if left == False or right == False:
+                    values.append(False)
+                elif left == None or right == None:
+                    values.append(None)
+                else:
+                    values.append(True)
+            elif type_ == TYPE_OR:
+                left, right = values[operand[0]], values[operand[1]]
+                if left == True or right == True:
+                    values.append(True)
+                elif left == None or right == None:
+                    values.append(None)
+                else:
+                    values.append(False)
+            elif type_ == TYPE_IMPLY:
+                assumption, conclusion = values[operand[0]], values[operand[1]]
+                if assumption == False or conclusion == True:
+                    values.append(True)
+                elif assumption == None or conclusion == None:
+                    values.append(None)
+                else:
+                    values.append(False)
+            elif type_ == TYPE_IFF:
+                left, right = values[operand[0]], values[operand[1]]
+                values.append(None if left == None or right == None else left == right)
+            elif type_ == TYPE_TRUE:
+                values.append(True)
+            elif type_ == TYPE_FALSE:
+                values.append(False)
+            else:
+                assert False
+        return values
 
     def logical_evaluate(self, truth_assign):
-        if self.type_ == TYPE_PROPERTY:
-            return truth_assign[self.name]
-        elif self.type_ == TYPE_NOT:
-            return not self.body.logical_evaluate(truth_assign)
-        elif self.type_ == TYPE_AND:
-            return self.left.logical_evaluate(truth_assign) and self.right.logical_evaluate(truth_assign)
-        elif self.type_ == TYPE_OR:
-            return self.left.logical_evaluate(truth_assign) or self.right.logical_evaluate(truth_assign)
-        elif self.type_ == TYPE_IMPLY:
-            return self.conclusion.logical_evaluate(truth_assign) or not self.assumption.logical_evaluate(truth_assign)
-        elif self.type_ == TYPE_IFF:
-            return self.left.logical_evaluate(truth_assign) == self.right.logical_evaluate(truth_assign)
-        elif self.type_ == TYPE_TRUE:
-            return True
-        elif self.type_ == TYPE_FALSE:
-            return False
-        else:
-            assert False
+        return Node.logical_run(self.logical_program(), truth_assign)
+
+    # the atoms of the logical form, each once
+    def atoms(self):
+        atoms = {}
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.type_ in [TYPE_NOT, TYPE_IMPLY, TYPE_AND, TYPE_OR, TYPE_IFF]:
+                stack += node.subnodes()
+            elif not node.type_ in [TYPE_TRUE, TYPE_FALSE]:
+                atoms[node.digest] = node
+        return list(atoms.values())
+
+    # whether the sentence is true whenever the reasons are, by the truth table
+    # the table is searched atom by atom, skipping the rows decided by the atoms assigned so far
+    def entailed(self, reasons):
+        mapping = {}
+        logical_forms = Node.logical_programs(reasons + [self], mapping)
+        target = logical_forms.pop()
+        return Node.search(logical_forms, target, len(mapping))
+
+    # the search of entailed, over the programs of count atoms
+    # the reasons and the negation of the target must contradict, checked in the groups connected by the atoms
+    @staticmethod
+    def search(logical_forms, target, count):
+        programs = logical_forms + [target + [(TYPE_NOT, [len(target) - 1])]]
+        groups = {} # the first program having the atom -> programs in the group
+        first = {} # atom -> the first program having it
+        parent = list(range(len(programs)))
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+        for index, program in enumerate(programs):
+            for type_, operand in program:
+                if type_ == TYPE_PROPERTY:
+                    if first.get(operand) == None:
+                        first[operand] = index
+                    else:
+                        parent[find(index)] = find(first[operand])
+        for index in reversed(range(len(programs))):
+            root = find(index)
+            if groups.get(root) == None:
+                groups[root] = []
+            groups[root].append(programs[index])
+        for group in sorted(groups.values(), key = lambda group : group[0] is not programs[-1]):
+            if Node.contradict(group, count):
+                return True
+        return False
+
+    # whether the programs of count atoms are never all true
+    # the forced atoms and the pure atoms are assigned before the search over the others
+    @staticmethod
+    def contradict(programs, count):
+        truth_assign = [None] * count
+        while True:
+            if not Node.propagate(programs, truth_assign):
+                return True
+            pure = Node.pure_atoms(programs, truth_assign)
+            if len(pure) == 0:
+                break
+            for atom, value in pure.items():
+                truth_assign[atom] = value
+        mapping = {}
+        restricted = []
+        for program in programs:
+            value = Node.logical_bound(program, truth_assign)
+            if value == False:
+                return True
+            if value == True:
+                continue
+            restricted.append([])
+            for type_, operand in program:
+                if type_ != TYPE_PROPERTY:
+                    restricted[-1].append((type_, operand))
+                elif truth_assign[operand] != None:
+                    restricted[-1].append((TYPE_TRUE if truth_assign[operand] else TYPE_FALSE, []))
+                else:
+                    if mapping.get(operand) == None:
+                        mapping[operand] = len(mapping)
+                    restricted[-1].append((TYPE_PROPERTY, mapping[operand]))
+        return Node.table_search(restricted, [(TYPE_FALSE, [])], len(mapping))
+
+    # assign the atoms forced for all the programs to be true, until nothing changes
+    # return whether the programs can be all true so far
+    @staticmethod
+    def propagate(programs, truth_assign):
+        changed = True
+        while changed:
+            changed = False
+            for program in programs:
+                budget.visit(len(program))
+                values = Node.logical_values(program, truth_assign)
+                required = [None] * len(program)
+                required[-1] = True
+                for index in reversed(range(len(program))):
+                    need = required[index]
+                    if need == None:
+                        continue
+                    if values[index] != None:
+                        if values[index] != need:
+                            return False
+                        continue
+                    type_, operand = program[index]
+                    forced = []
+                    if type_ == TYPE_PROPERTY:
+                        if truth_assign[operand] != None and truth_assign[operand] != need:
+                            return False
+                        truth_assign[operand] = need
+                        changed = True
+                    elif type_ == TYPE_NOT:
+                        forced = [(operand[0], not need)]
+                    elif type_ == TYPE_AND and need:
+                        forced = [(operand[0], True), (operand[1], True)]
+                    elif type_ == TYPE_OR and not need:
+                        forced = [(operand[0], False), (operand[1], False)]
+                    elif type_ == TYPE_IMPLY and not need:
+                        forced = [(operand[0], True), (operand[1], False)]
+                    elif type_ in [TYPE_AND, TYPE_OR]:
+                        # one of them is enough to decide, so the other is forced if the one cannot
+                        for this, other in [(operand[0], operand[1]), (operand[1], operand[0])]:
+                            if values[this] == (not need):
+                                forced = [(other, need)]
+                    elif type_ == TYPE_IMPLY:
+                        if values[operand[0]] == True:
+                            forced = [(operand[1], True)]
+                        elif values[operand[1]] == False:
+                            forced = [(operand[0], False)]
+                    elif type_ == TYPE_IFF:
+                        for this, other in [(operand[0], operand[1]), (operand[1], operand[0])]:
+                            if values[this] != None:
+                                forced = [(other, values[this] == need)]
+                    for position, value in forced:
+                        if required[position] != None and required[position] != value:
+                            return False
+                        required[position] = value
+        return True
+
+    # the atoms of a single polarity in the programs not true yet, with the values making them true
+    @staticmethod
+    def pure_atoms(programs, truth_assign):
+        polarities = {} # atom -> set of the polarities
+        for program in programs:
+            if Node.logical_bound(program, truth_assign) == True:
+                continue
+            polarity = [set() for instruction in program]
+            polarity[-1].add(True)
+            for index in reversed(range(len(program))):
+                type_, operand = program[index]
+                if type_ == TYPE_PROPERTY:
+                    if truth_assign[operand] == None:
+                        if polarities.get(operand) == None:
+                            polarities[operand] = set()
+                        polarities[operand] |= polarity[index]
+                elif type_ == TYPE_NOT:
+                    polarity[operand[0]] |= {not sign for sign in polarity[index]}
+                elif type_ in [TYPE_AND, TYPE_OR]:
+                    polarity[operand[0]] |= polarity[index]
+                    polarity[operand[1]] |= polarity[index]
+                elif type_ == TYPE_IMPLY:
+                    polarity[operand[0]] |= {not sign for sign in polarity[index]}
+                    polarity[operand[1]] |= polarity[index]
+                elif type_ == TYPE_IFF and len(polarity[index]) > 0:
+                    polarity[operand[0]] |= {True, False}
+                    polarity[operand[1]] |= {True, False}
+        return {atom : next(iter(signs)) for atom, signs in polarities.items() if len(signs) == 1}
+
+    # the search of contradict, atom by atom, or on truth_table_pool for the wide tables
+    @staticmethod
+    def table_search(logical_forms, target, count):
+        if count >= truth_table_pool.threshold:
+            return truth_table_pool.entailed(logical_forms, target, count)
+        stack = [[]]
+        while len(stack) > 0:
+            budget.enumerate()
+            truth_assign = stack.pop()
+            partial_assign = truth_assign + [None] * (count - len(truth_assign))
+            consider = True
+            for reason in logical_forms:
+                if Node.logical_bound(reason, partial_assign) == False:
+                    consider = False
+                    break
+            if not consider or Node.logical_bound(target, partial_assign) == True:
+                continue
+            if len(truth_assign) == count:
+                return False
+            stack.append(truth_assign + [False])
+            stack.append(truth_assign + [True])
+        return True
 
     # this namely deduces a tautological result from the given reasons
     def tautology(self, *reasons):
+        logical_forms = []
+        for reason in reasons:
+            reason = proof_history[reason]
+            assert reason.is_proved()
+            logical_forms.append(reason)
+        assert self.entailed(logical_forms)
+        return self.accept(TAUTOLOGY, *logical_forms)
+
+    # TAUTOLOGY without the reasons, trying the sentences in scope nearer by the atoms first
+    def auto_tautology(self):
+        reasons = []
+        for layer in premise_index.layers(self):
+            reasons += layer
+            if self.entailed(reasons):
+                return self.accept(TAUTOLOGY, *reasons)
+        assert False
+
+    # PUT for each of the terms and then TAUTOLOGY with the instance and the reasons, without making the instance
+    def instantiate(self, theorem, terms, *reasons):
+        name = theorem
+        theorem = proof_history[theorem]
+        assert theorem.is_proved()
         mapping = {}
+        body = theorem
+        for term in terms:
+            assert body.type_ == TYPE_ALL
+            assert not term.is_sentence()
+            mapping[body.bound.counter] = term
+            body = body.statement
         logical_forms = []
         for reason in reasons:
             reason = proof_history[reason]
             assert reason.is_proved()
-            logical_forms.append(reason.logical_form(mapping))
-        target = self.logical_form(mapping)
-        case_number = 2 ** len(mapping)
-        for case_index in range(0, case_number):
-            truth_assign = []
-            for assign_index in range(0, len(mapping)):
-                truth_assign.append(bool(case_index & (1 << assign_index)))
-            consider = True
-            for reason in logical_forms:
-                if not reason.logical_evaluate(truth_assign):
-                    consider = False
+            logical_forms.append(reason)
+        # an instance made before is simply a reason
+        instance = instance_cache.get(name, theorem, terms) if isinstance(name, str) else None
+        if instance != None:
+            assert self.entailed([instance] + logical_forms)
+            return self.accept(INSTANTIATE, theorem, list(terms), *logical_forms)
+        assert Node.instance_entails(body, mapping, logical_forms, self)
+        if isinstance(name, str):
+            instance_cache.put(name, theorem, terms, (body, mapping))
+        return self.accept(INSTANTIATE, theorem, list(terms), *logical_forms)
+
+    # whether the instance of the body by the mapping and the reasons entail the target, without making the instance:
+    # each atom of the instance is the atom of the target or the reasons it matches, or an atom of its own if none
+    @staticmethod
+    def instance_entails(body, mapping, reasons, target):
+        candidates = {}
+        for sentence in reasons + [target]:
+            for atom in sentence.atoms():
+                key = (atom.type_, atom.arguments.get("name"))
+                if candidates.get(key) == None:
+                    candidates[key] = []
+                candidates[key].append(atom)
+        keys = {}
+        for atom in body.atoms():
+            if atom.free.isdisjoint(mapping):
+                continue
+            keys[atom.digest] = (INSTANTIATE, atom.digest)
+            for candidate in candidates.get((atom.type_, atom.arguments.get("name")), []):
+                if candidate.matches(atom, mapping):
+                    keys[atom.digest] = candidate.digest
                     break
-            if consider:
-                assert target.logical_evaluate(truth_assign)
-        return self.accept()
+        atoms = {}
+        programs = Node.logical_programs([body], atoms, keys) + Node.logical_programs(reasons + [target], atoms)
+        target = programs.pop()
+        return Node.search(programs, target, len(atoms))
+
+    # the occurrence-th atom of the defined property in the reason, counting from 0 in preorder, replaced by its definiens
+    # or for a defined function, the instance of its definition at the occurrence-th term of it
+    def unfold(self, name, occurrence, reason):
+        reason = proof_history[reason]
+        assert reason.is_proved()
+        definition, type_ = definition_index.get(name)[ : 2]
+        count = occurrence
+        for node, path in reason.paths():
+            if node.type_ == type_ and node.name == name:
+                if count == 0:
+                    break
+                count -= 1
+        else:
+            assert False
+        unfolded = definition_index.unfold(name, node)
+        if type_ == TYPE_PROPERTY:
+            assert self.same(reason.replaced(path, unfolded))
+        else:
+            assert node.free.isdisjoint(reason.bounded)
+            assert self.same(unfolded)
+        return self.accept(UNFOLD, name, occurrence, reason, definition)
 
-    def interchangable(self, counterpart, A, B):
-        if hash(self) == hash(counterpart):
-            return True
-        elif hash(self) == hash(A) and hash(counterpart) == hash(B):
-            return True
-        elif hash(self) == hash(B) and hash(counterpart) == hash(A):
-            return True
+    # the occurrence-th instance of the definiens of the property in the reason, counting from 0 in preorder,
+    # replaced by the atom of the property
+    def fold(self, name, occurrence, reason):
+        reason = proof_history[reason]
+        assert reason.is_proved()
+        definition = definition_index.get(name)[0]
+        count = occurrence
+        for node, path in reason.paths():
+            atom = definition_index.fold(name, node)
+            if atom != None:
+                if count == 0:
+                    break
+                count -= 1
         else:
-            if self.type_ != counterpart.type_:
+            assert False
+        assert self.same(reason.replaced(path, atom))
+        return self.accept(FOLD, name, occurrence, reason, definition)
+
+    def interchangable(self, counterpart, A, B):
+        stack = [(self, counterpart)]
+        while len(stack) > 0:
+            node, counterpart = stack.pop()
+            if node.same(counterpart):
+                continue
+            elif node.same(A) and counterpart.same(B):
+                continue
+            elif node.same(B) and counterpart.same(A):
+                continue
+            if node.type_ != counterpart.type_:
                 return False
-            for key in self.arguments.keys():
+            # distinct variables, which have no arguments to compare
+            if node.type_ == TYPE_VARIABLE:
+                return False
+            for key in node.arguments.keys():
                 if counterpart.arguments.get(key) == None:
                     return False
             for key in counterpart.arguments.keys():
-                if self.arguments.get(key) == None:
+                if node.arguments.get(key) == None:
                     return False
-            for key, value in self.arguments.items():
+            for key, value in node.arguments.items():
                 value2 = counterpart.arguments[key]
                 if isinstance(value, list):
                     if not isinstance(value2, list):
@@ -458,15 +1867,15 @@ class Node:
                     if len(value) != len(value2):
                         return False
                     for index, element in enumerate(value):
-                        if not element.interchangable(value2[index], A, B):
-                            return False
+                        stack.append((element, value2[index]))
                 elif isinstance(value, Node):
-                    if not value.interchangable(counterpart.arguments[key], A, B):
+                    if not isinstance(value2, Node):
                         return False
+                    stack.append((value, value2))
                 else:
                     if value != value2:
                         return False
-            return True
+        return True
 
     # reason : P, A == B
     # target : Q,
@@ -479,7 +1888,102 @@ class Node:
         assert equality.type_ == TYPE_PROPERTY
         assert equality.name == "equal"
         assert self.interchangable(reason, equality.children[0], equality.children[1])
-        return self.accept()
+        return self.accept(REPLACE, reason, equality)
+
+    # the subnodes in the order the sentence is written, i.e. the children of a function or a property,
+    # or the fields of encoding_fields, e.g. the bound variable and then the statement of a quantifier
+    def written(self):
+        if self.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+            return self.children
+        if self.type_ == TYPE_VARIABLE:
+            return []
+        return [self.arguments[field] for field in encoding_fields[self.type_]]
+
+    # REPLACE at the given positions only
+    # reason : P, A == B
+    # target : Q,
+    # where P & Q are the same but at the end of each path, where one has A and the other has B
+    # a path is the positions of the subnodes from the root, each counting from 0 in the order the sentence is written,
+    # e.g. (1, 0) for s in All(x, P(s, y)), and no path may be inside another
+    def replace_at(self, paths, reason, equality):
+        reason = proof_history[reason]
+        equality = proof_history[equality]
+        assert reason.is_proved()
+        assert equality.is_proved()
+        assert equality.type_ == TYPE_PROPERTY
+        assert equality.name == "equal"
+        paths = [tuple(path) for path in paths]
+        self.interchanged_at(reason, paths, *equality.children)
+        return self.accept(REPLACE_AT, paths, reason, equality)
+
+    # the check of replace_at, walking the paths only
+    def interchanged_at(self, counterpart, paths, A, B):
+        assert len(paths) > 0
+        for index, path in enumerate(paths):
+            for other in paths[index + 1 : ]:
+                assert path[ : len(other)] != other and other[ : len(path)] != path
+        stack = [(self, counterpart, paths, 0, frozenset())]
+        while len(stack) > 0:
+            node, counterpart, below, depth, bounded = stack.pop()
+            budget.visit()
+            if len(below) == 1 and len(below[0]) == depth:
+                assert A.free.isdisjoint(bounded) and B.free.isdisjoint(bounded)
+                assert node.same(A) and counterpart.same(B) or node.same(B) and counterpart.same(A)
+                continue
+            assert node.type_ == counterpart.type_ and node.type_ != TYPE_VARIABLE
+            if node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                assert node.name == counterpart.name
+            subnodes, counterparts = node.written(), counterpart.written()
+            assert len(subnodes) == len(counterparts)
+            if node.type_ in [TYPE_ALL, TYPE_EXIST, TYPE_UNIQUELY_EXIST]:
+                bounded = bounded | set([node.bound.counter])
+            if len(below) == 1:
+                position = below[0][depth]
+                assert 0 <= position < len(subnodes)
+                for index in range(0, len(subnodes)):
+                    if index != position:
+                        assert subnodes[index].same(counterparts[index])
+                stack.append((subnodes[position], counterparts[position], below, depth + 1, bounded))
+                continue
+            assert all([0 <= path[depth] < len(subnodes) for path in below])
+            for position in range(0, len(subnodes)):
+                paths_below = [path for path in below if path[depth] == position]
+                if len(paths_below) == 0:
+                    assert subnodes[position].same(counterparts[position])
+                else:
+                    stack.append((subnodes[position], counterparts[position], paths_below, depth + 1, bounded))
+
+    # equivalence closure
+    # from A ~ B, C ~ B, C ~ D, ... deduce A ~ D at once,
+    # where ~ is a relation registered by register_equivalence
+    def equivalence(self, *reasons):
+        assert self.type_ == TYPE_PROPERTY
+        assert equivalence_relations.get(self.name) != None
+        assert len(self.children) == 2
+        closure = UnionFind()
+        for reason in reasons:
+            reason = proof_history[reason]
+            assert reason.is_proved()
+            assert reason.type_ == TYPE_PROPERTY
+            assert reason.name == self.name
+            closure.union(reason.children[0].digest, reason.children[1].digest, reason)
+        chain = closure.explain(self.children[0].digest, self.children[1].digest)
+        assert chain != None
+        return self.accept(EQUIVALENCE, *chain)
+
+    # congruence closure
+    # reason : P
+    # target : Q,
+    # where P & Q are sentences, only differ by interchanging terms
+    # which are equal by the proved equalities in scope
+    def congruence(self, *reasons):
+        assert self.is_sentence()
+        for reason in reasons:
+            reason = proof_history[reason]
+            assert reason.is_proved()
+            if congruence_closure.congruent(self, reason):
+                return self.accept(CONGRUENCE, reason)
+        assert False
 
     # class existence theorem
     # this is actually not an axiom, but is PROVABLE, due to Goedel
@@ -492,17 +1996,17 @@ class Node:
     
         cursor = self
         assert cursor.type_ == TYPE_UNIQUELY_EXIST
-        assert hash(cursor.bound) == hash(output)
+        assert cursor.bound.same(output)
         cursor = cursor.statement
         assert cursor.type_ == TYPE_ALL
         element = cursor.bound
         cursor = cursor.statement
         assert cursor.type_ == TYPE_IFF
-        assert hash(cursor.left) == hash(Node(TYPE_PROPERTY, name = "in", children = [element, output]))
+        assert cursor.left.same(Node(TYPE_PROPERTY, name = "in", children = [element, output]))
         cursor = cursor.right
         assert cursor.type_ == TYPE_AND
-        assert hash(cursor.left) == hash(Node(TYPE_PROPERTY, name = "set", children = [element]))
-        return self.accept()
+        assert cursor.left.same(Node(TYPE_PROPERTY, name = "set", children = [element]))
+        return self.accept(DEFINE_CLASS, output)
 
     # duality
     # not All(x, P(x)) iff Exist not(x, P(x))
@@ -519,7 +2023,7 @@ class Node:
             else:
                 assert False
             assert self.left.body.bound.counter == self.right.bound.counter
-            assert hash(self.left.body.statement) == hash(self.right.statement.body)
+            assert self.left.body.statement.same(self.right.statement.body)
         elif self.right.type_ == TYPE_NOT:
             if self.right.body.type_ == TYPE_ALL:
                 assert self.left.type_ == TYPE_EXIST
@@ -532,7 +2036,7 @@ class Node:
         else:
             assert False
 
-        return self.accept()
+        return self.accept(DUAL)
 
 
     # CAUTION!
@@ -592,7 +2096,34 @@ class Node:
 
 
 
+    # the steps written directly, not inside the derived rules, are passed to Node.recorder
+    # and a derived rule written directly runs under a Rollback
     def __matmul__(self, B): # reserved!
+        if Node.depth == 0:
+            budget.step()
+            if isinstance(B, tuple) and len(B) > 1 and B[1] in callbacks:
+                Node.rollback = Rollback()
+        if memory_profile.active:
+            memory_profile.enter()
+        Node.depth += 1
+        try:
+            result = self.infer(B)
+        except Exception:
+            if Node.depth == 1 and Node.rollback != None:
+                Node.rollback.restore()
+            raise
+        finally:
+            Node.depth -= 1
+            if Node.depth == 0 and Node.rollback != None:
+                Node.rollback.close()
+                Node.rollback = None
+            if memory_profile.active:
+                memory_profile.exit(B[1] if isinstance(B, tuple) and len(B) > 1 else None)
+        if Node.depth == 0 and Node.recorder != None:
+            Node.recorder.step(self, B)
+        return result
+
+    def infer(self, B):
         if not isinstance(B, tuple):
             return self.save(B)
 
@@ -608,6 +2139,8 @@ class Node:
                 return self.deduce(*arguments).save(save_as)
             elif inference == TAUTOLOGY:
                 return self.tautology(*arguments).save(save_as)
+            elif inference == AUTO_TAUTOLOGY:
+                return self.auto_tautology(*arguments).save(save_as)
             elif inference == DEFINE_PROPERTY:
                 return self.define_property(*arguments).save(save_as)
             elif inference == DEFINE_FUNCTION:
@@ -626,8 +2159,20 @@ class Node:
                 return self.put(*arguments).save(save_as)
             elif inference == REPLACE:
                 return self.replace(*arguments).save(save_as)
+            elif inference == REPLACE_AT:
+                return self.replace_at(*arguments).save(save_as)
+            elif inference == CONGRUENCE:
+                return self.congruence(*arguments).save(save_as)
+            elif inference == EQUIVALENCE:
+                return self.equivalence(*arguments).save(save_as)
+            elif inference == INSTANTIATE:
+                return self.instantiate(*arguments).save(save_as)
+            elif inference == UNFOLD:
+                return self.unfold(*arguments).save(save_as)
+            elif inference == FOLD:
+                return self.fold(*arguments).save(save_as)
             elif inference == AXIOM:
-                return self.accept().save(save_as)
+                return self.accept(AXIOM).save(save_as)
             elif inference == GENERALIZE:
                 return self.generalize(*arguments).save(save_as)
             elif inference == LET:
@@ -664,7 +2209,1139 @@ class Node:
 true = Node(TYPE_TRUE)
 false = Node(TYPE_FALSE)
 
+congruence_closure = CongruenceClosure()
+premise_index = PremiseIndex()
+# (type, counter or name, ids of the subnodes) -> weak reference to the node loaded by Node.loaded
+# a live node keeps its subnodes alive, so the ids in its key are still theirs
+loaded_nodes = {}
+
+# the truth tables of threshold or more atoms, in ranges of rows on a pool of processes, a block of rows as the bits of integers
+class TruthTablePool:
+    block = 16 # log2 of the rows in a block
+    cancelled = None # the event to stop the ranges, in the workers
+
+    def __init__(self, threshold = 22, workers = None, shards = 8):
+        self.threshold = threshold
+        self.workers = os.cpu_count() if workers == None else workers
+        self.shards = shards # ranges per worker
+        self.executor = None
+        self.event = None
+        self.counterexample = None
+
+    def configure(self, threshold = None, workers = None):
+        if threshold != None:
+            self.threshold = threshold
+        if workers != None and workers != self.workers:
+            self.close()
+            self.workers = workers
+
+    def close(self):
+        if self.executor != None:
+            self.executor.shutdown(cancel_futures = True)
+            self.executor = None
+            self.event = None
+
+    # the workers are forked if possible, so that they need not import the proofs again
+    def start(self):
+        if self.executor == None:
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            else:
+                context = multiprocessing.get_context()
+            self.event = context.Event()
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context = context, initializer = TruthTablePool.initialize, initargs = (self.event,))
+        self.event.clear()
+
+    @staticmethod
+    def initialize(event):
+        TruthTablePool.cancelled = event
+
+    # whether the target is true at every row where the reasons are
+    def entailed(self, logical_forms, target, count):
+        block = min(count, TruthTablePool.block)
+        blocks = 1 << (count - block)
+        shards = min(blocks, max(self.workers, 1) * self.shards)
+        bounds = [blocks * index // shards for index in range(shards + 1)]
+        row = None
+        if self.workers <= 1 or shards == 1:
+            for index in range(shards):
+                row = TruthTablePool.check(logical_forms, target, count, bounds[index], bounds[index + 1])
+                if row != None:
+                    break
+        else:
+            self.start()
+            futures = [self.executor.submit(TruthTablePool.check, logical_forms, target, count, bounds[index], bounds[index + 1]) for index in range(shards)]
+            ranges = dict([(future, bounds[index + 1] - bounds[index]) for index, future in enumerate(futures)])
+            pending = set(futures)
+            try:
+                # the budget is charged for the ranges done, and the clock is looked at while waiting
+                while len(pending) > 0 and row == None:
+                    done, pending = concurrent.futures.wait(pending, timeout = 0.1, return_when = concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        budget.enumerate(ranges[future] << block)
+                        if future.result() != None and row == None:
+                            row = future.result()
+                    budget.check()
+            finally:
+                if len(pending) > 0:
+                    self.event.set()
+                    for other in futures:
+                        other.cancel()
+                concurrent.futures.wait(futures)
+        if row == None:
+            self.counterexample = None
+            return True
+        self.counterexample = [bool(row >> atom & 1) for atom in range(count)]
+        return False
+
+    # the first row, from the first block to the last block (exclusive), where the reasons are true but the target is not, or None
+    # the atom i is true at the rows with the bit i set
+    @staticmethod
+    def check(logical_forms, target, count, first, last):
+        block = min(count, TruthTablePool.block)
+        full = (1 << (1 << block)) - 1
+        masks = []
+        for atom in range(block):
+            period = 1 << (atom + 1)
+            masks.append((((1 << (1 << atom)) - 1) << (1 << atom)) * (full // ((1 << period) - 1)))
+        for index in range(first, last):
+            if TruthTablePool.cancelled == None:
+                budget.enumerate(1 << block)
+            elif TruthTablePool.cancelled.is_set():
+                return None
+            truth_assign = masks + [full if index >> (atom - block) & 1 else 0 for atom in range(block, count)]
+            rows = full ^ TruthTablePool.run(target, truth_assign, full)
+            for reason in logical_forms:
+                if rows == 0:
+                    break
+                rows &= TruthTablePool.run(reason, truth_assign, full)
+            if rows != 0:
+                return (index << block) + (rows & -rows).bit_length() - 1
+        return None
+
+    # Node.logical_run over the rows of a block at once
+    @staticmethod
+    def run(program, truth_assign, full):
+        values = []
+        for type_, operand in program:
+            if type_ == TYPE_PROPERTY:
+                values.append(truth_assign[operand])
+            elif type_ == TYPE_NOT:
+                values.append(full ^ values[operand[0]])
+            elif type_ == TYPE_AND:
+                values.append(values[operand[0]] & values[operand[1]])
+            elif type_ == TYPE_OR:
+                values.append(values[operand[0]] | values[operand[1]])
+            elif type_ == TYPE_IMPLY:
+                values.append((full ^ values[operand[0]]) | values[operand[1]])
+            elif type_ == TYPE_IFF:
+                values.append(full ^ (values[operand[0]] ^ values[operand[1]]))
+            elif type_ == TYPE_TRUE:
+                values.append(full)
+            elif type_ == TYPE_FALSE:
+                values.append(0)
+            else:
+                assert False
+        return values[-1]
+
+truth_table_pool = TruthTablePool()
+
+# the nodes and the bytes kept by each rule, without those of the rules inside it, off unless started
+# memory_profile.start()
+# ... # the proofs to measure
+# print(memory_profile.report()) # or memory_profile.sample() for the numbers
+class MemoryProfile:
+    def __init__(self):
+        self.active = False
+        self.tracing = False # whether tracemalloc was started here
+        self.rules = {} # rule -> [steps, nodes, bytes]
+        self.stack = [] # [nodes, bytes, nodes inside, bytes inside] of each step running
+        self.made = 0 # made_nodes at the start
+
+    # tracemalloc slows the steps down a few times, so trace = False counts only the nodes
+    def start(self, trace = True):
+        self.active = True
+        self.rules = {}
+        self.stack = []
+        self.made = made_nodes
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop(self):
+        self.active = False
+        self.stack = []
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    @staticmethod
+    def traced():
+        if not tracemalloc.is_tracing():
+            return 0
+        return tracemalloc.get_traced_memory()[0]
+
+    def enter(self):
+        self.stack.append([made_nodes, MemoryProfile.traced(), 0, 0])
+
+    # a step started before start() is not counted
+    def exit(self, rule):
+        if len(self.stack) == 0:
+            return
+        made, traced, made_inside, traced_inside = self.stack.pop()
+        made = made_nodes - made
+        traced = MemoryProfile.traced() - traced
+        if self.rules.get(rule) == None:
+            self.rules[rule] = [0, 0, 0]
+        self.rules[rule][0] += 1
+        self.rules[rule][1] += made - made_inside
+        self.rules[rule][2] += traced - traced_inside
+        if len(self.stack) > 0:
+            self.stack[-1][2] += made
+            self.stack[-1][3] += traced
+
+    # the names of the rules, from the constants of the kernel and the callbacks
+    @staticmethod
+    def rule_names():
+        names = {None : "save"}
+        for name, value in globals().items():
+            if name.isupper() and isinstance(value, int) and value >= DEDUCE and not name.startswith(("RECORD_", "VALUE_")):
+                names[value] = name
+        return names
+
+    # the bytes of the nodes, counting the ones shared only once
+    @staticmethod
+    def footprint(nodes, counted):
+        total = 0
+        for node in nodes:
+            for subnode in node.postorder():
+                if id(subnode) in counted:
+                    continue
+                counted.add(id(subnode))
+                total += sys.getsizeof(subnode) + sys.getsizeof(subnode.__dict__) + sys.getsizeof(subnode.arguments)
+                total += sys.getsizeof(subnode.free) + sys.getsizeof(subnode.bounded) + sys.getsizeof(subnode.digest)
+                if subnode.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                    total += sys.getsizeof(subnode.children)
+        return total
+
+    # the counts of the values by the powers of two, i.e. 2 ** k -> the values from 2 ** k up to 2 ** (k + 1) - 1
+    @staticmethod
+    def histogram(values):
+        counts = {}
+        for value in values:
+            bucket = 1 << (max(value, 1).bit_length() - 1)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return dict(sorted(counts.items()))
+
+    @staticmethod
+    def depth(node):
+        depths = {}
+        for subnode in node.postorder():
+            depths[id(subnode)] = 1 + max([depths[id(child)] for child in subnode.subnodes()], default = 0)
+        return depths[id(node)]
+
+    @staticmethod
+    def rate(hits, misses):
+        if hits + misses == 0:
+            return 0.0
+        return hits / (hits + misses)
+
+    def sample(self):
+        names = MemoryProfile.rule_names()
+        rules = {}
+        for rule, (steps, made, traced) in self.rules.items():
+            rules[names.get(rule, rule)] = {"steps" : steps, "nodes" : made, "bytes" : traced}
+        attributed = sum([entry[1] for entry in self.rules.values()])
+        # the theorems of the later names are charged only for the nodes not shared with the earlier ones
+        counted = set()
+        theorems = {}
+        for name, sentence in dict.items(proof_history):
+            if isinstance(name, str):
+                theorems[name] = MemoryProfile.footprint([sentence], counted)
+        statements = dict([(id(sentence), sentence) for sentence in dict.values(proof_history)])
+        retained = sum(theorems.values()) + MemoryProfile.footprint(statements.values(), counted)
+        caches = {
+            "instances" : {"hits" : instance_cache.hits, "misses" : instance_cache.misses, "rate" : instance_cache.hit_rate()},
+            "definitions" : {"hits" : definition_index.hits, "misses" : definition_index.misses,
+                "rate" : MemoryProfile.rate(definition_index.hits, definition_index.misses)},
+            "schemas" : {"hits" : schema_cache.hits, "misses" : schema_cache.misses,
+                "rate" : MemoryProfile.rate(schema_cache.hits, schema_cache.misses)},
+        }
+        traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "nodes" : made_nodes - self.made,
+            "rules" : rules,
+            "outside" : made_nodes - self.made - attributed, # the nodes made out of the steps, e.g. writing the sentences
+            "theorems" : theorems,
+            "retained" : retained, # the bytes of all the sentences in proof_history
+            "sizes" : MemoryProfile.histogram([sentence.size for sentence in statements.values()]),
+            "depths" : MemoryProfile.histogram([MemoryProfile.depth(sentence) for sentence in statements.values()]),
+            "caches" : caches,
+            "traced" : {"current" : traced[0], "peak" : traced[1]},
+        }
+
+    def report(self, top = 10):
+        sample = self.sample()
+        lines = ["nodes made : %d, out of the steps : %d" % (sample["nodes"], sample["outside"])]
+        if self.tracing or tracemalloc.is_tracing():
+            lines.append("traced : %d bytes, peak %d bytes" % (sample["traced"]["current"], sample["traced"]["peak"]))
+        lines.append("rule : steps, nodes, bytes")
+        for rule, entry in sorted(sample["rules"].items(), key = lambda item : -item[1]["nodes"]):
+            lines.append("  %s : %d, %d, %d" % (rule, entry["steps"], entry["nodes"], entry["bytes"]))
+        lines.append("proof_history : %d bytes, %d theorems" % (sample["retained"], len(sample["theorems"])))
+        for name, size in sorted(sample["theorems"].items(), key = lambda item : -item[1])[ : top]:
+            lines.append("  %s : %d bytes" % (name, size))
+        for key in ["sizes", "depths"]:
+            lines.append("statement " + key[ : -1] + " : " + ", ".join(["%d+ : %d" % item for item in sample[key].items()]))
+        for name, entry in sample["caches"].items():
+            lines.append("%s cache : %d hits, %d misses, %.1f%%" % (name, entry["hits"], entry["misses"], 100 * entry["rate"]))
+        return "\n".join(lines) + "\n"
+
+memory_profile = MemoryProfile()
+
+# compact encoding of nodes, each distinct subterm once, referred to by the distance back to it
+encoding_fields = {
+    TYPE_ALL : ["bound", "statement"],
+    TYPE_EXIST : ["bound", "statement"],
+    TYPE_UNIQUELY_EXIST : ["bound", "statement"],
+    TYPE_NOT : ["body"],
+    TYPE_AND : ["left", "right"],
+    TYPE_OR : ["left", "right"],
+    TYPE_IMPLY : ["assumption", "conclusion"],
+    TYPE_IFF : ["left", "right"],
+    TYPE_TRUE : [],
+    TYPE_FALSE : [],
+}
+
+def write_varint(output, value):
+    while value >= 0x80:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+def read_varint(data, position):
+    if data[position] < 0x80: # most of them are short
+        return data[position], position + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+# a string name by its length and bytes, and an integer name as it is
+def read_name(data, position):
+    name, position = read_varint(data, position)
+    if name % 2 == 0:
+        return data[position : position + name // 2].decode(), position + name // 2
+    return name // 2, position
+
+class Packer:
+    def __init__(self):
+        self.indices = {} # named digest -> index, the bound variables being written as they are
+        self.output = bytearray()
+
+    def reference(self, node):
+        write_varint(self.output, len(self.indices) - self.indices[node.named_digest()])
+
+    # write the records of the new subterms, and return the index of the node
+    def pack(self, node):
+        key = node.named_digest()
+        if self.indices.get(key) != None:
+            return self.indices[key]
+        for subnode in node.postorder():
+            key = subnode.named_digest()
+            if self.indices.get(key) != None:
+                continue
+            self.output.append(subnode.type_)
+            if subnode.type_ == TYPE_VARIABLE:
+                write_varint(self.output, subnode.counter)
+            elif subnode.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                if isinstance(subnode.name, str):
+                    name = subnode.name.encode()
+                    write_varint(self.output, 2 * len(name))
+                    self.output += name
+                else:
+                    write_varint(self.output, 2 * subnode.name + 1)
+                write_varint(self.output, len(subnode.children))
+                for child in subnode.children:
+                    self.reference(child)
+            else:
+                for field in encoding_fields[subnode.type_]:
+                    self.reference(subnode.arguments[field])
+            self.indices[key] = len(self.indices)
+        return self.indices[key]
+
+class Unpacker:
+    def __init__(self):
+        self.nodes = []
+        self.counters = None # old counter -> new counter, to rename the variables
+
+    def reference(self, data, position):
+        distance, position = read_varint(data, position)
+        return self.nodes[len(self.nodes) - distance], position
+
+    # read one record, and return the node with the position after it
+    def unpack(self, data, position):
+        type_ = data[position]
+        position += 1
+        if type_ == TYPE_VARIABLE:
+            counter, position = read_varint(data, position)
+            if self.counters != None and counter >= 52:
+                if self.counters.get(counter) == None:
+                    # a new counter of the same letter, as closing() names the variables by counter % 52
+                    self.counters[counter] = Node.counter + (counter - Node.counter) % 52
+                    Node.counter = self.counters[counter] + 1
+                counter = self.counters[counter]
+            elif counter >= Node.counter:
+                # the next variables made are past the counters read, keeping their letters
+                Node.counter += (counter - Node.counter) // 52 * 52 + 52
+            node = Node(TYPE_VARIABLE, counter = counter)
+        elif type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+            name, position = read_name(data, position)
+            arity, position = read_varint(data, position)
+            children = []
+            for _ in range(0, arity):
+                child, position = self.reference(data, position)
+                children.append(child)
+            node = Node(type_, name = name, children = children)
+        else:
+            arguments = {}
+            for field in encoding_fields[type_]:
+                arguments[field], position = self.reference(data, position)
+            node = Node(type_, **arguments)
+        self.nodes.append(node)
+        return node, position
+
+def pack(node):
+    packer = Packer()
+    packer.pack(node)
+    return bytes(packer.output)
+
+# with rename, the variables past the letters are read as new variables of the same letters
+def unpack(data, rename = False):
+    unpacker = Unpacker()
+    if rename:
+        unpacker.counters = {}
+    position = 0
+    node = None
+    while position < len(data):
+        node, position = unpacker.unpack(data, position)
+    return node
+
+# the property & function names a theorem concludes about,
+# used to look up the theorems on the disk
+def head_symbols(theorem):
+    cursor = theorem
+    while cursor.type_ == TYPE_ALL:
+        cursor = cursor.statement
+    if cursor.type_ == TYPE_IMPLY:
+        cursor = cursor.conclusion
+    symbols = set()
+    stack = [cursor]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node.type_ in [TYPE_NOT, TYPE_AND, TYPE_OR, TYPE_IFF]:
+            stack += node.subnodes()
+        elif node.type_ == TYPE_PROPERTY:
+            symbols.add(node.name)
+            for child in node.children:
+                if child.type_ == TYPE_FUNCTION:
+                    symbols.add(child.name)
+    return symbols
+
+# content-addressed store of the named, closed theorems, in a SQLite file
+# store = TheoremStore("theorems.db")
+# store.publish("pair", "pair_is_set") # or store.publish() for every named theorem
+# attach(store) # from now on, proof_history loads the missing names from the store
+class TheoremStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS theorems (digest BLOB PRIMARY KEY, body BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, digest BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS heads (symbol TEXT NOT NULL, digest BLOB NOT NULL, UNIQUE (symbol, digest));
+                CREATE TABLE IF NOT EXISTS dependencies (digest BLOB NOT NULL, dependency BLOB NOT NULL, UNIQUE (digest, dependency));
+                CREATE INDEX IF NOT EXISTS names_by_digest ON names (digest);
+                CREATE INDEX IF NOT EXISTS dependents ON dependencies (dependency);
+            """)
+
+    def close(self):
+        self.connection.close()
+
+    # return the names published
+    def publish(self, *names):
+        if len(names) == 0:
+            names = [name for name, theorem in proof_history.items() if isinstance(name, str) and len(theorem.free) == 0 and theorem.is_proved() and len(theorem.branch) == 0]
+        with self.connection:
+            for name in names:
+                theorem = dict.__getitem__(proof_history, name)
+                assert theorem.is_proved()
+                assert len(theorem.branch) == 0 # ground level
+                assert len(theorem.free) == 0
+                digest = theorem.digest
+                row = self.connection.execute("SELECT digest FROM names WHERE name = ?", (name, )).fetchone()
+                if row != None:
+                    assert row[0] == digest
+                    continue
+                self.connection.execute("INSERT OR IGNORE INTO theorems VALUES (?, ?)", (digest, pack(theorem)))
+                self.connection.execute("INSERT INTO names VALUES (?, ?)", (name, digest))
+                for symbol in head_symbols(theorem):
+                    self.connection.execute("INSERT OR IGNORE INTO heads VALUES (?, ?)", (str(symbol), digest))
+                for dependency in proof_history.dependencies.get(name, []):
+                    dependency = dict.get(proof_history, dependency)
+                    if dependency != None and len(dependency.free) == 0:
+                        self.connection.execute("INSERT OR IGNORE INTO dependencies VALUES (?, ?)", (digest, dependency.digest))
+        return names
+
+    def lookup(self, digest):
+        row = self.connection.execute("SELECT body FROM theorems WHERE digest = ?", (digest, )).fetchone()
+        if row == None:
+            return None
+        # the bound variables are renamed to new ones, as the theorem is closed and its digest is the same
+        theorem = unpack(row[0], True)
+        assert theorem.digest == digest
+        return theorem.admit([])
+
+    # load the theorem into proof_history
+    def load(self, name):
+        row = self.connection.execute("SELECT digest FROM names WHERE name = ?", (name, )).fetchone()
+        if row == None:
+            return None
+        theorem = self.lookup(row[0])
+        dict.__setitem__(proof_history, name, theorem)
+        return theorem
+
+    def names(self, digests):
+        names = []
+        for digest in digests:
+            names += [row[0] for row in self.connection.execute("SELECT name FROM names WHERE digest = ? ORDER BY name", (digest, ))]
+        return names
+
+    def by_head(self, symbol):
+        return self.names([row[0] for row in self.connection.execute("SELECT digest FROM heads WHERE symbol = ?", (str(symbol), ))])
+
+    def dependencies(self, name):
+        return self.names([row[0] for row in self.connection.execute("SELECT dependencies.dependency FROM dependencies JOIN names ON names.digest = dependencies.digest WHERE names.name = ?", (name, ))])
+
+    def dependents(self, name):
+        return self.names([row[0] for row in self.connection.execute("SELECT dependencies.digest FROM dependencies JOIN names ON names.digest = dependencies.dependency WHERE names.name = ?", (name, ))])
+
+    # publish the theorems, and drop them from the memory
+    # they are loaded again when they are looked up
+    def offload(self, *names):
+        for name in self.publish(*names):
+            del proof_history[name]
+
+def attach(store):
+    History.store = store
+
+# proofs in the compact encoding, as frames of the new subterms and the step written
+# Node.recorder = ProofWriter(open("proof.bin", "wb"))
+# # your proof ...
+# Node.recorder = None
+# ProofReader(open("proof.bin", "rb")).run() # checks the proof again
+RECORD_STEP = 0x40
+RECORD_ENTER = 0x41
+RECORD_EXIT = 0x42
+RECORD_LEAVE = 0x46 # the block left by an error, proving nothing
+
+VALUE_INT = 0
+VALUE_STR = 1
+VALUE_NODE = 2
+VALUE_LIST = 3
+VALUE_TUPLE = 4
+
+class ProofWriter:
+    def __init__(self, output):
+        self.output = output
+        self.packer = Packer()
+
+    def pack(self, value):
+        if isinstance(value, Node):
+            self.packer.pack(value)
+        elif isinstance(value, (list, tuple)):
+            for element in value:
+                self.pack(element)
+
+    def write_value(self, value):
+        output = self.packer.output
+        if isinstance(value, Node):
+            output.append(VALUE_NODE)
+            self.packer.reference(value)
+        elif isinstance(value, bool) or not isinstance(value, (int, str, list, tuple)):
+            assert False # not to be recorded
+        elif isinstance(value, int):
+            output.append(VALUE_INT)
+            write_varint(output, 2 * value if value >= 0 else -2 * value - 1)
+        elif isinstance(value, str):
+            output.append(VALUE_STR)
+            value = value.encode()
+            write_varint(output, len(value))
+            output += value
+        else:
+            output.append(VALUE_LIST if isinstance(value, list) else VALUE_TUPLE)
+            write_varint(output, len(value))
+            for element in value:
+                self.write_value(element)
+
+    def flush(self):
+        frame = bytearray()
+        write_varint(frame, len(self.packer.output))
+        self.write(bytes(frame + self.packer.output))
+        self.packer.output = bytearray()
+
+    def write(self, frame):
+        self.output.write(frame)
+
+    def step(self, node, B):
+        self.pack([node, B])
+        self.packer.output.append(RECORD_STEP)
+        self.write_value([node, B])
+        self.flush()
+
+    def enter(self, node):
+        self.pack(node)
+        self.packer.output.append(RECORD_ENTER)
+        self.write_value(node)
+        self.flush()
+
+    def exit(self):
+        self.packer.output.append(RECORD_EXIT)
+        self.flush()
+
+    def leave(self):
+        self.packer.output.append(RECORD_LEAVE)
+        self.flush()
+
+class ProofReader:
+    def __init__(self, input):
+        self.input = input
+        self.unpacker = Unpacker()
+        self.unpacker.counters = {}
+        self.entered = []
+
+    def read_value(self, data, position):
+        tag = data[position]
+        position += 1
+        if tag == VALUE_NODE:
+            return self.unpacker.reference(data, position)
+        assert tag in [VALUE_INT, VALUE_STR, VALUE_LIST, VALUE_TUPLE]
+        length, position = read_varint(data, position)
+        if tag == VALUE_INT:
+            return (length // 2 if length % 2 == 0 else -(length + 1) // 2), position
+        elif tag == VALUE_STR:
+            return data[position : position + length].decode(), position + length
+        values = []
+        for _ in range(0, length):
+            value, position = self.read_value(data, position)
+            values.append(value)
+        return (values if tag == VALUE_LIST else tuple(values)), position
+
+    # the frames, one by one
+    def frames(self):
+        while True:
+            length = 0
+            shift = 0
+            while True:
+                byte = self.input.read(1)
+                if len(byte) == 0:
+                    assert shift == 0 # not cut in the middle
+                    return
+                length |= (byte[0] & 0x7f) << shift
+                shift += 7
+                if byte[0] < 0x80:
+                    break
+            frame = self.input.read(length)
+            assert len(frame) == length
+            yield frame
+
+    # check the steps again, through the kernel
+    def run(self):
+        for data in self.frames():
+            position = 0
+            while data[position] < RECORD_STEP:
+                node, position = self.unpacker.unpack(data, position)
+            record = data[position]
+            position += 1
+            if record == RECORD_STEP:
+                (node, B), position = self.read_value(data, position)
+                node @ B
+            elif record == RECORD_ENTER:
+                node, position = self.read_value(data, position)
+                node.__enter__()
+                self.entered.append(node)
+            elif record == RECORD_EXIT:
+                self.entered.pop().__exit__(None, None, None)
+            elif record == RECORD_LEAVE:
+                self.entered.pop().__exit__(Exception, None, None)
+            else:
+                assert False
+            assert position == len(data)
+
+# trace of the kernel inferences, including the ones in the derived rules
+# Node.tracer = TraceWriter(open("proof.trace", "wb"))
+# # your proof ...
+# Node.tracer = None
+# checker = TraceChecker(open("proof.trace", "rb"))
+# checker.run() # the sentences used but not proved are left in checker.premises
+RECORD_INFERENCE = 0x43
+RECORD_PREMISE = 0x44
+RECORD_EQUIVALENCE = 0x45
+
+class TraceWriter(ProofWriter):
+    def __init__(self, output):
+        ProofWriter.__init__(self, output)
+        self.proved = set()
+        self.held = None # the frames of the derived rule running, written when it ends
+        for name, theorems in equivalence_relations.items():
+            self.relation(name, *theorems)
+
+    # the theorems are the names in proof_history, as register_equivalence takes them
+    def relation(self, name, reflection, symmetry, transitivity):
+        theorems = [dict.__getitem__(proof_history, theorem) for theorem in [reflection, symmetry, transitivity]]
+        self.premises(theorems)
+        self.pack(theorems)
+        self.packer.output.append(RECORD_EQUIVALENCE)
+        self.write_value([name] + theorems)
+        self.flush()
+
+    def premises(self, arguments):
+        for argument in arguments:
+            if isinstance(argument, Node) and argument.is_sentence() and not argument.digest in self.proved:
+                self.prove(argument.digest)
+                self.pack(argument)
+                self.packer.output.append(RECORD_PREMISE)
+                self.write_value(argument)
+                self.flush()
+
+    def infer(self, node, inference):
+        self.premises(inference[1 : ])
+        self.prove(node.digest)
+        self.pack([node, inference])
+        self.packer.output.append(RECORD_INFERENCE)
+        self.write_value([node, list(inference)])
+        self.flush()
+
+    def enter(self, node):
+        self.prove(node.digest)
+        ProofWriter.enter(self, node)
+
+    def exit(self, implication):
+        self.prove(implication.digest)
+        ProofWriter.exit(self)
+
+    def prove(self, digest):
+        if self.held != None and not digest in self.proved:
+            self.added.append(digest)
+        self.proved.add(digest)
+
+    def write(self, frame):
+        if self.held != None:
+            self.held.append(frame)
+        else:
+            self.output.write(frame)
+
+    # by Rollback: the frames of a derived rule are held while it runs, then written or dropped
+    def hold(self):
+        self.held = []
+        self.added = []
+        self.indices = len(self.packer.indices)
+
+    def release(self):
+        if self.held != None:
+            held, self.held = self.held, None
+            for frame in held:
+                self.output.write(frame)
+
+    def drop(self):
+        for digest in self.added:
+            self.proved.remove(digest)
+        for key in [key for key, index in self.packer.indices.items() if index >= self.indices]:
+            del self.packer.indices[key]
+        self.packer.output = bytearray()
+        self.held = None
+
+# the kernel rules again, on the nodes read from the trace, with scopes of its own
+class TraceChecker(ProofReader):
+    def __init__(self, input):
+        ProofReader.__init__(self, input)
+        self.unpacker.counters = None
+        self.branch = [0]
+        self.bounded = [set()]
+        self.names = [set()]
+        self.assumptions = [None]
+        self.level = 0
+        self.last = None
+        self.proved = {} # digest -> (sentence, branch)
+        self.used = set() # counters of the variables in the sentences proved, i.e. not fresh
+        self.defined_by = {} # counter of a let variable -> its existence
+        self.premises = []
+        self.relations = set() # names of the equivalence relations
+        self.definitions = DefinitionIndex(self.is_proved)
+        self.rules = {
+            DEDUCE : self.deduce,
+            TAUTOLOGY : self.tautology,
+            DEFINE_PROPERTY : self.define_property,
+            DEFINE_FUNCTION : self.define_function,
+            DEFINE_CLASS : self.define_class,
+            DUAL : self.dual,
+            FOUND : self.found,
+            CLAIM_UNIQUE : self.claim_unique,
+            BY_UNIQUE : self.by_unique,
+            PUT : self.put,
+            REPLACE : self.replace,
+            REPLACE_AT : self.replace_at,
+            AXIOM : self.axiom,
+            LET : self.let,
+            GENERALIZE : self.generalize,
+            CONGRUENCE : self.congruence,
+            EQUIVALENCE : self.equivalence,
+            INSTANTIATE : self.instantiate,
+            UNFOLD : self.unfold,
+            FOLD : self.fold,
+        }
+
+    def in_scope(self, branch):
+        return len(branch) <= len(self.branch) and self.branch[ : len(branch)] == branch
+
+    # a sentence differing from a proved one only in the names of the bound variables has its digest, so it is proved too
+    def is_proved(self, sentence):
+        entry = self.proved.get(sentence.digest)
+        return entry != None and self.in_scope(entry[1]) and sentence.same(entry[0])
+
+    def is_fresh(self, variable):
+        assert variable.type_ == TYPE_VARIABLE
+        return not variable.counter in self.used
+
+    # a sentence proved in a wider scope stays there
+    def admit(self, sentence, branch):
+        entry = self.proved.get(sentence.digest)
+        if entry == None or not self.in_scope(entry[1]):
+            self.proved[sentence.digest] = (sentence, branch)
+        self.used |= sentence.free | sentence.bounded
+
+    def accept(self, sentence):
+        assert sentence.is_sentence()
+        self.admit(sentence, self.branch[ : self.level])
+        self.last = sentence
+
+    def enter(self, sentence):
+        self.level += 1
+        if len(self.branch) == self.level:
+            self.branch.append(0)
+            self.bounded.append(set())
+            self.assumptions.append(sentence)
+            self.names.append(set())
+        else:
+            self.branch[self.level] += 1
+            self.bounded[self.level] = set()
+            self.assumptions[self.level] = sentence
+            self.names[self.level] = set()
+        self.bounded[self.level] |= sentence.free
+        self.accept(sentence)
+
+    def exit(self):
+        self.accept(Node(TYPE_IMPLY, assumption = self.assumptions[self.level], conclusion = self.last))
+        self.level -= 1
+
+    def define(self, name):
+        for names in self.names:
+            assert not name in names
+        self.names[self.level].add(name)
+
+    def deduce(self, target):
+        assert target.same(self.last)
+
+    def axiom(self, target):
+        pass
+
+    def define_property(self, target, name):
+        self.define(name)
+        cursor = target
+        while cursor.type_ == TYPE_ALL:
+            cursor = cursor.statement
+        assert cursor.type_ == TYPE_IFF
+        assert cursor.left.type_ == TYPE_PROPERTY
+        assert cursor.left.name == name
+
+    def define_function(self, target, name, reason):
+        self.define(name)
+        assert self.is_proved(reason)
+        arguments = []
+        cursor = reason
+        while cursor.type_ == TYPE_ALL:
+            arguments.append(cursor.bound)
+            cursor = cursor.statement
+        function = Node(TYPE_FUNCTION, name = name, children = arguments)
+        if cursor.type_ == TYPE_IMPLY:
+            assumption = cursor.assumption
+            cursor = cursor.conclusion
+            assert cursor.type_ == TYPE_UNIQUELY_EXIST
+            definition = Node(TYPE_IMPLY, assumption = assumption, conclusion = cursor.statement.substitute(cursor.bound, function))
+        else:
+            assert cursor.type_ == TYPE_UNIQUELY_EXIST
+            definition = cursor.statement.substitute(cursor.bound, function)
+        for argument in reversed(arguments):
+            definition = Node(TYPE_ALL, bound = argument, statement = definition)
+        assert target.same(definition)
+
+    def found(self, target, term, reason):
+        assert self.is_proved(reason)
+        assert not term.is_sentence()
+        assert target.type_ == TYPE_EXIST
+        assert reason.instantiates(target.statement, target.bound, term)
+
+    def let(self, target, variable, reason):
+        assert self.is_proved(reason)
+        assert reason.type_ in [TYPE_EXIST, TYPE_UNIQUELY_EXIST]
+        assert self.is_fresh(variable)
+        self.defined_by[variable.counter] = reason
+        self.bounded[self.level].add(variable.counter)
+        assert target.instantiates(reason.statement, reason.bound, variable)
+
+    def claim_unique(self, target, reason):
+        assert self.is_proved(reason)
+        assert reason.type_ == TYPE_PROPERTY
+        assert reason.name == "equal"
+        left, right = reason.children
+        assert left.type_ == TYPE_VARIABLE and right.type_ == TYPE_VARIABLE
+        existence = self.defined_by.get(left.counter)
+        assert existence != None
+        assert self.defined_by.get(right.counter) != None
+        assert existence.same(self.defined_by[right.counter])
+        assert target.type_ == TYPE_UNIQUELY_EXIST
+        assert Node(TYPE_EXIST, **target.arguments).same(existence)
+
+    def by_unique(self, target, reason, left, right):
+        assert self.is_proved(reason)
+        assert self.is_proved(left)
+        assert self.is_proved(right)
+        assert target.type_ == TYPE_PROPERTY
+        assert target.name == "equal"
+        assert reason.type_ == TYPE_UNIQUELY_EXIST
+        assert len(target.children) == 2
+        assert left.instantiates(reason.statement, reason.bound, target.children[0])
+        assert right.instantiates(reason.statement, reason.bound, target.children[1])
+
+    def put(self, target, replace_by, reason):
+        assert self.is_proved(reason)
+        assert reason.type_ == TYPE_ALL
+        assert not replace_by.is_sentence()
+        assert target.instantiates(reason.statement, reason.bound, replace_by)
+
+    def generalize(self, target, reason, *variables):
+        assert self.is_proved(reason)
+        if len(variables) == 0:
+            assert target.type_ == TYPE_ALL
+            variables = [target.bound]
+        closed = reason
+        for variable in reversed(variables):
+            assert variable.type_ == TYPE_VARIABLE
+            for level in range(0, self.level + 1):
+                assert not variable.counter in self.bounded[level]
+            closed = Node(TYPE_ALL, bound = variable, statement = closed)
+        assert target.same(closed)
+
+    def entailed(self, target, reasons):
+        mapping = {}
+        logical_forms = Node.logical_programs(reasons + [target], mapping)
+        return Node.search(logical_forms[ : -1], logical_forms[-1], len(mapping))
+
+    def tautology(self, target, *reasons):
+        for reason in reasons:
+            assert self.is_proved(reason)
+        assert self.entailed(target, list(reasons))
+
+    def instantiate(self, target, theorem, terms, *reasons):
+        assert self.is_proved(theorem)
+        mapping = {}
+        body = theorem
+        for term in terms:
+            assert body.type_ == TYPE_ALL
+            assert not term.is_sentence()
+            mapping[body.bound.counter] = term
+            body = body.statement
+        for reason in reasons:
+            assert self.is_proved(reason)
+        # the kernel may have checked it on the instance of its cache, so the instance is made if matching fails
+        assert Node.instance_entails(body, mapping, list(reasons), target) or self.entailed(target, [body.substitute_all(mapping)] + list(reasons))
+
+    # the definition in the index of the checker, as the kernel keeps it in definition_index
+    def definition(self, name, definition):
+        entry = self.definitions.definitions.get(name)
+        if entry == None or not entry[0].same(definition):
+            self.definitions.add(name, definition)
+        entry = self.definitions.get(name)
+        assert entry[0].same(definition)
+        return entry
+
+    def unfold(self, target, name, occurrence, reason, definition):
+        assert self.is_proved(reason)
+        type_ = self.definition(name, definition)[1]
+        count = occurrence
+        for node, path in reason.paths():
+            if node.type_ == type_ and node.name == name:
+                if count == 0:
+                    break
+                count -= 1
+        else:
+            assert False
+        unfolded = self.definitions.unfold(name, node)
+        if type_ == TYPE_PROPERTY:
+            assert target.same(reason.replaced(path, unfolded))
+        else:
+            assert node.free.isdisjoint(reason.bounded)
+            assert target.same(unfolded)
+
+    def fold(self, target, name, occurrence, reason, definition):
+        assert self.is_proved(reason)
+        self.definition(name, definition)
+        count = occurrence
+        for node, path in reason.paths():
+            atom = self.definitions.fold(name, node)
+            if atom != None:
+                if count == 0:
+                    break
+                count -= 1
+        else:
+            assert False
+        assert target.same(reason.replaced(path, atom))
+
+    def replace(self, target, reason, equality):
+        assert self.is_proved(reason)
+        assert self.is_proved(equality)
+        assert equality.type_ == TYPE_PROPERTY
+        assert equality.name == "equal"
+        assert target.interchangable(reason, *equality.children)
+
+    def replace_at(self, target, paths, reason, equality):
+        assert self.is_proved(reason)
+        assert self.is_proved(equality)
+        assert equality.type_ == TYPE_PROPERTY
+        assert equality.name == "equal"
+        target.interchanged_at(reason, [tuple(path) for path in paths], *equality.children)
+
+    def equivalence(self, target, *reasons):
+        assert target.type_ == TYPE_PROPERTY
+        assert target.name in self.relations
+        assert len(target.children) == 2
+        closure = UnionFind()
+        for reason in reasons:
+            assert self.is_proved(reason)
+            assert reason.type_ == TYPE_PROPERTY
+            assert reason.name == target.name
+            assert len(reason.children) == 2
+            closure.union(reason.children[0].digest, reason.children[1].digest, reason)
+        assert closure.find(target.children[0].digest) == closure.find(target.children[1].digest)
+
+    # the congruence closure of the equalities in scope, made again for each step
+    def congruence(self, target, reason):
+        assert target.is_sentence()
+        assert self.is_proved(reason)
+        closure = CongruenceClosure()
+        for equality, branch in self.proved.values():
+            if equality.type_ == TYPE_PROPERTY and equality.name == "equal" and self.in_scope(branch):
+                closure.assume(equality, branch)
+        assert closure.find(closure.add(target)) == closure.find(closure.add(reason))
+
+    def define_class(self, target, output):
+        assert output.type_ == TYPE_VARIABLE
+        assert self.is_fresh(output)
+        cursor = target
+        assert cursor.type_ == TYPE_UNIQUELY_EXIST
+        assert cursor.bound.same(output)
+        cursor = cursor.statement
+        assert cursor.type_ == TYPE_ALL
+        element = cursor.bound
+        cursor = cursor.statement
+        assert cursor.type_ == TYPE_IFF
+        assert cursor.left.same(Node(TYPE_PROPERTY, name = "in", children = [element, output]))
+        cursor = cursor.right
+        assert cursor.type_ == TYPE_AND
+        assert cursor.left.same(Node(TYPE_PROPERTY, name = "set", children = [element]))
+
+    def dual(self, target):
+        assert target.type_ == TYPE_IFF
+        if target.left.type_ == TYPE_NOT:
+            if target.left.body.type_ == TYPE_ALL:
+                assert target.right.type_ == TYPE_EXIST
+            elif target.left.body.type_ == TYPE_EXIST:
+                assert target.right.type_ == TYPE_ALL
+            else:
+                assert False
+            assert target.right.statement.type_ == TYPE_NOT
+            assert target.left.body.bound.counter == target.right.bound.counter
+            assert target.left.body.statement.same(target.right.statement.body)
+        elif target.right.type_ == TYPE_NOT:
+            if target.right.body.type_ == TYPE_ALL:
+                assert target.left.type_ == TYPE_EXIST
+            elif target.right.body.type_ == TYPE_EXIST:
+                assert target.left.type_ == TYPE_ALL
+            else:
+                assert False
+            assert target.left.statement.type_ == TYPE_NOT
+        else:
+            assert False
 
+    # check_reflection, check_symmetry and check_transitivity on the sentences
+    def relation(self, name, reflection, symmetry, transitivity):
+        for theorem in [reflection, symmetry, transitivity]:
+            assert self.is_proved(theorem)
+        def bounds(sentence, count):
+            variables = []
+            for _ in range(0, count):
+                assert sentence.type_ == TYPE_ALL
+                variables.append(sentence.bound)
+                sentence = sentence.statement
+            return variables, sentence
+        def related(A, B):
+            return Node(TYPE_PROPERTY, name = name, children = [A, B])
+        (A, ), statement = bounds(reflection, 1)
+        assert related(A, A).same(statement)
+        (A, B), statement = bounds(symmetry, 2)
+        assert Node(TYPE_IMPLY, assumption = related(A, B), conclusion = related(B, A)).same(statement)
+        (A, B, C), statement = bounds(transitivity, 3)
+        assumption = Node(TYPE_AND, left = related(A, B), right = related(B, C))
+        assert Node(TYPE_IMPLY, assumption = assumption, conclusion = related(A, C)).same(statement)
+        self.relations.add(name)
+
+    def run(self):
+        for data in self.frames():
+            position = 0
+            while data[position] < RECORD_STEP:
+                node, position = self.unpacker.unpack(data, position)
+            record = data[position]
+            position += 1
+            if record == RECORD_INFERENCE:
+                (target, inference), position = self.read_value(data, position)
+                rule = inference[0]
+                # a sentence already proved in scope needs no more checks, unless the rule does something more
+                if not (self.is_proved(target) and not rule in [LET, DEFINE_PROPERTY, DEFINE_FUNCTION, DEFINE_CLASS]):
+                    self.rules[rule](target, *inference[1 : ])
+                self.accept(target)
+            elif record == RECORD_PREMISE:
+                sentence, position = self.read_value(data, position)
+                assert sentence.is_sentence()
+                self.premises.append(sentence)
+                self.admit(sentence, [])
+            elif record == RECORD_EQUIVALENCE:
+                (name, reflection, symmetry, transitivity), position = self.read_value(data, position)
+                self.relation(name, reflection, symmetry, transitivity)
+            elif record == RECORD_ENTER:
+                sentence, position = self.read_value(data, position)
+                self.enter(sentence)
+            elif record == RECORD_EXIT:
+                self.exit()
+            elif record == RECORD_LEAVE:
+                self.level -= 1
+            else:
+                assert False
+            assert position == len(data)
 
 
 def New(*counter):
@@ -698,12 +3375,11 @@ def UniquelyExist(*arguments):
 
 def Tuple(*arguments):
     arity = len(arguments)
-    if arity == 2:
-        return Node(TYPE_FUNCTION, name = "ordered_pair", children = [arguments[0], arguments[1]])
-    elif arity > 2:
-        return Node(TYPE_FUNCTION, name = "ordered_pair", children = [arguments[0], Tuple(*arguments[1 : ])])
-    else:
-        assert False
+    assert arity >= 2
+    tuple_ = Node(TYPE_FUNCTION, name = "ordered_pair", children = [arguments[-2], arguments[-1]])
+    for index in range(arity - 3, -1, -1):
+        tuple_ = Node(TYPE_FUNCTION, name = "ordered_pair", children = [arguments[index], tuple_])
+    return tuple_
 
 # used in theorems
 a_ = New()
@@ -871,44 +3547,196 @@ def clear():
 
 # theorem use
 def match(A, B, counters, mapping):
-    if A.type_ == TYPE_VARIABLE:
-        if A.counter in counters:
-            if mapping.get(A.counter) != None:
-                assert hash(mapping[A.counter]) == hash(B)
-            else:
-                mapping[A.counter] = B
-    else:
-        assert A.type_ == B.type_
-        for key, value in A.arguments.items():
-            if isinstance(value, list):
-                for index, element in enumerate(value):
-                    match(element, B.arguments[key][index], counters, mapping)
-            elif isinstance(value, Node):
-                match(value, B.arguments[key], counters, mapping)
+    stack = [(A, B)]
+    while len(stack) > 0:
+        A, B = stack.pop()
+        if A.type_ == TYPE_VARIABLE:
+            if A.counter in counters:
+                if mapping.get(A.counter) != None:
+                    assert mapping[A.counter].same(B)
+                else:
+                    mapping[A.counter] = B
+        else:
+            assert A.type_ == B.type_
+            for key, value in A.arguments.items():
+                if isinstance(value, list):
+                    for index, element in enumerate(value):
+                        stack.append((element, B.arguments[key][index]))
+                elif isinstance(value, Node):
+                    stack.append((value, B.arguments[key]))
+                else:
+                    assert B.arguments[key] == value
+
+# try_match with the pattern compiled once, rejecting by its head and size first
+class Matcher:
+    CHECK = 0
+    BIND = 1
+    SKIP = 2
+
+    def __init__(self, pattern, counters):
+        self.head = None
+        if pattern.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+            self.head = (pattern.type_, pattern.name, len(pattern.children))
+        elif pattern.type_ != TYPE_VARIABLE or pattern.counter in counters:
+            self.head = (pattern.type_, None, None)
+        self.size = pattern.size
+        self.program = []
+        stack = [pattern]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.type_ == TYPE_VARIABLE:
+                if node.counter in counters:
+                    self.program.append((Matcher.BIND, node.counter))
+                else:
+                    self.program.append((Matcher.SKIP, None))
+            elif node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                self.program.append((Matcher.CHECK, (node.type_, node.name, len(node.children), None)))
+                stack += reversed(node.children)
             else:
-                assert B.arguments[key] == value
+                fields = encoding_fields[node.type_]
+                self.program.append((Matcher.CHECK, (node.type_, None, None, list(reversed(fields)))))
+                stack += [node.arguments[field] for field in reversed(fields)]
+        if self.head != None and self.head[0] == TYPE_VARIABLE:
+            self.head = None
+            self.size = 1
+
+    def run(self, target, mapping):
+        if self.head != None:
+            if target.type_ != self.head[0] or target.size < self.size:
+                return False
+            if self.head[1] != None and (target.name != self.head[1] or len(target.children) != self.head[2]):
+                return False
+        stack = [target]
+        for kind, argument in self.program:
+            node = stack.pop()
+            if kind == Matcher.BIND:
+                bound = mapping.get(argument)
+                if bound == None:
+                    mapping[argument] = node
+                elif not bound.same(node):
+                    return False
+            elif kind == Matcher.CHECK:
+                type_, name, arity, fields = argument
+                if node.type_ != type_:
+                    return False
+                if fields == None:
+                    if node.name != name or len(node.children) != arity:
+                        return False
+                    stack += reversed(node.children)
+                else:
+                    stack += [node.arguments[field] for field in fields]
+        return True
 
-def by_theorem(target, name, *reasons):
-    cursor = proof_history[name]
-    bounds = set()
+# the matchers of the named theorems, by the names and the parts matched, "conclusion", "left" or "right"
+theorem_matchers = {} # (name, part) -> (theorem, matcher)
+
+def theorem_matcher(name, part):
+    theorem = proof_history[name]
+    entry = theorem_matchers.get((name, part))
+    if entry != None and entry[0] is theorem:
+        return entry[1]
+    counters = set()
+    cursor = theorem
     while cursor.type_ == TYPE_ALL:
-        bounds.add(cursor.bound.counter)
+        counters.add(cursor.bound.counter)
         cursor = cursor.statement
-    if cursor.type_ == TYPE_IMPLY:
-        mapping = {}
-        conclusion = cursor.conclusion
-        match(conclusion, target, bounds, mapping)
-        cursor = proof_history[name] @ -1
-        while cursor.type_ == TYPE_ALL:
-            cursor = cursor.statement.substitute(cursor.bound, mapping[cursor.bound.counter]) @ (-1, PUT, mapping[cursor.bound.counter], -1)
-        return target @ (-1, TAUTOLOGY, -1, *reasons)
+    if part == "conclusion":
+        pattern = cursor.conclusion if cursor.type_ == TYPE_IMPLY else cursor
     else:
-        mapping = {}
-        match(cursor, target, bounds, mapping)
-        cursor = proof_history[name] @ -1
+        assert cursor.type_ == TYPE_IFF
+        pattern = cursor.arguments[part]
+    matcher = Matcher(pattern, counters)
+    if isinstance(name, str):
+        theorem_matchers[(name, part)] = (theorem, matcher)
+    return matcher
+
+# the definitions by the formal names, for UNFOLD and FOLD, with the unfolded forms made once for each atom or term
+class DefinitionIndex:
+    def __init__(self, is_proved = Node.is_proved):
+        self.is_proved = is_proved
+        self.definitions = {} # name -> (definition, type of the defined, variables, definiens, matcher of the definiens)
+        self.unfolded = {} # (name, digest of the atom or the term) -> (definition, unfolded form)
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, name, definition):
+        variables = []
+        cursor = definition
         while cursor.type_ == TYPE_ALL:
-            cursor = (cursor.statement.substitute(cursor.bound, mapping[cursor.bound.counter])) @ (-1, PUT, mapping[cursor.bound.counter], -1)
-        return target @ (-1, TAUTOLOGY, -1, *reasons)
+            variables.append(cursor.bound)
+            cursor = cursor.statement
+        if cursor.type_ == TYPE_IFF and cursor.left.type_ == TYPE_PROPERTY and cursor.left.name == name:
+            children = cursor.left.children
+            if any([child.type_ != TYPE_VARIABLE for child in children]) or len(set([child.counter for child in children])) != len(children):
+                return
+            counters = set([child.counter for child in children])
+            self.definitions[name] = (definition, TYPE_PROPERTY, children, cursor.right, Matcher(cursor.right, counters))
+            return
+        # the arguments of the function are the first variables
+        for node in definition.postorder():
+            if node.type_ == TYPE_FUNCTION and node.name == name and len(node.children) <= len(variables):
+                if all([child is variable for child, variable in zip(node.children, variables)]):
+                    cursor = definition
+                    for variable in node.children:
+                        cursor = cursor.statement
+                    self.definitions[name] = (definition, TYPE_FUNCTION, node.children, cursor, None)
+                    return
+
+    # the entry of the definition, which must be proved in scope
+    def get(self, name):
+        entry = self.definitions.get(name)
+        assert entry != None
+        assert self.is_proved(entry[0])
+        return entry
+
+    # the instance of the definiens for the atom of the property, or the term of the function
+    def unfold(self, name, node):
+        definition, type_, variables, definiens = self.get(name)[ : 4]
+        entry = self.unfolded.get((name, node.digest))
+        if entry != None and entry[0] is definition:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        assert node.type_ == type_ and node.name == name
+        assert len(node.children) == len(variables)
+        mapping = {}
+        for variable, child in zip(variables, node.children):
+            assert child.free.isdisjoint(definiens.bounded)
+            mapping[variable.counter] = child
+        unfolded = definiens.substitute_all(mapping)
+        self.unfolded[(name, node.digest)] = (definition, unfolded)
+        return unfolded
+
+    # the atom of the property whose unfolded form is the node, or None
+    def fold(self, name, node):
+        definition, type_, variables, definiens, matcher = self.get(name)
+        assert type_ == TYPE_PROPERTY
+        mapping = {}
+        if not matcher.run(node, mapping):
+            return None
+        if any([mapping.get(variable.counter) == None for variable in variables]):
+            return None
+        atom = Node(TYPE_PROPERTY, name = name, children = [mapping[variable.counter] for variable in variables])
+        if any([not child.free.isdisjoint(definiens.bounded) for child in atom.children]):
+            return None
+        if not self.unfold(name, atom).same(node):
+            return None
+        return atom
+
+definition_index = DefinitionIndex()
+
+# the terms for the first quantifiers of the theorem, in order
+def binding(theorem, mapping, hidden = None):
+    terms = []
+    while theorem.type_ == TYPE_ALL:
+        terms.append(mapping[theorem.bound.counter] if hidden == None else mapping.get(theorem.bound.counter, hidden))
+        theorem = theorem.statement
+    return terms
+
+def by_theorem(target, name, *reasons):
+    mapping = {}
+    assert theorem_matcher(name, "conclusion").run(target, mapping)
+    return target.instantiate(name, binding(proof_history[name], mapping), *reasons)
 
 BY_THEOREM = 25
 callbacks[BY_THEOREM] = by_theorem
@@ -916,22 +3744,13 @@ callbacks[BY_THEOREM] = by_theorem
 def put_theorem(target, name, hidden, *reasons):
     cursor = proof_history[name]
     assert cursor.is_proved()
-    bounds = set()
     while cursor.type_ == TYPE_ALL:
-        bounds.add(cursor.bound.counter)
         cursor = cursor.statement
     assert cursor.type_ == TYPE_IMPLY
     assert len(cursor.assumption.free) == len(cursor.conclusion.free) + 1
     mapping = {}
-    conclusion = cursor.conclusion
-    match(conclusion, target, bounds, mapping)
-    cursor = proof_history[name] @ -1
-    while cursor.type_ == TYPE_ALL:
-        if mapping.get(cursor.bound.counter) != None:
-            cursor = (cursor.statement.substitute(cursor.bound, mapping[cursor.bound.counter])) @ (-1, PUT, mapping[cursor.bound.counter], -1)
-        else:
-            cursor = (cursor.statement.substitute(cursor.bound, hidden)) @ (-1, PUT, hidden, -1)
-    return target @ (-1, TAUTOLOGY, -1, *reasons)
+    assert theorem_matcher(name, "conclusion").run(target, mapping)
+    return target.instantiate(name, binding(proof_history[name], mapping, hidden), *reasons)
 
 PUT_THEOREM = 28
 callbacks[PUT_THEOREM] = put_theorem
@@ -939,55 +3758,265 @@ callbacks[PUT_THEOREM] = put_theorem
 
 # bicondition
 def try_match(A, B, counters, mapping):
-    if A.type_ == TYPE_VARIABLE:
-        if A.counter in counters:
-            if mapping.get(A.counter) != None:
-                if hash(mapping[A.counter]) != hash(B):
-                    return False
-            else:
-                mapping[A.counter] = B
-    else:
-        if A.type_ != B.type_:
-            return False
-        for key, value in A.arguments.items():
-            if isinstance(value, list):
-                for index, element in enumerate(value):
-                    if not try_match(element, B.arguments[key][index], counters, mapping):
+    stack = [(A, B)]
+    while len(stack) > 0:
+        A, B = stack.pop()
+        if A.type_ == TYPE_VARIABLE:
+            if A.counter in counters:
+                if mapping.get(A.counter) != None:
+                    if not mapping[A.counter].same(B):
+                        return False
+                else:
+                    mapping[A.counter] = B
+        else:
+            if A.type_ != B.type_:
+                return False
+            for key, value in A.arguments.items():
+                if isinstance(value, list):
+                    if len(value) != len(B.arguments[key]):
+                        return False
+                    for index, element in enumerate(value):
+                        stack.append((element, B.arguments[key][index]))
+                elif isinstance(value, Node):
+                    stack.append((value, B.arguments[key]))
+                else:
+                    if B.arguments[key] != value:
                         return False
-            elif isinstance(value, Node):
-                if not try_match(value, B.arguments[key], counters, mapping):
-                    return False
-            else:
-                if B.arguments[key] != value:
-                    return False
     return True
 
 def bicondition(target, name, *reasons):
-    cursor = proof_history[name]
-    bounds = set()
-    while cursor.type_ == TYPE_ALL:
-        bounds.add(cursor.bound.counter)
-        cursor = cursor.statement
-    assert cursor.type_ == TYPE_IFF
-    mapping = {}
-    conclusion = cursor.right
-    if try_match(conclusion, target, bounds, mapping):
-        cursor = proof_history[name] @ -1
-        while cursor.type_ == TYPE_ALL:
-            cursor = cursor.statement.substitute(cursor.bound, mapping[cursor.bound.counter]) @ (-1, PUT, mapping[cursor.bound.counter], -1)
-        return target @ (-1, TAUTOLOGY, -1, *reasons)
-    mapping = {}
-    conclusion = cursor.left
-    if try_match(conclusion, target, bounds, mapping):
-        cursor = proof_history[name] @ -1
-        while cursor.type_ == TYPE_ALL:
-            cursor = cursor.statement.substitute(cursor.bound, mapping[cursor.bound.counter]) @ (-1, PUT, mapping[cursor.bound.counter], -1)
-        return target @ (-1, TAUTOLOGY, -1, *reasons)
+    for part in ["right", "left"]:
+        mapping = {}
+        if theorem_matcher(name, part).run(target, mapping):
+            return target.instantiate(name, binding(proof_history[name], mapping), *reasons)
     assert False
 
 BICONDITION = 38
 callbacks[BICONDITION] = bicondition
 
+# the instances of the named theorems by the terms for their first quantifiers, the least recently used dropped over size
+class InstanceCache:
+    def __init__(self, size = 1024):
+        self.size = size
+        self.instances = {} # (name, digests of the terms) -> (digest of the theorem, instance or (body, mapping)), the least recently used first
+        self.keys = {} # name -> keys of its instances
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # the cached instance, or None
+    def get(self, name, theorem, terms):
+        key = (name, tuple([term.digest for term in terms]))
+        entry = self.instances.pop(key, None)
+        if entry == None or entry[0] != theorem.digest:
+            if entry != None:
+                self.forget(key)
+            self.misses += 1
+            return None
+        if isinstance(entry[1], tuple):
+            body, mapping = entry[1]
+            entry = (entry[0], body.substitute_all(mapping))
+        self.instances[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    # the instance, or the body under the first quantifiers with the mapping of their counters to the terms
+    def put(self, name, theorem, terms, instance):
+        key = (name, tuple([term.digest for term in terms]))
+        self.instances.pop(key, None)
+        self.instances[key] = (theorem.digest, instance)
+        if self.keys.get(name) == None:
+            self.keys[name] = set()
+        self.keys[name].add(key)
+        while len(self.instances) > self.size:
+            key = next(iter(self.instances))
+            del self.instances[key]
+            self.forget(key)
+            self.evictions += 1
+
+    def forget(self, key):
+        keys = self.keys[key[0]]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self.keys[key[0]]
+
+    # the instance, made if not cached
+    def instance(self, name, theorem, terms):
+        instance = self.get(name, theorem, terms)
+        if instance == None:
+            instance = theorem
+            for term in terms:
+                assert instance.type_ == TYPE_ALL
+                instance = instance.statement.substitute(instance.bound, term)
+            self.put(name, theorem, terms, instance)
+        return instance
+
+    def invalidate(self, name):
+        for key in self.keys.pop(name, []):
+            del self.instances[key]
+
+    def hit_rate(self):
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
+
+instance_cache = InstanceCache()
+
+# e-matching, instantiating the named universal theorems by the terms in scope matching their triggers
+class Instantiator:
+    def __init__(self, max_generation = 2, max_instances = 32):
+        self.max_generation = max_generation
+        self.max_instances = max_instances
+        self.theorems = {} # name -> (theorem, bound variables, matchers of the triggers)
+        self.instances = {} # name -> set of the bound terms already used
+        self.terms = {} # (type, name, arity) -> [(sequence number, term, generation, branch)]
+        self.count = 0
+        self.sentences = set() # digests of the sentences whose terms are indexed
+        self.generations = {} # digest of an instance -> its generation
+        self.matched = {} # name -> sequence number of the last term matched, by the triggers
+
+    @staticmethod
+    def head(term):
+        return (term.type_, term.name, len(term.children))
+
+    def compile(self, name):
+        theorem = proof_history[name]
+        if self.theorems.get(name) != None and self.theorems[name][0] is theorem:
+            return self.theorems[name]
+        bounds = []
+        cursor = theorem
+        while cursor.type_ == TYPE_ALL:
+            bounds.append(cursor.bound)
+            cursor = cursor.statement
+        counters = set([bound.counter for bound in bounds])
+        inner = cursor.bounded # bound inside P, so not in the triggers
+        candidates = []
+        for node in cursor.postorder():
+            if not node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY]:
+                continue
+            if len(node.free & counters) > 0 and len(node.free & inner) == 0:
+                candidates.append(node)
+        triggers = []
+        for node in candidates:
+            if node.free >= counters and (len(triggers) == 0 or len(node.postorder()) < len(triggers[0].postorder())):
+                triggers = [node]
+        covered = set()
+        if len(triggers) == 0:
+            for node in sorted(candidates, key = (lambda node : -len(node.free & counters))):
+                if not node.free & counters <= covered:
+                    triggers.append(node)
+                    covered |= node.free & counters
+            if covered != counters:
+                triggers = []
+        self.theorems[name] = (theorem, bounds, [Matcher(trigger, counters) for trigger in triggers])
+        self.instances[name] = set()
+        self.matched[name] = {}
+        return self.theorems[name]
+
+    def index(self, sentence, generation, branch):
+        for node in sentence.postorder():
+            if node.type_ in [TYPE_FUNCTION, TYPE_PROPERTY] and len(node.free & sentence.bounded) == 0:
+                head = Instantiator.head(node)
+                if self.terms.get(head) == None:
+                    self.terms[head] = []
+                self.terms[head].append((self.count, node, generation, branch))
+                self.count += 1
+
+    # index the terms of the new sentences in scope, and of the goal if any
+    def collect(self, goal):
+        premise_index.update()
+        facts = list(premise_index.constants)
+        for sentences in premise_index.facts.values():
+            facts += sentences
+        for fact in facts:
+            if fact.digest in self.sentences or not fact.is_proved():
+                continue
+            self.sentences.add(fact.digest)
+            self.index(fact, self.generations.get(fact.digest, 0), fact.branch)
+        if goal != None:
+            self.index(goal, 0, Node.branch[ : Node.level])
+
+    # the terms of the head, still in scope and young enough to trigger
+    def triggered(self, head):
+        alive = [entry for entry in self.terms.get(head, []) if Node.in_scope(entry[3])]
+        self.terms[head] = alive
+        return alive
+
+    # the new instances of the theorem, proved
+    def instantiate(self, name):
+        theorem, bounds, triggers = self.compile(name)
+        if len(triggers) == 0:
+            return []
+        matched = self.matched[name]
+        candidates = [self.triggered(trigger.head) for trigger in triggers]
+        instances = []
+        for index, trigger in enumerate(triggers):
+            for sequence, term, generation, branch in reversed(candidates[index]):
+                budget.visit()
+                if len(instances) >= self.max_instances:
+                    break
+                if sequence < matched.get(index, 0) or generation >= self.max_generation:
+                    continue
+                mapping = {}
+                if not trigger.run(term, mapping):
+                    continue
+                for mapping, generation in self.join(triggers, candidates, index, mapping, generation + 1):
+                    if len(instances) >= self.max_instances:
+                        break
+                    key = tuple([mapping[bound.counter].digest for bound in bounds])
+                    if key in self.instances[name]:
+                        continue
+                    if any([len(mapping[bound.counter].free & theorem.bounded) > 0 for bound in bounds]):
+                        continue
+                    terms = [mapping[bound.counter] for bound in bounds]
+                    instance = instance_cache.instance(name, theorem, terms) @ (-1, INSTANTIATE, name, terms)
+                    self.instances[name].add(key)
+                    self.generations[instance.digest] = generation
+                    instances.append(instance)
+        for index in range(0, len(triggers)):
+            matched[index] = self.count
+        return instances
+
+    # the mappings extending the given one by the other triggers, one by one
+    def join(self, triggers, candidates, fixed, mapping, generation):
+        others = [index for index in range(0, len(triggers)) if index != fixed]
+        stack = [(0, mapping, generation)]
+        while len(stack) > 0:
+            depth, mapping, generation = stack.pop()
+            if depth == len(others):
+                yield mapping, generation
+                continue
+            index = others[depth]
+            for sequence, term, term_generation, branch in candidates[index]:
+                budget.visit()
+                if term_generation >= self.max_generation:
+                    continue
+                extended = dict(mapping)
+                if triggers[index].run(term, extended):
+                    stack.append((depth + 1, extended, max(generation, term_generation + 1)))
+
+    # the new instances of the named theorems, or of all the named universal theorems,
+    # triggered by the sentences in scope and the goal
+    def saturate(self, goal, *names):
+        self.collect(goal)
+        if len(names) == 0:
+            names = [name for name, theorem in dict.items(proof_history) if isinstance(name, str) and theorem.type_ == TYPE_ALL and theorem.is_proved()]
+        instances = []
+        for name in names:
+            instances += self.instantiate(name)
+        return instances
+
+instantiator = Instantiator()
+
+# TAUTOLOGY from the instances e-matching finds
+# the named theorems are instantiated, or all the named universal theorems if no names are given
+def by_instances(target, *names):
+    instantiator.saturate(target, *names)
+    return target @ (-1, AUTO_TAUTOLOGY)
+
+BY_INSTANCES = 34
+callbacks[BY_INSTANCES] = by_instances
+
 def make_property(name):
     def new_property(*arguments):
         return Node(TYPE_PROPERTY, name = name, children = [*arguments])
@@ -998,30 +4027,25 @@ def make_function(name):
         return Node(TYPE_FUNCTION, name = name, children = [*arguments])
     return new_function
 
+# the free variables of the reason are bound by the quantifiers of the same letters
+# as the names of the bound variables do not matter, it is a single GENERALIZE over them
 def closing(target, reason):
     cursor = target
     free = {}
-    reason = proof_history[reason]
-    assert reason.is_proved()
-    for counter in reason.free:
+    for counter in proof_history[reason].free:
         free[counter % 52] = counter # 52 == number of alphabets, a-Z
-    bounds = []
-    closed = reason @ -1
+    variables = []
     while cursor.type_ == TYPE_ALL:
-        bounds.append(cursor.bound)
+        variables.append(New(free[cursor.bound.counter]))
         cursor = cursor.statement
-    for bound in reversed(bounds):
-        variable = New(free[bound.counter])
-        closed = All(variable, closed) @ (-1, GENERALIZE, -1)
-    for bound in bounds:
-        closed = closed.statement.substitute(closed.bound, bound) @ (-1, PUT, bound, -1)
-    for bound in reversed(bounds):
-        closed = All(bound, closed) @ (-1, GENERALIZE, -1)
-    return target @ (-1, TAUTOLOGY, -1)
+    return target.generalize(reason, *variables)
 
 CLOSING = 26
 callbacks[CLOSING] = closing
 
+if os.environ.get("MATH_UP_MEMORY"):
+    memory_profile.start()
+
 # membership
 clear()
 in_ = make_property("in")
@@ -1067,7 +4091,7 @@ def check_reflection(name, reflection):
     assert reflection.is_proved()
     assert reflection.type_ == TYPE_ALL
     bound = reflection.bound
-    assert hash(Node(TYPE_PROPERTY, name = name, children = [bound, bound])) == hash(reflection.statement)
+    assert Node(TYPE_PROPERTY, name = name, children = [bound, bound]).same(reflection.statement)
 
 # symmetry generic
 def check_symmetry(name, symmetry):
@@ -1077,7 +4101,7 @@ def check_symmetry(name, symmetry):
     A0 = symmetry.bound
     assert symmetry.statement.type_ == TYPE_ALL
     B0 = symmetry.statement.bound
-    assert hash(Node(TYPE_PROPERTY, name = name, children = [A0, B0]) >> Node(TYPE_PROPERTY, name = name, children = [B0, A0])) == hash(symmetry.statement.statement)
+    assert (Node(TYPE_PROPERTY, name = name, children = [A0, B0]) >> Node(TYPE_PROPERTY, name = name, children = [B0, A0])).same(symmetry.statement.statement)
 
 # transitivity generic
 def check_transitivity(name, transitivity):
@@ -1089,10 +4113,9 @@ def check_transitivity(name, transitivity):
     B0 = transitivity.statement.bound
     assert transitivity.statement.statement.type_ == TYPE_ALL
     C0 = transitivity.statement.statement.bound
-    assert hash((Node(TYPE_PROPERTY, name = name, children = [A0, B0]) & Node(TYPE_PROPERTY, name = name, children = [B0, C0])) >> Node(TYPE_PROPERTY, name = name, children = [A0, C0])) == hash(transitivity.statement.statement.statement)
+    assert ((Node(TYPE_PROPERTY, name = name, children = [A0, B0]) & Node(TYPE_PROPERTY, name = name, children = [B0, C0])) >> Node(TYPE_PROPERTY, name = name, children = [A0, C0])).same(transitivity.statement.statement.statement)
 
 # equivalence relation generic
-equivalence_relations = {}
 def register_equivalence(name, reflection, symmetry, transitivity):
     if isinstance(name, str):
         assert equivalence_relations.get(name) == None
@@ -1100,50 +4123,13 @@ def register_equivalence(name, reflection, symmetry, transitivity):
     check_symmetry(name, symmetry)
     check_transitivity(name, transitivity)
     equivalence_relations[name] = (reflection, symmetry, transitivity)
+    if Node.tracer != None:
+        Node.tracer.relation(name, reflection, symmetry, transitivity)
 
 register_equivalence("equal", "equality_reflection", "equality_symmetry", "equality_transitivity")
 
 def by_equivalence(target, *reasons):
-    assert target.type_ == TYPE_PROPERTY
-    name = target.name
-    reflection, symmetry, transitivity = equivalence_relations[name]
-    if not reasons:
-        return target @ (-2, BY_THEOREM, reflection)
-    else:
-        statements = []
-        for reason in reasons:
-            reason = proof_history[reason]
-            assert reason.is_proved()
-            assert reason.type_ == TYPE_PROPERTY
-            assert reason.name == name
-            statements.append(reason)
-        left = target.children[0]
-        cursor = left
-        marked = set()
-        for _ in range(0, len(statements)):
-            for index, reason in enumerate(statements):
-                if index in marked:
-                    continue
-                if hash(reason.children[0]) == hash(cursor):
-                    if len(marked) == 0:
-                        reason @ -2
-                    else:
-                        reason @ -3
-                        Node(TYPE_PROPERTY, name = name, children = [left, reason.children[1]]) @ (-2, PUT_THEOREM, transitivity, reason.children[0], -2, -3)
-                    cursor = reason.children[1]
-                    marked.add(index)
-                    break
-                elif hash(reason.children[1]) == hash(cursor):
-                    reason @ -3
-                    if len(marked) == 0:
-                        Node(TYPE_PROPERTY, name = name, children = [reason.children[1], reason.children[0]]) @ (-2, BY_THEOREM, symmetry, -3)
-                    else:
-                        Node(TYPE_PROPERTY, name = name, children = [reason.children[1], reason.children[0]]) @ (-3, BY_THEOREM, symmetry, -3)
-                        Node(TYPE_PROPERTY, name = name, children = [left, reason.children[0]]) @ (-2, PUT_THEOREM, transitivity, reason.children[1], -2, -3)
-                    cursor = reason.children[0]
-                    marked.add(index)
-                    break
-        return target @ (-2, TAUTOLOGY, -2)
+    return target.equivalence(*reasons)
 
 BY_EQUIVALENCE = 33
 callbacks[BY_EQUIVALENCE] = by_equivalence
@@ -1323,7 +4309,7 @@ with (Set(a) & Set(b) & Set(c) & Set(d)) @ 0:
                 ((d *in_* Pair(a, a)) == (d == a)) @ (61, BY_THEOREM, "element_of_singleton", 0)
                 (d == a) @ (62, TAUTOLOGY, 70, 61)
                 (c == d) @ (63, BY_EQUIVALENCE, 62, 24)
-                (Pair(c, c) == Pair(c, d)) @ (64, REPLACE, 20, 63)
+                (Pair(a, a) == Pair(c, d)) @ (64, REPLACE, 20, 63)
                 (Pair(a, a) == Pair(c, d)) @ (65, BY_EQUIVALENCE, 20, 64)
                 false @ (66, TAUTOLOGY, 65, 60)
             ((d == a) >> false) @ (67, DEDUCE)
@@ -2241,21 +5227,73 @@ with ((A *inc* B) & (B *inc* A)) @ 0:
 (((A *inc* B) & (B *inc* A)) >> (A == B)) @ (12, DEDUCE)
 All(A_, B_, ((A_ *inc* B_) & (B_ *inc* A_)) >> (A_ == B_)) @ ("bi-inclusion", CLOSING, 12)
 
-def induction(target, C0, C1, initial, iteration):
-    initial = proof_history[initial]
-    assert initial.is_proved()
-    initial @ -11
-    iteration = proof_history[iteration]
-    assert iteration.is_proved()
-    iteration @ -12
-    assert target.type_ == TYPE_ALL
-    n0 = target.bound
-    cursor = target.statement
-    assert cursor.type_ == TYPE_IMPLY
-    
-    def Prop(x):
-        return target.statement.conclusion.substitute(n0, x)
+# the schemas of the derived rules, proved once over a schematic property and instantiated by the later calls
+class SchemaCache:
+    def __init__(self):
+        self.schemas = {} # rule -> (schema, cited name -> theorem)
+        self.hits = 0
+        self.misses = 0
+
+    # off with Node.tracer or Node.confirm on, so that the steps are traced or confirmed one by one
+    @staticmethod
+    def active():
+        return Node.tracer == None and not Node.confirm
+
+    # the schema of the rule, or None
+    def get(self, rule):
+        if not SchemaCache.active():
+            return None
+        entry = self.schemas.get(rule)
+        if entry == None or any([dict.get(proof_history, name) is not theorem or not theorem.is_proved() for name, theorem in entry[1].items()]):
+            self.misses += 1
+            return None
+        for name in entry[1]:
+            proof_history[name] # cited by the call, as the steps would
+        self.hits += 1
+        return entry[0]
+
+    # prove the schema (premises >> conclusion) by the steps under the premises, assumed at the number
+    def prove(self, rule, schema, steps, number):
+        citations = proof_history.citations
+        proof_history.citations = set()
+        try:
+            with schema.assumption @ number:
+                steps()
+            schema @ (number, DEDUCE)
+        finally:
+            cited = proof_history.citations
+            proof_history.citations = citations | cited
+        self.schemas[rule] = (schema, dict([(name, dict.get(proof_history, name)) for name in cited]))
+
+    # the schema with every P(t) of the schematic property P replaced by the formula with t for the variable,
+    # or None if a variable of the formula would be bound by a quantifier of the schema
+    @staticmethod
+    def instance(schema, name, variable, formula):
+        if not (formula.free - set([variable.counter])).isdisjoint(schema.bounded) or not formula.bounded.isdisjoint(schema.bounded):
+            return None
+        substituted = {}
+        for node in schema.postorder():
+            if node.type_ == TYPE_PROPERTY and node.name == name:
+                substituted[id(node)] = formula.substitute(variable, node.children[0])
+            elif all([substituted[id(subnode)] is subnode for subnode in node.subnodes()]):
+                substituted[id(node)] = node
+            else:
+                arguments = {}
+                for key, value in node.arguments.items():
+                    if isinstance(value, list):
+                        arguments[key] = [substituted[id(element)] for element in value]
+                    elif isinstance(value, Node):
+                        arguments[key] = substituted[id(value)]
+                    else:
+                        arguments[key] = value
+                substituted[id(node)] = Node(node.type_, **arguments)
+        return substituted[id(schema)]
 
+schema_cache = SchemaCache()
+
+# the steps of INDUCTION, from Prop(Empty()) at -11 and All(n0, Prop(n0) >> Prop(Succ(n0))) at -12
+def induction_steps(target, C0, C1, Prop):
+    n0 = target.bound
     UniquelyExist(C0, All(x_, (x_ *in_* C0) == ((Set(x_) & ((x_ *in_* Naturals()) & Prop(x_)))))) @ (-13, DEFINE_CLASS, C0)
     All(x_, (x_ *in_* C1) == (Set(x_) & ((x_ *in_* Naturals()) & Prop(x_)))) @ (-16, LET, C1, -13)
 
@@ -2308,6 +5346,48 @@ def induction(target, C0, C1, initial, iteration):
     ((n0 *in_* Naturals()) >> Prop(n0)) @ (-51, DEDUCE)
     return target @ (-52, GENERALIZE, -51)
 
+def induction(target, C0, C1, initial, iteration):
+    initial = proof_history[initial]
+    assert initial.is_proved()
+    iteration = proof_history[iteration]
+    assert iteration.is_proved()
+    assert target.type_ == TYPE_ALL
+    n0 = target.bound
+    cursor = target.statement
+    assert cursor.type_ == TYPE_IMPLY
+
+    def Prop(x):
+        return cursor.conclusion.substitute(n0, x)
+
+    # the side conditions of the schema: C0 and C1 defined by the steps are new, n0 and x_ generalized by them are not assumed,
+    # and none of them but n0 is in Prop
+    counters = set([C0.counter, C1.counter, x_.counter])
+    if SchemaCache.active() and C0.is_fresh() and C1.is_fresh() and len(counters | set([n0.counter])) == 4 and n0.is_generalizable() and x_.is_generalizable() \
+        and counters.isdisjoint(cursor.conclusion.free | cursor.conclusion.bounded) and cursor.assumption.same(n0 *in_* Naturals()):
+        schema = schema_cache.get(INDUCTION)
+        proved = schema != None
+        if not proved:
+            P = make_property("induction:Prop")
+            schema = (P(Empty()) & All(n0, P(n0) >> P(Succ(n0)))) >> All(n0, (n0 *in_* Naturals()) >> P(n0))
+        instance = SchemaCache.instance(schema, "induction:Prop", n0, cursor.conclusion)
+        if instance != None and instance.same((initial & iteration) >> target):
+            if not proved:
+                def steps():
+                    P(Empty()) @ (-11, TAUTOLOGY, -53)
+                    All(n0, P(n0) >> P(Succ(n0))) @ (-12, TAUTOLOGY, -53)
+                    induction_steps(schema.conclusion, C0, C1, P)
+                schema_cache.prove(INDUCTION, schema, steps, -53)
+            # what the steps leave, as LET C1 does
+            Node.fresh.discard(C0.counter)
+            Node.fresh.discard(C1.counter)
+            Rollback.set(C1, "defined_by", UniquelyExist(C0, All(x_, (x_ *in_* C0) == ((Set(x_) & ((x_ *in_* Naturals()) & Prop(x_)))))))
+            Node.bounded[Node.level].add(C1.counter)
+            return target.accept()
+
+    initial @ -11
+    iteration @ -12
+    return induction_steps(target, C0, C1, Prop)
+
 INDUCTION = 40
 callbacks[INDUCTION] = induction
 
@@ -2319,3 +5399,7 @@ with Set(n) @ 1:
 (Set(n) >> Set(Succ(n))) @ (3, DEDUCE)
 All(n, Set(n) >> Set(Succ(n))) @ (5, GENERALIZE, 3)
 All(n, (n *in_* Naturals()) >> Set(n)) @ (4, INDUCTION, C, D, 0, 5)
+
+if memory_profile.active and os.environ.get("MATH_UP_MEMORY"):
+    sys.stderr.write(memory_profile.report())
+    memory_profile.stop()
@@ -0,0 +1,164 @@
+# author : Hyunwoo Yang <hyunsdo.yang@samsung.com>
+# project name : math_up
+# description : the benchmarks of math_up
+#
+# deep : the walks over the terms and the formulas a few hundred deep, i.e. under the recursion limit,
+# and the same walks of the other math_up.py files given, e.g. the revisions before and after the explicit stacks
+#   build : f(f(...f(x))), and the nested negations of P(x)
+#   substitute : x to y in the term
+#   str : the term as text
+#   interchangable : the term against the substituted one, under x = y
+#   tautology : P(x) from the nested negations
+# each is the best time of the rounds, interleaved over the modules
+#
+# pickle : the theorems of proof_history are pickled and loaded by
+#   node : Node.__reduce__, a row of each node with its digest, loaded through Node.__init__
+#   default : the __dict__ of every node, as pickle does without __reduce__
+#   pack : pack() and unpack(), which hash the nodes again on loading
+# each is the best time of the rounds, with the size of the data and the nodes left after loading
+#
+# usage : python math_up_bench.py deep [math_up.py files to compare]
+#         python math_up_bench.py pickle [rounds]
+
+import copyreg
+import gc
+import importlib.util
+import io
+import pickle
+import sys
+import time
+
+import math_up
+
+
+# the pickler of the nodes as plain objects, as without Node.__reduce__
+class DefaultPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, math_up.Node):
+            return (copyreg.__newobj__, (math_up.Node, ), obj.__dict__)
+        return NotImplemented
+
+def default_dumps(theorems):
+    output = io.BytesIO()
+    DefaultPickler(output, pickle.HIGHEST_PROTOCOL).dump(theorems)
+    return output.getvalue()
+
+def pack_dumps(theorems):
+    return pickle.dumps({name : math_up.pack(sentence) for name, sentence in theorems.items()}, pickle.HIGHEST_PROTOCOL)
+
+def pack_loads(data):
+    return {name : math_up.unpack(packed) for name, packed in pickle.loads(data).items()}
+
+def best(function, argument, rounds):
+    times = []
+    for round_ in range(rounds):
+        start = time.perf_counter()
+        result = function(argument)
+        times.append(time.perf_counter() - start)
+        if round_ < rounds - 1:
+            del result
+    return min(times), result
+
+# the distinct nodes under the sentences
+def count_nodes(theorems):
+    seen = set()
+    for sentence in theorems.values():
+        for node in sentence.postorder():
+            seen.add(id(node))
+    return len(seen)
+
+# the rows are timed round by round, so that a slow moment of the machine hits them all alike
+def run(rows, theorems, rounds):
+    times = {name : [[], []] for name, dumps, loads in rows}
+    for round_ in range(rounds):
+        for name, dumps, loads in rows:
+            dumps_time, data = best(dumps, theorems, 1)
+            loads_time, loaded = best(loads, data, 1)
+            times[name][0].append(dumps_time)
+            times[name][1].append(loads_time)
+            if round_ < rounds - 1:
+                del loaded
+            else:
+                assert all(loaded[key].digest == sentence.digest for key, sentence in theorems.items())
+                print("%-8s dumps %8.2f ms  loads %8.2f ms  %9d bytes  %6d nodes" % (name, min(times[name][0]) * 1000, min(times[name][1]) * 1000, len(data), count_nodes(loaded)))
+
+# the steps over the chains of the depth, in the module given
+def deep_steps(module, depth):
+    f = module.make_function("bench")
+    P = module.make_property("bench")
+    x, y = module.New(), module.New()
+    def build(depth):
+        term = x
+        for index in range(depth):
+            term = f(term)
+        sentence = P(x)
+        for index in range(2 * (depth // 2)):
+            sentence = ~sentence
+        return term, sentence
+    term, sentence = build(depth)
+    substituted = term.substitute(x, y)
+    def tautology(sentence):
+        with sentence @ 0:
+            P(x) @ (1, module.TAUTOLOGY, 0)
+    return [
+        ("build", build, depth),
+        ("substitute", lambda term : term.substitute(x, y), term),
+        ("str", str, term),
+        ("interchangable", lambda term : term.interchangable(substituted, x, y), term),
+        ("tautology", tautology, sentence),
+    ]
+
+# the modules are timed round by round like the pickle rows, with the garbage collector off,
+# as the libraries of the other modules loaded make its passes slower
+def run_deep(others, rounds = 50):
+    modules = [("this", math_up)]
+    for index, other in enumerate(others):
+        spec = importlib.util.spec_from_file_location("math_up_other%d" % index, other)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        modules.append((other, module))
+    for depth in [30, 100, 300, 600]:
+        print("depth %d" % depth)
+        steps = {}
+        for label, module in modules:
+            try:
+                steps[label] = deep_steps(module, depth)
+            except RecursionError:
+                steps[label] = None
+        times = {}
+        gc.collect()
+        gc.disable()
+        try:
+            for round_ in range(rounds):
+                for label, module in modules:
+                    if steps[label] == None:
+                        continue
+                    try:
+                        for name, step, argument in steps[label]:
+                            times[(label, name)] = min(times.get((label, name), 1e9), best(step, argument, 1)[0])
+                    except RecursionError:
+                        steps[label] = None
+        finally:
+            gc.enable()
+        for label, module in modules:
+            if steps[label] == None:
+                print("  %-16s RecursionError" % label[-16 : ])
+            else:
+                print("  %-16s %s" % (label[-16 : ], "  ".join(["%s %8.3f ms" % (name, times[(label, name)] * 1000) for name, step, argument in steps[label]])))
+
+def run_pickle(rounds):
+    theorems = {name : sentence for name, sentence in dict(math_up.proof_history).items() if isinstance(sentence, math_up.Node)}
+    print("%d theorems, %d nodes" % (len(theorems), count_nodes(theorems)))
+    run([
+        ("node", lambda theorems : pickle.dumps(theorems, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ("default", default_dumps, pickle.loads),
+        ("pack", pack_dumps, pack_loads),
+    ], theorems, rounds)
+
+if __name__ == "__main__":
+    kind = sys.argv[1] if len(sys.argv) > 1 else "pickle"
+    if kind == "deep":
+        run_deep(sys.argv[2 : ])
+    else:
+        assert kind == "pickle"
+        run_pickle(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
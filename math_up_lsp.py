@@ -0,0 +1,377 @@
+# author : Hyunwoo Yang <hyunsdo.yang@samsung.com>
+# project name : math_up
+# description : the language server of math_up, over the standard input and output
+#
+# every top-level statement of a proof file is a unit, checked in order by a worker process,
+# which forks a checkpoint, i.e. the state after the unit, after each unit saving a named theorem
+#
+# usage : python math_up_lsp.py
+# it needs fork(), so it runs only on POSIX systems
+
+import ast
+import asyncio
+import json
+import os
+import pickle
+import signal
+import socket
+import struct
+import sys
+import traceback
+import urllib.parse
+
+import math_up
+
+
+# the units of the source as (the first line, the text), where the statements sharing a line are a unit
+# the text of a unit is its whole lines, so that a unit is unchanged only if it is at the same lines
+def split_units(source):
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends = True)
+    spans = []
+    for statement in tree.body:
+        first = min([statement.lineno] + [decorator.lineno for decorator in getattr(statement, "decorator_list", [])])
+        if len(spans) > 0 and first <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], statement.end_lineno)
+        else:
+            spans.append([first, statement.end_lineno])
+    return [(first, "".join(lines[first - 1 : last])) for first, last in spans]
+
+# the ranges of the @ steps in the tree, as (first line, first column, last line, last column)
+def step_ranges(tree):
+    ranges = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.MatMult):
+            ranges.append((node.lineno, node.col_offset, node.end_lineno, node.end_col_offset))
+    return ranges
+
+def diagnostic(first_line, first_column, last_line, last_column, message):
+    return {
+        "range" : {
+            "start" : {"line" : first_line - 1, "character" : first_column},
+            "end" : {"line" : last_line - 1, "character" : last_column},
+        },
+        "severity" : 1,
+        "source" : "math_up",
+        "message" : message,
+    }
+
+# the diagnostic of the error, at the innermost step of the file on the line it was raised from
+# the message names the check of math_up which failed, if any
+def diagnose(error, path, ranges):
+    frames = traceback.extract_tb(error.__traceback__)
+    line = None
+    for frame in frames:
+        if frame.filename == path:
+            line = frame.lineno
+    message = traceback.format_exception_only(type(error), error)[-1].strip()
+    if len(frames) > 0 and frames[-1].filename != path and frames[-1].line:
+        message += " (" + frames[-1].name + " : " + frames[-1].line + ")"
+    if line == None:
+        return diagnostic(1, 0, 1, 0, message)
+    steps = [step for step in ranges if step[0] <= line <= step[2]]
+    if len(steps) == 0:
+        return diagnostic(line, 0, line + 1, 0, message)
+    return diagnostic(*min(steps, key = lambda step : step[2] - step[0]), message)
+
+# the commands to a checkpoint, each as the length and the pickle
+def write_command(writer, command):
+    data = pickle.dumps(command)
+    data = struct.pack(">I", len(data)) + data
+    while len(data) > 0:
+        data = data[os.write(writer, data) : ]
+
+def read_exactly(reader, size):
+    data = b""
+    while len(data) < size:
+        chunk = os.read(reader, size - len(data))
+        if chunk == b"":
+            return None
+        data += chunk
+    return data
+
+def read_command(reader):
+    header = read_exactly(reader, 4)
+    if header == None:
+        return None
+    data = read_exactly(reader, struct.unpack(">I", header)[0])
+    if data == None:
+        return None
+    return pickle.loads(data)
+
+# a process checking the units of a file, or waiting as a checkpoint
+# the messages to the server are the datagrams of the channel, each a pickle of (kind, generation, pid, ...)
+class Worker:
+    def __init__(self, channel, path):
+        self.channel = channel
+        self.path = path
+        self.namespace = {"__name__" : "__main__", "__file__" : path, "__builtins__" : __builtins__}
+        self.count = 0 # units checked
+
+    def send(self, message, fds = []):
+        socket.send_fds(self.channel, [pickle.dumps(message)], fds)
+
+    # wait for the commands, each forking a worker to check the units after the state
+    # the end of the commands means the server is gone
+    def checkpoint(self, generation):
+        reader, writer = os.pipe()
+        self.send(("checkpoint", generation, os.getpid(), self.count), [writer])
+        os.close(writer)
+        while True:
+            command = read_command(reader)
+            if command == None:
+                os._exit(0)
+            generation, units = command
+            if os.fork() == 0:
+                os.close(reader)
+                try:
+                    self.run(generation, units)
+                finally:
+                    os._exit(0)
+
+    def run(self, generation, units):
+        self.send(("started", generation, os.getpid()))
+        for first, text in units:
+            saved = len(math_up.proof_history.dependencies)
+            diagnostics = self.check(first, text)
+            self.count += 1
+            self.send(("checked", generation, os.getpid(), self.count - 1, diagnostics))
+            if len(diagnostics) == 0 and len(math_up.proof_history.dependencies) != saved:
+                if os.fork() == 0:
+                    self.checkpoint(generation)
+        self.send(("done", generation, os.getpid()))
+
+    # the diagnostics of a unit, at its lines of the file
+    def check(self, first, text):
+        tree = ast.parse(text, self.path)
+        ast.increment_lineno(tree, first - 1)
+        try:
+            exec(compile(tree, self.path, "exec"), self.namespace)
+        except Exception as error:
+            return [diagnose(error, self.path, step_ranges(tree))]
+        return []
+
+# the process forking the root worker of each session, with the socket given for its channel
+# the requests are the datagrams of the channel, each a pickle of the path with the socket,
+# and the end of the requests means the server is gone
+class Forker:
+    def __init__(self):
+        self.channel, channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                self.channel.close()
+                null = os.open(os.devnull, os.O_RDWR)
+                os.dup2(null, 0)
+                os.dup2(null, 1)
+                signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+                self.serve(channel)
+            finally:
+                os._exit(0)
+        channel.close()
+
+    def serve(self, channel):
+        while True:
+            data, fds, flags, address = socket.recv_fds(channel, 1 << 20, 1)
+            if data == b"":
+                return
+            if os.fork() == 0:
+                channel.close()
+                Worker(socket.socket(fileno = fds[0]), pickle.loads(data)).checkpoint(0)
+                os._exit(0)
+            os.close(fds[0])
+
+    # the channel to the root worker checking the file of the path
+    def open(self, path):
+        channel, other = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        socket.send_fds(self.channel, [pickle.dumps(path)], [other.fileno()])
+        other.close()
+        return channel
+
+def kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+# an open file, with its workers
+# the messages of the older generations come from the workers of the older texts, which are killed then
+class Session:
+    def __init__(self, server, uri):
+        self.server = server
+        self.uri = uri
+        self.path = urllib.parse.unquote(urllib.parse.urlparse(uri).path)
+        self.units = []
+        self.generation = 0
+        self.checkpoints = {} # units checked -> (pid, writer of the commands)
+        self.runner = None
+        self.diagnostics = {} # unit -> diagnostics
+        self.failed = False # whether a unit failed in this generation
+        self.syntax = []
+        self.channel = server.forker.open(self.path)
+        self.receive()
+        self.channel.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.channel.fileno(), self.receive)
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.channel.fileno())
+        for pid, writer in self.checkpoints.values():
+            kill(pid)
+            os.close(writer)
+        if self.runner != None:
+            kill(self.runner)
+        self.channel.close()
+
+    def update(self, source):
+        try:
+            units = split_units(source)
+        except SyntaxError as error:
+            line = error.lineno or 1
+            self.syntax = [diagnostic(line, max((error.offset or 1) - 1, 0), line + 1, 0, "SyntaxError: " + str(error.msg))]
+            self.publish()
+            return
+        self.syntax = []
+        first = 0
+        while first < min(len(units), len(self.units)) and units[first] == self.units[first]:
+            first += 1
+        if first == len(units) == len(self.units):
+            if self.runner == None:
+                self.publish()
+            return
+        self.units = units
+        self.generation += 1
+        self.failed = False
+        if self.runner != None:
+            kill(self.runner)
+            self.runner = None
+        while True:
+            count = max([count for count in self.checkpoints if count <= first])
+            for later in [later for later in self.checkpoints if later > count]:
+                pid, writer = self.checkpoints.pop(later)
+                kill(pid)
+                os.close(writer)
+            for unit in [unit for unit in self.diagnostics if unit >= count]:
+                del self.diagnostics[unit]
+            try:
+                write_command(self.checkpoints[count][1], (self.generation, units[count : ]))
+                return
+            except BrokenPipeError:
+                os.close(self.checkpoints.pop(count)[1])
+                assert count > 0
+                first = count - 1
+
+    # the diagnostics are published at the first failure, and then when all the units are checked
+    def receive(self):
+        while True:
+            try:
+                data, fds, flags, address = socket.recv_fds(self.channel, 1 << 20, 1)
+            except BlockingIOError:
+                return
+            if data == b"":
+                asyncio.get_running_loop().remove_reader(self.channel.fileno())
+                return
+            message = pickle.loads(data)
+            kind, generation, pid = message[ : 3]
+            if generation != self.generation:
+                kill(pid)
+                for fd in fds:
+                    os.close(fd)
+                continue
+            if kind == "checkpoint":
+                self.checkpoints[message[3]] = (pid, fds[0])
+                if message[3] == 0:
+                    return
+            elif kind == "started":
+                self.runner = pid
+            elif kind == "checked":
+                self.diagnostics[message[3]] = message[4]
+                if len(message[4]) > 0 and not self.failed:
+                    self.failed = True
+                    self.publish()
+            elif kind == "done":
+                self.runner = None
+                self.publish()
+
+    def publish(self):
+        diagnostics = list(self.syntax)
+        for unit in sorted(self.diagnostics):
+            diagnostics += self.diagnostics[unit]
+        self.server.notify("textDocument/publishDiagnostics", {"uri" : self.uri, "diagnostics" : diagnostics})
+
+# the JSON-RPC messages over the standard input and output, each after its Content-Length header
+class Server:
+    def __init__(self, forker):
+        self.forker = forker
+        self.sessions = {} # uri -> Session
+        self.output = sys.stdout.buffer
+
+    def write(self, message):
+        body = json.dumps(message).encode()
+        self.output.write(b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        self.output.flush()
+
+    def notify(self, method, params):
+        self.write({"jsonrpc" : "2.0", "method" : method, "params" : params})
+
+    def respond(self, id_, result):
+        self.write({"jsonrpc" : "2.0", "id" : id_, "result" : result})
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda : asyncio.StreamReaderProtocol(reader), sys.stdin)
+        while True:
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line == b"":
+                    self.close()
+                    return
+                line = line.strip()
+                if line == b"":
+                    break
+                key, value = line.decode().split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+            message = json.loads(await reader.readexactly(int(headers["content-length"])))
+            if not self.handle(message.get("method"), message.get("params", {}), message.get("id")):
+                self.close()
+                return
+
+    # whether to go on
+    def handle(self, method, params, id_):
+        if method == "initialize":
+            self.respond(id_, {
+                "capabilities" : {"textDocumentSync" : {"openClose" : True, "change" : 1}},
+                "serverInfo" : {"name" : "math_up"},
+            })
+        elif method == "shutdown":
+            self.respond(id_, None)
+        elif method == "exit":
+            return False
+        elif method == "textDocument/didOpen":
+            document = params["textDocument"]
+            if self.sessions.get(document["uri"]) != None:
+                self.sessions[document["uri"]].close()
+            self.sessions[document["uri"]] = Session(self, document["uri"])
+            self.sessions[document["uri"]].update(document["text"])
+        elif method == "textDocument/didChange":
+            session = self.sessions.get(params["textDocument"]["uri"])
+            if session != None and len(params["contentChanges"]) > 0:
+                session.update(params["contentChanges"][-1]["text"])
+        elif method == "textDocument/didClose":
+            session = self.sessions.pop(params["textDocument"]["uri"], None)
+            if session != None:
+                session.close()
+                self.notify("textDocument/publishDiagnostics", {"uri" : session.uri, "diagnostics" : []})
+        elif id_ != None:
+            self.write({"jsonrpc" : "2.0", "id" : id_, "error" : {"code" : -32601, "message" : "unknown method " + str(method)}})
+        return True
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+
+if __name__ == "__main__":
+    forker = Forker()
+    asyncio.run(Server(forker).serve())
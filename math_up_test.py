@@ -0,0 +1,1045 @@
+# author : Hyunwoo Yang <hyunsdo.yang@samsung.com>
+# project name : math_up
+# description : the tests of math_up, over the library proved on import
+#
+# usage : python -m unittest math_up_test
+
+import ast
+import contextlib
+import io
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tracemalloc
+import unittest
+
+from math_up import *
+import math_up_lsp
+
+
+class CongruenceTest(unittest.TestCase):
+    # rewriting a = b under All(a, ...) would capture the bound a
+    def test_no_capture_under_binders(self):
+        a, b = New(), New()
+        (a == a) @ (0, BY_THEOREM, "equality_reflection")
+        All(a, a == a) @ (1, GENERALIZE, 0)
+        with (a == b) @ 2:
+            with self.assertRaises(AssertionError):
+                All(a, a == b) @ (3, CONGRUENCE, 1)
+
+    def test_under_binders_without_capture(self):
+        a, b, P = New(), New(), make_property("congruence_test")
+        with All(x_, P(x_, a)) @ 0:
+            with (a == b) @ 1:
+                All(x_, P(x_, b)) @ (2, CONGRUENCE, 0)
+
+
+class ReplaceTest(unittest.TestCase):
+    def setUp(self):
+        self.P = make_property("replace_test")
+        self.a, self.b, self.c, self.d = New(), New(), New(), New()
+
+    def test_replace(self):
+        with self.P(self.c) @ 0:
+            with (self.c == self.d) @ 1:
+                self.P(self.d) @ (2, REPLACE, 0, 1)
+
+    # the variables a and b are not equal, whatever the equality
+    def test_distinct_variables(self):
+        with self.P(self.a) @ 0:
+            with (self.c == self.d) @ 1:
+                with self.assertRaises(AssertionError):
+                    self.P(self.b) @ (2, REPLACE, 0, 1)
+
+
+# the verdict is the same in the kernel and in the replay of its trace, whatever the names of the bound variables
+class InstantiatesTest(unittest.TestCase):
+    def setUp(self):
+        self.P = make_property("instantiates_test")
+        self.t, self.x, self.y, self.z = New(), New(), New(), New()
+
+    def found(self):
+        P, t, x, y, z = self.P, self.t, self.x, self.y, self.z
+        with All(z, P(t, z)) @ 0:
+            Exist(x, All(y, P(x, y))) @ (1, FOUND, t, 0)
+        with All(z, P(z, z)) @ 2:
+            with self.assertRaises(AssertionError):
+                Exist(x, All(y, P(x, y))) @ (3, FOUND, t, 2)
+
+    def test_renamed_bound(self):
+        self.found()
+
+    def test_renamed_bound_traced(self):
+        output = io.BytesIO()
+        Node.tracer = TraceWriter(output)
+        try:
+            self.found()
+        finally:
+            Node.tracer = None
+        TraceChecker(io.BytesIO(output.getvalue())).run()
+
+
+# the terms and the formulas 100,000 deep, far over the recursion limit
+class DeepTest(unittest.TestCase):
+    depth = 100000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.f = make_function("deep_test")
+        cls.x, cls.y = New(), New()
+        cls.term = cls.x
+        for index in range(DeepTest.depth):
+            cls.term = cls.f(cls.term)
+
+    def test_substitute(self):
+        term = self.term.substitute(self.x, self.y)
+        self.assertEqual(term.size, DeepTest.depth + 1)
+        self.assertFalse(self.x.counter in term.free)
+        self.assertTrue(self.y.counter in term.free)
+
+    def test_str(self):
+        self.assertEqual(str(self.term).count("deep_test("), DeepTest.depth)
+
+    def test_pack(self):
+        self.assertEqual(unpack(pack(self.term)).size, DeepTest.depth + 1)
+
+    def test_pickle(self):
+        self.assertTrue(pickle.loads(pickle.dumps(self.term)).same(self.term))
+
+    # the variable bound outermost, under 2,000 quantifiers
+    def nested(self, P, b, swapped):
+        a = New()
+        sentence = P(b, a) if swapped else P(a, b)
+        for index in range(2000):
+            c = New()
+            sentence = Exist(c, P(c, c) & sentence)
+        return All(a, sentence)
+
+    def test_nested_binders(self):
+        P, b = make_property("deep_test"), New()
+        sentence = self.nested(P, b, False)
+        self.assertEqual(sentence.digest, self.nested(P, b, False).digest)
+        self.assertNotEqual(sentence.digest, self.nested(P, b, True).digest)
+
+    def test_tautology(self):
+        P = make_property("deep_test")
+        sentence = P(self.term)
+        for index in range(DeepTest.depth):
+            sentence = ~sentence
+        with sentence @ 0:
+            P(self.term) @ (1, TAUTOLOGY, 0)
+
+    def test_replace(self):
+        P = make_property("deep_test")
+        with (self.x == self.y) @ 0:
+            with P(self.term) @ 1:
+                P(self.term.substitute(self.x, self.y)) @ (2, REPLACE, 1, 0)
+
+
+class RollbackTest(unittest.TestCase):
+    # INDUCTION stopped by the budget leaves C0 and C1 fresh, so the step can be tried again
+    def test_retry_induction(self):
+        self.retry_induction()
+
+    # the trace has the steps of the second INDUCTION only, and the block left by an error is closed in it
+    def test_retry_induction_traced(self):
+        output = io.BytesIO()
+        Node.tracer = TraceWriter(output)
+        try:
+            target = self.retry_induction()
+            with self.assertRaises(AssertionError):
+                with Set(Empty()) @ 6:
+                    Set(Empty()) @ (7, TAUTOLOGY)
+            (target >> target) @ (8, TAUTOLOGY)
+        finally:
+            Node.tracer = None
+        checker = TraceChecker(io.BytesIO(output.getvalue()))
+        checker.run()
+        self.assertTrue(checker.is_proved(target))
+        self.assertEqual(checker.level, 0)
+
+    def retry_induction(self):
+        n, C0, C1 = New(), New(), New()
+        Set(Empty()) @ (0, BY_THEOREM, "empty_is_set")
+        with Set(n) @ 1:
+            Set(Succ(n)) @ (2, BY_THEOREM, "successor_is_set", 1)
+        (Set(n) >> Set(Succ(n))) @ (3, DEDUCE)
+        All(n, Set(n) >> Set(Succ(n))) @ (5, GENERALIZE, 3)
+        last, numbered = Node.last, proof_history[5]
+        schema_cache.schemas.pop(INDUCTION, None)
+        budget.configure(step_nodes = 200)
+        try:
+            with self.assertRaises(BudgetExceeded):
+                All(n, (n *in_* Naturals()) >> Set(n)) @ (4, INDUCTION, C0, C1, 0, 5)
+        finally:
+            budget.configure(step_nodes = None)
+        self.assertTrue(C0.is_fresh() and C1.is_fresh())
+        self.assertTrue(Node.last is last and proof_history[5] is numbered)
+        target = All(n, (n *in_* Naturals()) >> Set(n)) @ (4, INDUCTION, C0, C1, 0, 5)
+        self.assertFalse(C0.is_fresh() or C1.is_fresh())
+        return target
+
+
+class SchemaCacheTest(unittest.TestCase):
+    # the premises of INDUCTION for Set, at 0 and 5
+    def premises(self):
+        n = New()
+        Set(Empty()) @ (0, BY_THEOREM, "empty_is_set")
+        with Set(n) @ 1:
+            Set(Succ(n)) @ (2, BY_THEOREM, "successor_is_set", 1)
+        (Set(n) >> Set(Succ(n))) @ (3, DEDUCE)
+        All(n, Set(n) >> Set(Succ(n))) @ (5, GENERALIZE, 3)
+        return n
+
+    # the second call, over other variables, instantiates the schema proved by the first
+    def test_hit(self):
+        n = self.premises()
+        All(n, (n *in_* Naturals()) >> Set(n)) @ (4, INDUCTION, New(), New(), 0, 5)
+        m, C0, C1 = self.premises(), New(), New()
+        hits = schema_cache.hits
+        target = All(m, (m *in_* Naturals()) >> Set(m)) @ (6, INDUCTION, C0, C1, 0, 5)
+        self.assertEqual(schema_cache.hits, hits + 1)
+        self.assertTrue(target.is_proved())
+        self.assertFalse(C0.is_fresh() or C1.is_fresh())
+
+    # a target the instance does not conclude falls back to the steps, which reject it
+    def test_wrong_target(self):
+        n = self.premises()
+        All(n, (n *in_* Naturals()) >> Set(n)) @ (4, INDUCTION, New(), New(), 0, 5)
+        hits = schema_cache.hits
+        target = All(n, (n *in_* Naturals()) >> Set(Succ(n)))
+        with self.assertRaises(AssertionError):
+            target @ (6, INDUCTION, New(), New(), 0, 5)
+        self.assertEqual(schema_cache.hits, hits + 1)
+        self.assertFalse(target.is_proved())
+
+    # the steps are traced instead of the schema, so the trace proves the target
+    def test_traced(self):
+        output = io.BytesIO()
+        Node.tracer = TraceWriter(output)
+        try:
+            n = self.premises()
+            target = All(n, (n *in_* Naturals()) >> Set(n)) @ (4, INDUCTION, New(), New(), 0, 5)
+        finally:
+            Node.tracer = None
+        checker = TraceChecker(io.BytesIO(output.getvalue()))
+        checker.run()
+        self.assertTrue(checker.is_proved(target))
+
+
+class DigestTest(unittest.TestCase):
+    # the digests of the library do not depend on the salt of str hashes, so another process gets the same ones
+    def test_stable_across_processes(self):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        script = "from math_up import *\nfor name, theorem in dict.items(proof_history):\n    if isinstance(name, str):\n        print(name, theorem.digest.hex())\n"
+        environment = dict(os.environ, PYTHONHASHSEED = "1234")
+        output = subprocess.run([sys.executable, "-c", script], cwd = directory, env = environment, capture_output = True, text = True, check = True).stdout
+        digests = dict([line.split() for line in output.splitlines()])
+        self.assertEqual(digests, dict([(name, theorem.digest.hex()) for name, theorem in dict.items(proof_history) if isinstance(name, str)]))
+
+    # the closed sentences differing only in the names of the bound variables are the same, confirmed or not
+    def test_closed(self):
+        P = make_property("digest_test")
+        x, y, a = New(), New(), New()
+        pairs = [
+            (All(x, P(x, a)), All(y, P(y, a)), True),
+            (All(x, Exist(y, P(x, y))), All(y, Exist(x, P(y, x))), True),
+            (All(x, Exist(y, P(x, y))), All(x, Exist(y, P(y, x))), False),
+            (All(x, P(x, a)), All(x, P(a, x)), False),
+        ]
+        confirm = Node.confirm
+        try:
+            for Node.confirm in [False, True]:
+                for A, B, same in pairs:
+                    self.assertEqual(A.same(B), same)
+                    self.assertEqual(A.digest == B.digest, same)
+                    self.assertEqual(hash(A) == hash(B), same)
+        finally:
+            Node.confirm = confirm
+
+    # a digest taken over by another node is caught only when confirmed
+    def test_confirm(self):
+        P = make_property("digest_test")
+        a, b = New(), New()
+        A, B = P(a), P(b)
+        B.digest = A.digest
+        confirm = Node.confirm
+        try:
+            Node.confirm = False
+            self.assertTrue(A.same(B))
+            Node.confirm = True
+            self.assertFalse(A.same(B))
+        finally:
+            Node.confirm = confirm
+
+
+class PremiseIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.P, self.Q, self.R = make_property("premise_test_p"), make_property("premise_test_q"), make_property("premise_test_r")
+        self.a, self.b = New(), New()
+
+    # the sentences sharing an atom with the target first, then those sharing an atom with them
+    def test_layers(self):
+        P, Q, R, a, b = self.P, self.Q, self.R, self.a, self.b
+        with R(b) @ 0:
+            with P(a) @ 1:
+                with (P(a) >> Q(a)) @ 2:
+                    layers = [[str(fact) for fact in layer] for layer in premise_index.layers(Q(a))]
+                    self.assertEqual(layers[ : 2], [[str(P(a) >> Q(a))], [str(P(a))]])
+                    self.assertFalse(any([str(R(b)) in layer for layer in layers]))
+                    self.assertTrue((Q(a) @ (3, AUTO_TAUTOLOGY)).is_proved())
+
+    def test_not_entailed(self):
+        P, Q, a, b = self.P, self.Q, self.a, self.b
+        with P(a) @ 0:
+            target = Q(a) | Q(b)
+            with self.assertRaises(AssertionError):
+                target @ (1, AUTO_TAUTOLOGY)
+            self.assertFalse(target.is_proved())
+
+    # the sentences of a block closed by a new one are out of scope
+    def test_out_of_scope(self):
+        P, Q, R, a, b = self.P, self.Q, self.R, self.a, self.b
+        with P(a) @ 0:
+            with (P(a) >> Q(a)) @ 1:
+                Q(a) @ (2, AUTO_TAUTOLOGY)
+        with R(b) @ 3:
+            target = Q(a)
+            with self.assertRaises(AssertionError):
+                target @ (4, AUTO_TAUTOLOGY)
+            self.assertFalse(target.is_proved())
+
+
+class InstantiatorTest(unittest.TestCase):
+    def setUp(self):
+        self.P, self.Q = make_property("ematch_test_p"), make_property("ematch_test_q")
+        self.f = make_function("ematch_test_f")
+        self.x, self.a, self.b = New(), New(), New()
+
+    # the trigger P(x) matches P(a) in scope, but nothing about b
+    def test_by_instances(self):
+        P, Q, x, a, b = self.P, self.Q, self.x, self.a, self.b
+        with All(x, P(x) >> Q(x)) @ 0:
+            with P(a) @ 1:
+                self.assertTrue((Q(a) @ (2, BY_INSTANCES, 0)).is_proved())
+                target = Q(b)
+                with self.assertRaises(AssertionError):
+                    target @ (3, BY_INSTANCES, 0)
+                self.assertFalse(target.is_proved())
+
+    # each instance is one generation older than the terms matched, up to max_generation
+    def test_generations(self):
+        P, f, x, a = self.P, self.f, self.x, self.a
+        with All(x, P(x) >> P(f(x))) @ 0:
+            with P(a) @ 1:
+                self.assertEqual([len(instantiator.saturate(None, 0)) > 0 for count in range(3)], [True, True, False])
+                self.assertTrue((P(f(f(a))) @ (2, AUTO_TAUTOLOGY)).is_proved())
+                target = P(f(f(f(a))))
+                with self.assertRaises(AssertionError):
+                    target @ (3, AUTO_TAUTOLOGY)
+                self.assertFalse(target.is_proved())
+
+
+class PackerTest(unittest.TestCase):
+    def setUp(self):
+        self.P, self.Q = make_property("packer_test_p"), make_property("packer_test_q")
+        self.a = New()
+
+    def test_round_trip(self):
+        for name, theorem in dict.items(proof_history):
+            if isinstance(name, str):
+                loaded = unpack(pack(theorem))
+                self.assertEqual(loaded.digest, theorem.digest)
+                self.assertEqual(str(loaded), str(theorem))
+
+    # a subterm is written once, and referred to afterwards
+    def test_shared(self):
+        term = Pair(self.a, self.a)
+        self.assertEqual(len(pack(Pair(term, term))), 2 * len(pack(term)) - len(pack(self.a)))
+
+    def frames(self, data):
+        return list(ProofReader(io.BytesIO(data)).frames())
+
+    def framed(self, frames):
+        data = bytearray()
+        for frame in frames:
+            write_varint(data, len(frame))
+            data += frame
+        return bytes(data)
+
+    # the frames of the step, the block and the steps in it
+    def record(self):
+        P, Q, a = self.P, self.Q, self.a
+        output = io.BytesIO()
+        Node.recorder = ProofWriter(output)
+        try:
+            with P(a) @ 0:
+                (P(a) | Q(a)) @ (1, TAUTOLOGY, 0)
+            target = (Q(a) >> (P(a) >> (P(a) | Q(a)))) @ (2, TAUTOLOGY)
+        finally:
+            Node.recorder = None
+        data = output.getvalue()
+        self.assertEqual(self.framed(self.frames(data)), data)
+        return target, data
+
+    # the variables are renamed to new ones of the same letters
+    def test_read(self):
+        target, data = self.record()
+        ProofReader(io.BytesIO(data)).run()
+        self.assertTrue(proof_history[2].is_proved())
+        self.assertEqual(str(proof_history[2]), str(target))
+        self.assertNotEqual(proof_history[2].digest, target.digest)
+
+    # without the block, the step in it has no reason
+    def test_frame_dropped(self):
+        target, data = self.record()
+        frames = self.frames(data)
+        level = Node.level
+        reader = ProofReader(io.BytesIO(self.framed(frames[ : 1] + frames[2 : ])))
+        with self.assertRaises(AssertionError):
+            reader.run()
+        self.assertEqual(reader.entered, [])
+        self.assertEqual(Node.level, level)
+
+    def test_cut(self):
+        target, data = self.record()
+        with self.assertRaises(AssertionError):
+            ProofReader(io.BytesIO(data[ : -1])).run()
+
+
+class TruthTablePoolTest(unittest.TestCase):
+    # blocks of 8 rows, so that the small tables are in many ranges
+    def setUp(self):
+        self.block = TruthTablePool.block
+        TruthTablePool.block = 3
+        self.P = make_property("pool_test")
+        self.atoms = [self.P(New()) for index in range(7)]
+
+    def tearDown(self):
+        TruthTablePool.block = self.block
+
+    def sentence(self, generator, depth):
+        if depth == 0:
+            return generator.choice(self.atoms)
+        A, B = self.sentence(generator, depth - 1), self.sentence(generator, depth - 1)
+        return generator.choice([~A, A & B, A | B, A >> B])
+
+    # the pool, on a worker or more, answers as the search does, with a counterexample when not entailed
+    def test_agrees_with_search(self):
+        generator = random.Random(0)
+        for workers in [1, 2]:
+            pool = TruthTablePool(0, workers, 4)
+            try:
+                answers = set()
+                for case in range(30):
+                    mapping = {}
+                    programs = Node.logical_programs([self.sentence(generator, 2) for index in range(3)], mapping)
+                    reasons, target = programs[ : -1], programs[-1]
+                    entailed = pool.entailed(reasons, target, len(mapping))
+                    self.assertEqual(entailed, Node.search(reasons, target, len(mapping)))
+                    answers.add(entailed)
+                    if not entailed:
+                        self.assertTrue(all([Node.logical_run(reason, pool.counterexample) for reason in reasons]))
+                        self.assertFalse(Node.logical_run(target, pool.counterexample))
+                self.assertEqual(answers, {True, False})
+            finally:
+                pool.close()
+
+    # the tables left by the reductions, on the pool whatever their sizes
+    def test_tautology(self):
+        a, b, c = self.atoms[ : 3]
+        threshold, workers = truth_table_pool.threshold, truth_table_pool.workers
+        truth_table_pool.configure(0, 2)
+        try:
+            self.assertTrue(((((a >> b) & (b >> c)) >> (a >> c)) @ (0, TAUTOLOGY)).is_proved())
+            target = ((a >> b) & (b >> c)) >> (c >> a)
+            with self.assertRaises(AssertionError):
+                target @ (1, TAUTOLOGY)
+            self.assertFalse(target.is_proved())
+            self.assertIsInstance(truth_table_pool.counterexample, list)
+        finally:
+            truth_table_pool.configure(threshold, workers)
+            truth_table_pool.close()
+
+
+class ReductionTest(unittest.TestCase):
+    def setUp(self):
+        self.P = make_property("reduction_test")
+        self.atoms = [self.P(New()) for index in range(6)]
+        self.a, self.b, self.c = self.atoms[ : 3]
+
+    def sentence(self, generator, depth):
+        if depth == 0:
+            return generator.choice(self.atoms)
+        A, B = self.sentence(generator, depth - 1), self.sentence(generator, depth - 1)
+        return generator.choice([~A, A & B, A | B, A >> B])
+
+    # the programs, and the truth assignment indexed by the atoms
+    def programs(self, sentences):
+        mapping = {}
+        programs = Node.logical_programs(sentences, mapping)
+        return programs, [None] * len(mapping), mapping
+
+    def test_propagate(self):
+        a, b, c = self.a, self.b, self.c
+        programs, truth_assign, mapping = self.programs([a, a >> b, b >> (c | a)])
+        self.assertTrue(Node.propagate(programs, truth_assign))
+        self.assertEqual([truth_assign[mapping[atom.digest]] for atom in [a, b, c]], [True, True, None])
+        programs, truth_assign, mapping = self.programs([a >> b, a, ~b])
+        self.assertFalse(Node.propagate(programs, truth_assign))
+
+    # the atoms of both polarities, or in the programs already true, are not pure
+    def test_pure_atoms(self):
+        a, b, c = self.a, self.b, self.c
+        programs, truth_assign, mapping = self.programs([a | ~b, b >> c, c | ~a])
+        self.assertEqual(Node.pure_atoms(programs, truth_assign), {mapping[b.digest] : False, mapping[c.digest] : True})
+        truth_assign[mapping[b.digest]] = False
+        self.assertEqual(Node.pure_atoms(programs, truth_assign), {mapping[a.digest] : False, mapping[c.digest] : True})
+
+    # the reductions keep the answers of the whole table
+    def test_agrees_with_table(self):
+        generator = random.Random(1)
+        answers = set()
+        for case in range(200):
+            sentences = [self.sentence(generator, 2) for index in range(3)]
+            mapping = {}
+            programs = Node.logical_programs(sentences, mapping)
+            entailed = Node.search(programs[ : -1], programs[-1], len(mapping))
+            self.assertEqual(entailed, Node.table_search(programs[ : -1], programs[-1], len(mapping)))
+            answers.add(entailed)
+        self.assertEqual(answers, {True, False})
+
+
+class MatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.f, self.g = make_function("matcher_test_f"), make_function("matcher_test_g")
+        self.x, self.y, self.a, self.b = New(), New(), New(), New()
+        self.counters = {self.x.counter, self.y.counter}
+
+    def test_bind(self):
+        f, g, x, y, a, b = self.f, self.g, self.x, self.y, self.a, self.b
+        matcher = Matcher(f(x, g(y)), self.counters)
+        mapping = {}
+        self.assertTrue(matcher.run(f(a, g(Pair(a, b))), mapping))
+        self.assertEqual(mapping, {x.counter : a, y.counter : Pair(a, b)})
+        self.assertFalse(matcher.run(f(a, f(b, b)), {}))
+        repeated = Matcher(f(x, x), self.counters)
+        self.assertTrue(repeated.run(f(g(a), g(a)), {}))
+        self.assertFalse(repeated.run(f(g(a), g(b)), {}))
+
+    # the head and the size reject before the program runs
+    def test_quick_reject(self):
+        f, g, x, y, a = self.f, self.g, self.x, self.y, self.a
+        matcher = Matcher(f(g(x), y), self.counters)
+        for target in [g(g(a), a), f(g(a), a, a), f(a, a), Set(a)]:
+            mapping = {}
+            self.assertFalse(matcher.run(target, mapping))
+            self.assertEqual(mapping, {})
+
+    # the matchers of the theorems answer as try_match over the other theorems
+    def test_agrees_with_try_match(self):
+        theorems = [theorem for name, theorem in dict.items(proof_history) if isinstance(name, str)][ : 80]
+        matched = 0
+        for theorem in theorems:
+            counters = set()
+            cursor = theorem
+            while cursor.type_ == TYPE_ALL:
+                counters.add(cursor.bound.counter)
+                cursor = cursor.statement
+            pattern = cursor.conclusion if cursor.type_ == TYPE_IMPLY else cursor
+            matcher = Matcher(pattern, counters)
+            for other in theorems:
+                other = other.statement if other.type_ == TYPE_ALL else other
+                result = matcher.run(other, {})
+                self.assertEqual(result, try_match(pattern, other, counters, {}))
+                matched += result
+        self.assertTrue(matched > 0)
+
+    def test_by_theorem(self):
+        self.assertTrue((Set(Empty()) @ (0, BY_THEOREM, "empty_is_set")).is_proved())
+        target = Set(Naturals())
+        with self.assertRaises(AssertionError):
+            target @ (1, BY_THEOREM, "empty_is_set")
+        self.assertFalse(target.is_proved())
+
+
+class DefinitionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d, self.x = New(), New(), New(), New(), New()
+
+    # the unfolded form is made once for the atom, and folded back
+    def test_unfold_fold(self):
+        c, x = self.c, self.x
+        with Relation(c) @ 0:
+            hits = definition_index.hits
+            for save_as in [1, 2]:
+                unfolded = All(x, (x *in_* c) >> Arity2(x)) @ (save_as, UNFOLD, "relation", 0, 0)
+                self.assertTrue(unfolded.is_proved())
+            self.assertEqual(definition_index.hits, hits + 1)
+            self.assertTrue((Relation(c) @ (3, FOLD, "relation", 0, 1)).is_proved())
+
+    def test_wrong(self):
+        c, d, x = self.c, self.d, self.x
+        with Relation(c) @ 0:
+            All(x, (x *in_* c) >> Arity2(x)) @ (1, UNFOLD, "relation", 0, 0)
+            for target, B in [
+                (All(x, (x *in_* d) >> Arity2(x)), (2, UNFOLD, "relation", 0, 0)), # another term
+                (Relation(c), (2, UNFOLD, "relation", 1, 0)), # no second atom
+                (Relation(d), (2, FOLD, "relation", 0, 1)), # another term
+                (Relation(c), (2, FOLD, "relation", 1, 1)), # no second instance
+                (Relation(c), (2, FOLD, "set", 0, 1)), # another definition
+            ]:
+                with self.assertRaises(AssertionError):
+                    target @ B
+                self.assertFalse(target.is_proved())
+
+    # a function is unfolded to the instance of its definition at the term
+    def test_function(self):
+        a, b, x = self.a, self.b, self.x
+        with Set(Pair(a, b)) @ 0:
+            target = (Set(a) & Set(b)) >> (Set(Pair(a, b)) & All(x, ((x *in_* Pair(a, b)) == ((x == a) | (x == b)))))
+            self.assertTrue((target @ (1, UNFOLD, "pair", 0, 0)).is_proved())
+            target = (Set(b) & Set(a)) >> (Set(Pair(b, a)) & All(x, ((x *in_* Pair(b, a)) == ((x == b) | (x == a)))))
+            with self.assertRaises(AssertionError):
+                target @ (2, UNFOLD, "pair", 0, 0)
+            self.assertFalse(target.is_proved())
+
+
+class MemoryProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = New(), New()
+
+    # the nodes of BY_INSTANCES are counted without those of the steps inside it,
+    # and the failed steps are counted too
+    def test_rules(self):
+        P, Q = make_property("memory_test_p"), make_property("memory_test_q")
+        x, a, b = New(), self.a, self.b
+        memory_profile.start(False)
+        try:
+            with All(x, P(x) >> Q(x)) @ 0:
+                with P(a) @ 1:
+                    Q(a) @ (2, BY_INSTANCES, 0)
+                    with self.assertRaises(AssertionError):
+                        Q(b) @ (3, BY_INSTANCES, 0)
+            sample = memory_profile.sample()
+            self.assertEqual(memory_profile.stack, [])
+        finally:
+            memory_profile.stop()
+        rules = sample["rules"]
+        self.assertEqual([rules[rule]["steps"] for rule in ["save", "BY_INSTANCES", "INSTANTIATE", "AUTO_TAUTOLOGY"]], [2, 2, 1, 2])
+        self.assertTrue(rules["BY_INSTANCES"]["nodes"] > 0)
+        self.assertEqual(sum([entry["nodes"] for entry in rules.values()]) + sample["outside"], sample["nodes"])
+        self.assertEqual(sample["traced"], {"current" : 0, "peak" : 0})
+        self.assertFalse(memory_profile.active)
+
+    def test_traced(self):
+        memory_profile.start()
+        try:
+            self.assertTrue(tracemalloc.is_tracing())
+            Set(Empty()) @ (0, BY_THEOREM, "empty_is_set")
+            self.assertIn("traced : ", memory_profile.report())
+        finally:
+            memory_profile.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_footprint(self):
+        a, b = self.a, self.b
+        term = Pair(a, Pair(a, b))
+        self.assertEqual(MemoryProfile.footprint([term, term], set()), MemoryProfile.footprint([term], set()))
+        counted = set()
+        MemoryProfile.footprint([Pair(a, b)], counted)
+        self.assertTrue(MemoryProfile.footprint([term], counted) < MemoryProfile.footprint([term], set()))
+        self.assertEqual(MemoryProfile.depth(term), 3)
+        self.assertEqual(MemoryProfile.histogram([0, 1, 2, 3, 4, 7, 8]), {1 : 2, 2 : 2, 4 : 2, 8 : 1})
+
+
+class FreshVariablesTest(unittest.TestCase):
+    # the counters are tracked only while their variables are alive
+    def test_bounded(self):
+        tracked = len(Node.fresh.freshness)
+        for index in range(10000):
+            New()
+        self.assertTrue(len(Node.fresh.freshness) <= tracked + 1)
+
+    def test_used(self):
+        a = New()
+        self.assertTrue(a.is_fresh())
+        with Set(a) @ 0:
+            self.assertFalse(a.is_fresh())
+            with self.assertRaises(KeyError):
+                Node.fresh.remove(a.counter)
+            Node.fresh.discard(a.counter)
+            self.assertFalse(a.is_fresh())
+
+    # a counter is fresh again when a variable is made of it after all its variables are gone
+    def test_revived(self):
+        fresh = FreshVariables()
+        freshness = fresh.add(5)
+        self.assertTrue(5 in fresh)
+        fresh.remove(5)
+        self.assertFalse(5 in fresh)
+        self.assertIs(fresh.add(5), freshness)
+        self.assertFalse(5 in fresh)
+        del freshness
+        self.assertEqual(len(fresh.freshness), 0)
+        freshness = fresh.add(5)
+        self.assertTrue(5 in fresh)
+        self.assertEqual(len(fresh), 1)
+
+
+class ReplaceAtTest(unittest.TestCase):
+    def setUp(self):
+        self.P, self.Q = make_property("replace_at_test_p"), make_property("replace_at_test_q")
+        self.f = make_function("replace_at_test_f")
+        self.x, self.y, self.a, self.c = New(), New(), New(), New()
+
+    def test_replace_at(self):
+        P, f, x, a, c = self.P, self.f, self.x, self.a, self.c
+        with P(x, a, a) @ 0:
+            with (a == f(c)) @ 1:
+                self.assertTrue((P(x, a, f(c)) @ (2, REPLACE_AT, [(2,)], 0, 1)).is_proved())
+                self.assertTrue((P(x, f(c), f(c)) @ (3, REPLACE_AT, [(1,), (2,)], 0, 1)).is_proved())
+
+    def test_wrong_paths(self):
+        P, f, x, a, c = self.P, self.f, self.x, self.a, self.c
+        with P(x, a, a) @ 0:
+            with (a == f(c)) @ 1:
+                for target, paths in [
+                    (P(x, a, f(c)), [(3,)]), # out of range
+                    (P(x, a, f(c)), [(-1,)]),
+                    (P(x, a, f(c)), [(1,)]), # another position
+                    (P(x, a, f(c)), [(2,), (2, 0)]), # one inside another
+                    (P(x, a, f(c)), []),
+                    (P(x, a, f(c), a), [(2,)]),
+                ]:
+                    with self.assertRaises(AssertionError):
+                        target @ (2, REPLACE_AT, paths, 0, 1)
+                    self.assertFalse(target.is_proved())
+
+    # the variables of the terms are not bound on the paths
+    def test_capture(self):
+        Q, y, a = self.Q, self.y, self.a
+        with All(y, Q(y, a)) @ 0:
+            with (a == y) @ 1:
+                target = All(y, Q(y, y))
+                with self.assertRaises(AssertionError):
+                    target @ (2, REPLACE_AT, [(1, 1)], 0, 1)
+                self.assertFalse(target.is_proved())
+
+    def test_traced(self):
+        P, f, x, a, c = self.P, self.f, self.x, self.a, self.c
+        output = io.BytesIO()
+        Node.tracer = TraceWriter(output)
+        try:
+            with P(x, a, a) @ 0:
+                with (a == f(c)) @ 1:
+                    target = P(x, f(c), a) @ (2, REPLACE_AT, [(1,)], 0, 1)
+        finally:
+            Node.tracer = None
+        checker = TraceChecker(io.BytesIO(output.getvalue()))
+        checker.run()
+        self.assertTrue(checker.is_proved(target))
+
+
+class FormatTest(unittest.TestCase):
+    # at most limit characters, and the whole text exactly when it fits
+    def test_limit(self):
+        sentence = proof_history["pair"]
+        for share in [False, True]:
+            whole = sentence.format(share)
+            for limit in [0, 2, 3, 4, 20, len(whole) - 1, len(whole), len(whole) + 1]:
+                text = sentence.format(share, limit)
+                self.assertTrue(len(text) <= limit)
+                self.assertEqual(text == whole, limit >= len(whole))
+                if limit >= 3 and text != whole:
+                    self.assertTrue(text.endswith("..."))
+
+    def test_share(self):
+        a = New()
+        term = Pair(Pair(a, a), Pair(a, a))
+        self.assertEqual(term.format(True).count("let "), 1)
+        self.assertEqual(term.format(True, 5), "le...")
+
+
+class TraceTest(unittest.TestCase):
+    def trace(self, writer):
+        output = io.BytesIO()
+        Node.tracer = writer(output)
+        try:
+            a, b, c = New(), New(), New()
+            with (a == b) @ 0:
+                with (b == c) @ 1:
+                    (a == c) @ (2, BY_EQUIVALENCE, 0, 1)
+        finally:
+            Node.tracer = None
+        return TraceChecker(io.BytesIO(output.getvalue()))
+
+    # the relations registered before the trace are recorded at its start, with their theorems as the premises
+    def test_relations_recorded(self):
+        checker = self.trace(TraceWriter)
+        checker.run()
+        self.assertEqual(len(checker.premises), 3)
+
+    def test_relations_not_recorded(self):
+        class Forgetful(TraceWriter):
+            def relation(self, *arguments):
+                pass
+        with self.assertRaises(AssertionError):
+            self.trace(Forgetful).run()
+
+
+class EquivalenceTest(unittest.TestCase):
+    # the links v[i] = v[i + 1] assumed at 100 + i, but the reversed ones, as v[i + 1] = v[i]
+    def chain(self, stack, count, reversed_ = []):
+        v = [New() for index in range(count + 1)]
+        for index in range(count):
+            link = (v[index + 1] == v[index]) if index in reversed_ else (v[index] == v[index + 1])
+            stack.enter_context(link @ (100 + index))
+        return v
+
+    def test_long_chain(self):
+        with contextlib.ExitStack() as stack:
+            v = self.chain(stack, 60, [30])
+            (v[0] == v[60]) @ (0, BY_EQUIVALENCE, *range(100, 160))
+            (v[60] == v[0]) @ (1, BY_EQUIVALENCE, *range(100, 160))
+            (v[20] == v[40]) @ (2, BY_EQUIVALENCE, *range(100, 160))
+
+    def test_broken_chain(self):
+        with contextlib.ExitStack() as stack:
+            v = self.chain(stack, 60)
+            with self.assertRaises(AssertionError):
+                (v[0] == v[60]) @ (0, BY_EQUIVALENCE, *[100 + index for index in range(60) if index != 30])
+
+    def test_unregistered(self):
+        R = make_property("equivalence_test")
+        a, b = New(), New()
+        with R(a, b) @ 100:
+            with self.assertRaises(AssertionError):
+                R(b, a) @ (0, BY_EQUIVALENCE, 100)
+            with self.assertRaises(AssertionError):
+                R(a, b) @ (1, BY_EQUIVALENCE, 100)
+
+
+class InstanceCacheTest(unittest.TestCase):
+    # the binding checked by the first step is the instance of the second
+    def test_instance_reused(self):
+        a, b = New(), New()
+        (a == a) @ (0, BY_THEOREM, "equality_reflection")
+        hits = instance_cache.hits
+        (a == a) @ (1, BY_THEOREM, "equality_reflection")
+        self.assertEqual(instance_cache.hits, hits + 1)
+        (b == b) @ (2, BY_THEOREM, "equality_reflection")
+        self.assertEqual(instance_cache.hits, hits + 1)
+
+    # dropping a name drops the instances of that name only
+    def test_invalidate_by_name(self):
+        a = New()
+        P = make_property("instance_cache_test")
+        (P(a) | ~P(a)) @ (0, TAUTOLOGY)
+        All(a, P(a) | ~P(a)) @ ("instance_cache_test", GENERALIZE, 0)
+        (P(a) | ~P(a)) @ (1, BY_THEOREM, "instance_cache_test")
+        (a == a) @ (2, BY_THEOREM, "equality_reflection")
+        self.assertTrue("instance_cache_test" in instance_cache.keys)
+        del proof_history["instance_cache_test"]
+        self.assertFalse("instance_cache_test" in instance_cache.keys)
+        hits = instance_cache.hits
+        (a == a) @ (3, BY_THEOREM, "equality_reflection")
+        self.assertEqual(instance_cache.hits, hits + 1)
+
+    # the least recently used instance is dropped, and its name with its last instance
+    def test_eviction(self):
+        cache = InstanceCache(2)
+        theorem = proof_history["equality_reflection"]
+        a, b, c = New(), New(), New()
+        for term in [a, b]:
+            cache.instance("equality_reflection", theorem, [term])
+        cache.instance("pair_is_set", proof_history["pair_is_set"], [a, b])
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get("equality_reflection", theorem, [a]), None)
+        self.assertTrue(cache.get("equality_reflection", theorem, [b]).same(b == b))
+        cache.instance("equality_reflection", theorem, [c])
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual(cache.get("pair_is_set", proof_history["pair_is_set"], [a, b]), None)
+        self.assertFalse("pair_is_set" in cache.keys)
+        self.assertEqual(len(cache.keys["equality_reflection"]), 2)
+        # another theorem under the name misses
+        self.assertEqual(cache.get("equality_reflection", proof_history["pair_is_set"], [b]), None)
+        self.assertEqual(len(cache.keys["equality_reflection"]), 1)
+
+    # the steps are checked again after their instances are dropped
+    def test_evicted_steps(self):
+        size = instance_cache.size
+        instance_cache.size = 1
+        try:
+            a, b = New(), New()
+            for save_as, term in enumerate([a, b, a]):
+                self.assertTrue(((term == term) @ (save_as, BY_THEOREM, "equality_reflection")).is_proved())
+            target = a == b
+            with self.assertRaises(AssertionError):
+                target @ (3, BY_THEOREM, "equality_reflection")
+            self.assertFalse(target.is_proved())
+        finally:
+            instance_cache.size = size
+
+
+class PickleTest(unittest.TestCase):
+    # a variable loaded of a counter alive shares its freshness, so the class defined stays defined
+    def test_loaded_variable_not_fresh(self):
+        A, C = New(), New()
+        UniquelyExist(C, All(x_, (x_ *in_* C) == (Set(x_) & (x_ *in_* A)))) @ (0, DEFINE_CLASS, C)
+        for load in [lambda sentence : pickle.loads(pickle.dumps(sentence)), lambda sentence : unpack(pack(sentence))]:
+            load(proof_history[0])
+            self.assertFalse(C.is_fresh())
+            with self.assertRaises(AssertionError):
+                UniquelyExist(C, All(x_, (x_ *in_* C) == (Set(x_) & ~(x_ *in_* A)))) @ (1, DEFINE_CLASS, C)
+
+    def test_round_trip(self):
+        theorem = proof_history["pair"]
+        loaded = pickle.loads(pickle.dumps(theorem))
+        self.assertTrue(loaded.same(theorem))
+        self.assertEqual(loaded.size, theorem.size)
+
+    # the rows are loaded through __init__, so a row breaking its checks is rejected
+    def test_rows_checked(self):
+        a, b, P = New(), New(), make_property("pickle_test")
+        row = lambda *arguments : type("Row", (), {"__reduce__" : lambda self : (Node.loaded, arguments)})()
+        with self.assertRaises(AssertionError):
+            pickle.loads(pickle.dumps(row(TYPE_ALL, bytes(16), None, a, P(b))))
+        Node.confirm = True
+        try:
+            with self.assertRaises(AssertionError):
+                pickle.loads(pickle.dumps(row(TYPE_NOT, bytes(16), None, P(a))))
+            self.assertTrue(pickle.loads(pickle.dumps(row(TYPE_NOT, (~P(a)).digest, None, P(a)))).same(~P(a)))
+        finally:
+            Node.confirm = False
+
+    # a node loaded again while the first one is alive is that one
+    def test_interned(self):
+        data = pickle.dumps(proof_history["pair"])
+        loaded = pickle.loads(data)
+        self.assertTrue(pickle.loads(data) is loaded)
+
+
+class TheoremStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = TheoremStore(":memory:")
+        self.P = make_property("store_test")
+
+    def tearDown(self):
+        self.store.close()
+
+    # the bound variables are new ones, so they never meet the variables alive
+    def test_lookup_renames(self):
+        a = New()
+        (self.P(a) >> self.P(a)) @ (0, TAUTOLOGY)
+        theorem = All(a, self.P(a) >> self.P(a)) @ ("store_test_renames", GENERALIZE, 0)
+        self.store.publish("store_test_renames")
+        loaded = self.store.lookup(theorem.digest)
+        self.assertTrue(loaded.is_proved())
+        self.assertNotEqual(loaded.bound.counter, a.counter)
+        self.assertEqual(loaded.bound.counter % 52, a.counter % 52)
+        self.assertTrue(New().counter > loaded.bound.counter)
+
+    def test_unpack_moves_the_counter(self):
+        variable = New(Node.counter + 1000)
+        unpack(pack(self.P(variable)))
+        made = New()
+        self.assertTrue(made.counter > variable.counter)
+
+    def test_publish_ground_only(self):
+        b = New()
+        closed = All(x_, self.P(x_))
+        with self.P(b) @ 0:
+            (closed >> closed) @ ("store_test_level", TAUTOLOGY)
+        with self.assertRaises(AssertionError):
+            self.store.publish("store_test_level")
+
+    # without names, the theorems proved in the closed blocks are left out
+    def test_publish_default_names(self):
+        closed = All(x_, self.P(x_))
+        with Set(Empty()) @ 100:
+            (closed >> closed) @ ("store_test_block", TAUTOLOGY)
+        names = self.store.publish()
+        self.assertFalse("store_test_block" in names)
+        self.assertTrue("comparison_of_ordered_pairs" in names)
+        self.assertEqual(self.store.names([proof_history["comparison_of_ordered_pairs"].digest]), ["comparison_of_ordered_pairs"])
+
+
+class LanguageServerTest(unittest.TestCase):
+    source = (
+        "from math_up import *\n"
+        "a = New(); P = make_property(\"lsp_test\")\n"
+        "(P(a) >> P(a)) @ (\"lsp_test\", TAUTOLOGY)\n"
+        "P(a) @ (0,\n"
+        "    TAUTOLOGY)\n"
+    )
+
+    # the statements sharing a line are a unit
+    def test_split_units(self):
+        units = math_up_lsp.split_units(LanguageServerTest.source)
+        self.assertEqual([first for first, text in units], [1, 2, 3, 4])
+        self.assertEqual(units[3][1], "P(a) @ (0,\n    TAUTOLOGY)\n")
+
+    def test_diagnose(self):
+        tree = ast.parse(LanguageServerTest.source)
+        try:
+            exec(compile(tree, "lsp_test.py", "exec"), {})
+        except AssertionError as error:
+            diagnostic = math_up_lsp.diagnose(error, "lsp_test.py", math_up_lsp.step_ranges(tree))
+        self.assertEqual(diagnostic["range"], {"start" : {"line" : 3, "character" : 0}, "end" : {"line" : 4, "character" : 14}})
+        self.assertTrue("tautology" in diagnostic["message"])
+
+    def send(self, message):
+        body = json.dumps(dict(message, jsonrpc = "2.0")).encode()
+        self.server.stdin.write(b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        self.server.stdin.flush()
+
+    def receive(self):
+        length = None
+        while True:
+            line = self.server.stdout.readline().strip()
+            if line == b"":
+                break
+            key, value = line.decode().split(":", 1)
+            if key.lower() == "content-length":
+                length = int(value)
+        return json.loads(self.server.stdout.read(length))
+
+    # the diagnostics published when all the units are checked
+    def published(self):
+        while True:
+            message = self.receive()
+            if message.get("method") == "textDocument/publishDiagnostics" and message["params"]["uri"] == self.uri:
+                return message["params"]["diagnostics"]
+
+    # an edit re-checks the units from the checkpoint after the named theorem
+    def test_server(self):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        self.server = subprocess.Popen([sys.executable, os.path.join(directory, "math_up_lsp.py")], cwd = directory, stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+        self.uri = "file:///lsp_test.py"
+        try:
+            self.send({"id" : 1, "method" : "initialize", "params" : {}})
+            self.assertEqual(self.receive()["result"]["serverInfo"]["name"], "math_up")
+            self.send({"method" : "textDocument/didOpen", "params" : {"textDocument" : {"uri" : self.uri, "text" : LanguageServerTest.source}}})
+            diagnostics = self.published()
+            self.assertEqual(len(diagnostics), 1)
+            self.assertEqual(diagnostics[0]["range"]["start"]["line"], 3)
+            fixed = LanguageServerTest.source.replace("P(a) @ (0,", "(P(a) >> P(a)) @ (0,")
+            self.send({"method" : "textDocument/didChange", "params" : {"textDocument" : {"uri" : self.uri}, "contentChanges" : [{"text" : fixed}]}})
+            while len(diagnostics) > 0:
+                diagnostics = self.published()
+            self.send({"id" : 2, "method" : "shutdown"})
+            self.assertEqual(self.receive()["id"], 2)
+            self.send({"method" : "exit"})
+            self.assertEqual(self.server.wait(10), 0)
+        finally:
+            self.server.kill()
+            self.server.stdin.close()
+            self.server.stdout.close()
+
+
+if __name__ == "__main__":
+    unittest.main()